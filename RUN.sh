@@ -7,4 +7,6 @@ else
     bport=5006
 fi
 
-python3 azure_usage/main.py --origin 0.0.0.0 --bport $bport 
+workers=${2:-1}
+
+python3 azure_usage/main.py --origin 0.0.0.0 --bport $bport --workers $workers
@@ -24,6 +24,14 @@ def setup():
         help="The origin of the websocket connections",
         default="127.0.0.1",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="The number of processes serving the Bokeh webapp (with "
+        "more than one, restart the server to load new data)",
+        type=int,
+        default=1,
+    )
 
     return parser.parse_args()
 
@@ -34,4 +42,4 @@ if __name__ == "__main__":
     ARGS = setup()
 
     # Running Bokeh server
-    bk_worker(ARGS.origin, ARGS.bport)
+    bk_worker(ARGS.origin, ARGS.bport, ARGS.workers)
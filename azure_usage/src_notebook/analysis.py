@@ -17,9 +17,20 @@ from ..src_webapp.constants import (
 
 from ..src_webapp.data_loader import create_dataframe
 
-from ..src_webapp.utilities import diff_month
-from ..src_webapp.totals import group_year_month, add_missing_year_months
-from ..src_webapp.subs import get_data_for_subid
+from ..src_webapp.totals import (
+    group_year_month,
+    group_sub_year_month,
+    add_missing_year_months,
+    get_year_month_range,
+)
+from ..src_webapp.subs import get_data_for_subid, SubscriptionNames
+from ..src_webapp.query import SubscriptionIndex
+from .budgets import (
+    get_calender_months,
+    get_period_months,
+    project_budgets,
+    create_projection_df,
+)
 
 # from src_webapp.constants import (
 #     CONST_COL_NAME_DATE,
@@ -33,9 +44,20 @@ from ..src_webapp.subs import get_data_for_subid
 
 # from src_webapp.data_loader import create_dataframe
 
-# from src_webapp.utilities import diff_month
-# from src_webapp.totals import group_year_month, add_missing_year_months
-# from src_webapp.subs import get_data_for_subid
+# from src_webapp.totals import (
+#     group_year_month,
+#     group_sub_year_month,
+#     add_missing_year_months,
+#     get_year_month_range,
+# )
+# from src_webapp.subs import get_data_for_subid, SubscriptionNames
+# from src_webapp.query import SubscriptionIndex
+# from budgets import (
+#     get_calender_months,
+#     get_period_months,
+#     project_budgets,
+#     create_projection_df,
+# )
 
 from dateutil.relativedelta import relativedelta
 
@@ -76,84 +98,23 @@ def create_cost_avail_ideal_df(
     if ea_budget.dt_to < date_from or ea_budget.dt_from > date_to:
         return None
 
-    budget_days = (ea_budget.dt_to - ea_budget.dt_from).days
-    budget_months = diff_month(ea_budget.dt_to, ea_budget.dt_from)
-
-    budget_avg_day = float(ea_budget.amount) / float(budget_days)
-    budget_avg_month = float(ea_budget.amount) / float(budget_months)
-
-    budget_left = ea_budget.amount - budget_spent
-
-    budget_days_left = max((ea_budget.dt_to - max_reg_cost_day).days, 0)
-    budget_months_left = max(
-        diff_month(
-            ea_budget.dt_to,
-            copy.copy(max_reg_cost_day).replace(day=1) - relativedelta(days=1),
-        ),
-        0,
+    period_months = get_period_months(
+        get_calender_months(date_from, date_to), date_from, date_to
     )
 
-    budget_left_avg_day = float(budget_left) / float(budget_days_left)
-    budget_left_avg_month = float(budget_left) / float(budget_months_left)
-
-    cur_date = copy.copy(date_from).replace(day=1)
-
-    year_month_list = []
-    ideal_list = []
-    avail_list = []
-
-    while cur_date <= date_to:
-
-        month_st = max(copy.copy(cur_date).replace(day=1), date_from)
-        month_end = min(
-            copy.copy(cur_date).replace(day=1)
-            + relativedelta(months=1)
-            - relativedelta(days=1),
-            date_to,
-        )
-
-        days_cnt = (month_end - month_st).days
-        year_month = "{year}-{month:02d}".format(
-            year=month_st.year, month=month_st.month
-        )
-
-        # Check if the month has passed
-        full_month = max_reg_cost_day >= month_end
-
-        if full_month:
-            if ea_budget.dt_from >= month_end:
-                monthly = 0.0
-            else:
-                if use_days:
-                    monthly = budget_avg_day * days_cnt
-                else:
-                    monthly = budget_avg_month
-
-            monthly_avail = None
-        else:
-            monthly = None
-
-            if month_end <= ea_budget.dt_to:
-                if use_days:
-                    monthly_avail = budget_left_avg_day * days_cnt
-                else:
-                    monthly_avail = budget_left_avg_month
-            else:
-                monthly_avail = 0.0
-
-        year_month_list.append(year_month)
-        ideal_list.append(monthly)
-        avail_list.append(monthly_avail)
-
-        cur_date += relativedelta(months=1)
-
-    d = {
-        CONST_COL_NAME_YM: year_month_list,
-        CONST_COL_NAME_IDEALCOST: ideal_list,
-        CONST_COL_NAME_AVAILCOST: avail_list,
-    }
+    ideal_costs, avail_costs = project_budgets(
+        period_months,
+        ea_budget.amount,
+        ea_budget.dt_from,
+        ea_budget.dt_to,
+        budget_spent,
+        max_reg_cost_day,
+        use_days=use_days,
+        count_current_month=True,
+        zero_before_start=True,
+    )
 
-    df = pd.DataFrame(data=d)
+    df = create_projection_df(period_months, ideal_costs[0], avail_costs[0])
 
     return df
 
@@ -307,87 +268,30 @@ def get_ideal_avail_spnsr_costs(
     )
 
     budget_spent = sub_raw_data_df[CONST_COL_NAME_COST].sum()
-    budget_left = spnsr_budget - budget_spent
-
-    # number of days/months within the analysis period
-    days_total = (date_to - date_from).days
 
-    months_total = diff_month(date_to, date_from)
-
-    if days_total <= 0:
+    if (date_to - date_from).days <= 0:
         return pd.DataFrame()
 
-    # average dayly/monthly allocated budget during the analysis period
-    day_avg_budget = float(spnsr_budget) / float(days_total)
-    month_avg_budget = float(spnsr_budget) / float(months_total)
-
-    # number of days/months left (no usage registered yet) during the
-    # analysis period
-    days_left = max((date_to - max_reg_cost_day).days, 0)
-    months_left = max(diff_month(date_to, max_reg_cost_day), 0)
-
-    # average dayly/monthly left available for the analysis period
-    day_left_avg_budget = float(budget_left) / float(days_left)
-    month_left_avg_budget = float(budget_left) / float(months_left)
-
-    # Iterates through the months of the analysis period and estinates ideal
-    # and available costs. Ideal costs is the spnsr_budget equally distributed
-    # over the months of the analysis period. Available costs are unspent
-    # budget distributed equally over the future months (months withough
+    # Estimates ideal and available costs for the months of the analysis
+    # period. Ideal costs is the spnsr_budget equally distributed over the
+    # months of the analysis period. Available costs are unspent budget
+    # distributed equally over the future months (months withough
     # registered usage)
+    period_months = get_period_months(
+        get_year_month_range(date_from, date_to), date_from, date_to
+    )
 
-    year_month_list = []
-    ideal_cost_list = []
-    avail_cost_list = []
-
-    cur_date = date_from
-
-    while cur_date < date_to:
-
-        month_st = max(copy.copy(cur_date).replace(day=1), date_from)
-        month_end = min(
-            copy.copy(cur_date).replace(day=1)
-            + relativedelta(months=1)
-            - relativedelta(days=1),
-            date_to,
-        )
-
-        days_cnt = (month_end - month_st).days
-        year_month = "{year}-{month:02d}".format(
-            year=month_st.year, month=month_st.month
-        )
-
-        # Check if the month has passed
-        full_month = max_reg_cost_day >= month_end
-
-        if full_month:
-            if use_days:
-                ideal_cost = days_cnt * day_avg_budget
-            else:
-                ideal_cost = month_avg_budget
-
-            avail_cost = None
-        else:
-            if use_days:
-                avail_cost = days_cnt * day_left_avg_budget
-            else:
-                avail_cost = month_left_avg_budget
-
-            ideal_cost = None
-
-        year_month_list.append(year_month)
-        ideal_cost_list.append(ideal_cost)
-        avail_cost_list.append(avail_cost)
-
-        cur_date += relativedelta(months=1)
-
-    d = {
-        CONST_COL_NAME_YM: year_month_list,
-        CONST_COL_NAME_IDEALCOST: ideal_cost_list,
-        CONST_COL_NAME_AVAILCOST: avail_cost_list,
-    }
+    ideal_costs, avail_costs = project_budgets(
+        period_months,
+        spnsr_budget,
+        date_from,
+        date_to,
+        budget_spent,
+        max_reg_cost_day,
+        use_days=use_days,
+    )
 
-    df = pd.DataFrame(data=d)
+    df = create_projection_df(period_months, ideal_costs[0], avail_costs[0])
 
     return df, max_reg_cost_day
 
@@ -397,8 +301,14 @@ def get_detailed_spnsr_analysis_df(data_path, date_from, date_to):
     # reading in the data
     data_df = create_dataframe(data_path)
 
+    # indexed once, for both the date range and the subscription names
+    sub_index = SubscriptionIndex(data_df)
+
     # applying data filters
-    df = data_df[(data_df.Date >= date_from) & (data_df.Date <= date_to)]
+    df = sub_index.get_rows(sub_index.sub_ids, date_from, date_to)
+
+    # names of the subscriptions over time
+    sub_names = SubscriptionNames(sub_index)
 
     # Getting DSG's data
     dsg_ids = get_DSGs_IDs()
@@ -446,8 +356,8 @@ def get_detailed_spnsr_analysis_df(data_path, date_from, date_to):
     excl_df = group_sub_year_month(get_data_excl_subid(df, exclude_list))
 
     excl_df.insert(0, CONST_COL_NAME_SUB, "")
-    excl_df[CONST_COL_NAME_SUB] = excl_df[CONST_COL_NAME_SGUID].apply(
-        lambda x: get_sub_latest_name(df, x)
+    excl_df[CONST_COL_NAME_SUB] = excl_df[CONST_COL_NAME_SGUID].map(
+        lambda x: get_sub_latest_name(sub_names, x, date_from, date_to)
     )
 
     final_df = pd.concat(
@@ -477,8 +387,8 @@ def get_detailed_spnsr_analysis_df(data_path, date_from, date_to):
     pivot_df = pd.DataFrame(result.to_records())
 
     pivot_df.insert(0, CONST_COL_NAME_SUB, "")
-    pivot_df[CONST_COL_NAME_SUB] = pivot_df[CONST_COL_NAME_SGUID].apply(
-        lambda x: get_sub_latest_name(df, x)
+    pivot_df[CONST_COL_NAME_SUB] = pivot_df[CONST_COL_NAME_SGUID].map(
+        lambda x: get_sub_latest_name(sub_names, x, date_from, date_to)
     )
 
     # Updating Subscription names and ids
@@ -619,53 +529,22 @@ def agg_subs_with_total_usage(df, total_from, total_to, sub_id, sub_name):
     return sub_ids, res_df
 
 
-def group_sub_year_month(raw_data):
-    """Groups raw usage by calender month and subscriptionid
-    Args:
-        raw_data: raw usage data framework
-    Returns:
-        raw_data_gr: dataframe of grouped raw usage by calender month
+def get_sub_latest_name(sub_names, sub_id, date_from=None, date_to=None):
     """
-
-    raw_data_ = raw_data.copy()
-    raw_data_[CONST_COL_NAME_YM] = pd.to_datetime(
-        raw_data_[CONST_COL_NAME_DATE]
-    ).apply(lambda x: "{year}-{month:02d}".format(year=x.year, month=x.month))
-
-    raw_data_gr = (
-        raw_data_.groupby([CONST_COL_NAME_SGUID, CONST_COL_NAME_YM])[
-            CONST_COL_NAME_COST
-        ]
-        .sum()
-        .reset_index()
-        .sort_values(by=[CONST_COL_NAME_YM], ascending=True)
-    )
-
-    return raw_data_gr
-
-
-def get_sub_latest_name(raw_data_df, sub_id):
-    """
-    Returns the latest subscription name from the raw data for a particular
-        subscription id
+    Returns the latest subscription name for a particular subscription id
 
     Args:
-        raw_data_df: raw usage data framework
+        sub_names: SubscriptionNames of the raw usage data
         sub_id: subscription id
+        date_from: first day of the analysis period, None for no limit
+        date_to: last day of the analysis period, None for no limit
     Returns:
-        subscription name
+        subscription name, NA if the subscription has no usage in the period
     """
 
-    raw_data_df_temp = raw_data_df[raw_data_df.SubscriptionGuid == sub_id]
+    sub_name = sub_names.get_latest_name(sub_id, date_from, date_to)
 
-    raw_sub_last_df = (
-        raw_data_df_temp[["SubscriptionGuid", "Date", "SubscriptionName"]]
-        .groupby(["SubscriptionGuid"])
-        .agg("max")
-        .reset_index()
-    )
-
-    try:
-        return str(raw_sub_last_df["SubscriptionName"][0])
-    except Exception:
+    if sub_name is None:
         return "NA"
+
+    return str(sub_name)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Python module to project budgets over the months of an analysis period.
+
+The ideal costs of a budget are its amount spread equally over its months
+(or days) and are shown for the months which have passed. The available
+costs are the budget left spread equally over the months (or days) left and
+are shown for the months still to come.
+
+The months of the period are computed once and the costs of all the
+budgets with array operations, so any number of budgets (e.g. hundreds of
+what-if amounts) are projected in one call.
+"""
+
+import numpy as np
+import pandas as pd
+
+from ..src_webapp.constants import (
+    CONST_COL_NAME_YM,
+    CONST_COL_NAME_IDEALCOST,
+    CONST_COL_NAME_AVAILCOST,
+)
+from ..src_webapp.totals import format_year_months
+
+# from src_webapp.constants import (
+#     CONST_COL_NAME_YM,
+#     CONST_COL_NAME_IDEALCOST,
+#     CONST_COL_NAME_AVAILCOST,
+# )
+# from src_webapp.totals import format_year_months
+
+ONE_DAY = np.timedelta64(1, "D")
+
+
+def _to_datetimes(dates):
+    """Converts a date or an array of dates to datetime64[ns]"""
+
+    return np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]")
+
+
+def _diff_months(dates_to, dates_from):
+    """Counts the months between dates, as utilities.diff_month does"""
+
+    return (
+        dates_to.astype("datetime64[M]") - dates_from.astype("datetime64[M]")
+    ).astype(np.int64)
+
+
+def get_calender_months(date_from, date_to):
+    """
+    Returns all the calender months from the month of date_from to the
+        month of date_to
+
+    Args:
+        date_from - first date
+        date_to - last date
+    Returns:
+        datetime64[M] array of the months
+    """
+
+    return np.arange(
+        _to_datetimes(date_from).astype("datetime64[M]"),
+        _to_datetimes(date_to).astype("datetime64[M]") + 1,
+    )
+
+
+def get_period_months(months, period_from, period_to):
+    """
+    Computes the boundaries of the months of an analysis period.
+
+    Args:
+        months - datetime64[M] array of the months of the period
+        period_from - analysis period start date
+        period_to - analysis period end date, the last month ends on it
+    Returns:
+        dataframe with the Year-Month of each month, its first (start) and
+        last (end) dates within the period and the days between them
+    """
+
+    months = np.asarray(months, dtype="datetime64[M]")
+
+    month_starts = np.maximum(
+        months.astype("datetime64[ns]"), _to_datetimes(period_from)
+    )
+    month_ends = np.minimum(
+        (months + 1).astype("datetime64[ns]") - ONE_DAY,
+        _to_datetimes(period_to),
+    )
+
+    return pd.DataFrame(
+        {
+            CONST_COL_NAME_YM: format_year_months(month_starts),
+            "start": month_starts,
+            "end": month_ends,
+            "days": (month_ends - month_starts) // ONE_DAY,
+        }
+    )
+
+
+def project_budgets(
+    period_months,
+    amounts,
+    budgets_from,
+    budgets_to,
+    spent,
+    max_reg_cost_day,
+    use_days=False,
+    count_current_month=False,
+    zero_before_start=False,
+):
+    """
+    Projects budgets over the months of an analysis period.
+
+    A month has passed when max_reg_cost_day is on or after its end. Passed
+    months get the ideal cost, i.e. the amount divided by the number of
+    months (days) of the budget, and the months to come get the available
+    cost, i.e. the amount not spent divided by the number of months (days)
+    left. Months ending after the budget has ended get no available cost.
+
+    The arguments of the budgets are numbers, dates or arrays of them, and
+    are broadcast against each other.
+
+    Args:
+        period_months - dataframe returned by get_period_months
+        amounts - amounts of the budgets
+        budgets_from - start dates of the budgets
+        budgets_to - end dates of the budgets
+        spent - costs spent from the budgets
+        max_reg_cost_day - the present (max date with registered usage)
+        use_days - a flag to use days for estimation, otherwise months
+        count_current_month - whether the month of max_reg_cost_day is
+            counted as a month left (EA budgets) or not (sponsorship)
+        zero_before_start - whether passed months ending before a budget
+            starts get no ideal cost (EA budgets)
+    Returns:
+        ideal_costs - (budgets, months) array of the ideal costs, nan for
+            the months to come
+        avail_costs - (budgets, months) array of the available costs, nan
+            for the passed months
+    """
+
+    amounts, spent = np.broadcast_arrays(
+        np.asarray(amounts, dtype=np.float64),
+        np.asarray(spent, dtype=np.float64),
+    )
+    budgets_from, budgets_to, max_reg_cost_day = np.broadcast_arrays(
+        _to_datetimes(budgets_from),
+        _to_datetimes(budgets_to),
+        _to_datetimes(max_reg_cost_day),
+    )
+
+    shape = np.broadcast(amounts, budgets_from).shape
+
+    # one row per budget
+    amounts = np.broadcast_to(amounts, shape).reshape(-1, 1)
+    spent = np.broadcast_to(spent, shape).reshape(-1, 1)
+    budgets_from = np.broadcast_to(budgets_from, shape).reshape(-1, 1)
+    budgets_to = np.broadcast_to(budgets_to, shape).reshape(-1, 1)
+    max_reg_cost_day = np.broadcast_to(max_reg_cost_day, shape).reshape(-1, 1)
+
+    # one column per month
+    month_ends = period_months["end"].values.reshape(1, -1)
+    month_days = period_months["days"].values.reshape(1, -1)
+
+    budget_days = (budgets_to - budgets_from) // ONE_DAY
+    budget_months = _diff_months(budgets_to, budgets_from)
+
+    days_left = np.maximum((budgets_to - max_reg_cost_day) // ONE_DAY, 0)
+    months_left = np.maximum(
+        _diff_months(budgets_to, max_reg_cost_day) + int(count_current_month),
+        0,
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if use_days:
+            ideal = amounts / budget_days * month_days
+            avail = (amounts - spent) / days_left * month_days
+        else:
+            ideal = amounts / budget_months + np.zeros(month_ends.shape)
+            avail = (amounts - spent) / months_left + np.zeros(
+                month_ends.shape
+            )
+
+    passed = max_reg_cost_day >= month_ends
+
+    if zero_before_start:
+        ideal = np.where(budgets_from >= month_ends, 0.0, ideal)
+
+    avail = np.where(month_ends <= budgets_to, avail, 0.0)
+
+    ideal_costs = np.where(passed, ideal, np.nan)
+    avail_costs = np.where(passed, np.nan, avail)
+
+    return ideal_costs, avail_costs
+
+
+def create_projection_df(period_months, ideal_costs, avail_costs):
+    """
+    Creates a dataframe with the ideal and available costs of a budget (or
+        of the sum of budgets)
+
+    Args:
+        period_months - dataframe returned by get_period_months
+        ideal_costs - ideal costs of the months
+        avail_costs - available costs of the months
+    Returns:
+        dataframe with the Year-Month, ideal and available costs
+    """
+
+    return pd.DataFrame(
+        {
+            CONST_COL_NAME_YM: period_months[CONST_COL_NAME_YM].values,
+            CONST_COL_NAME_IDEALCOST: ideal_costs,
+            CONST_COL_NAME_AVAILCOST: avail_costs,
+        }
+    )
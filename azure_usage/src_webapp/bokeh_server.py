@@ -4,6 +4,9 @@ Main bokeh server module
 
 import os
 from math import pi
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 
 # Bokeh imports
@@ -12,9 +15,13 @@ from bokeh.layouts import row, column, layout
 from bokeh.models import (
     ColumnDataSource,
     DatetimeTickFormatter,
+    HoverTool,
+    DataRange1d,
+    LinearAxis,
 )
 from bokeh.palettes import Category20c
 from bokeh.transform import cumsum
+from bokeh.protocol import Protocol
 from bokeh.models.widgets import (
     TextInput,
     DataTable,
@@ -35,7 +42,6 @@ from .constants import (
     CONST_COL_NAME_ANGLE,
     CONST_COL_NAME_PERC,
     CONST_COL_NAME_DATE,
-    DATA_FOLDER,
     README_FILE,
     UPDATES_FILE,
     URL_PARAM_REPORT,
@@ -47,60 +53,51 @@ from .constants import (
     CONST_RB_LABEL_1,
     CONST_RB_LABEL_2,
     CONST_RB_LABEL_3,
+    CONST_RB_VALUES,
     CONST_ENCODING,
     DEFAULT_REPORT_NAME,
-    TIMESTAMP_FILE,
     DEFAULT_TIMEZONE,
+    CONST_QUERY_WORKERS,
+    CONST_UPDATE_DEBOUNCE,
+    CONST_QUERY_CACHE_SIZE,
+    CONST_QUERY_CACHE_MEMORY,
+    CONST_COL_NAME_END,
+    CONST_RESOLUTION_DAY,
+    CONST_RESOLUTION_WEEK,
+    CONST_RESOLUTION_MONTH,
+    CONST_COL_NAME_CUMULATIVE,
+    CONST_COL_NAME_ROLLING,
+    CONST_ROLLING_WINDOWS,
 )
 
-from .subs import get_data_for_subid, get_top_services, calc_top_services_perc
-
-from .totals import group_day
-from .utilities import prep_sub_ids, parse_url_params, read_timestamp
-from .data_loader import create_dataframe
-
-
-# Global variables
-GLOBAL_RAW_USAGE = None
-GLOBAL_LAST_UPDATE = None
-GLOBAL_SUB_RAW_USAGE = None
-GLOBAL_SUB_SERVICE_GRP = None
-
-GLOBAL_TOTAL_SOURCE = None
-
-GLOBAL_WIDGET_SUBID = TextInput()
-GLOBAL_DATE_PICKER_FROM = None
-GLOBAL_DATE_PICKER_TO = None
-GLOBAL_WIDGET_SUBSCRIPTION_NAMES = None
-GLOBAL_WIDGET_TOTAL_TEXT = None
-GLOBAL_WIDGET_TOP_SERVICES_RB = None
-
-GLOBAL_S1 = None
-GLOBAL_S2 = None
+from .subs import (
+    get_data_for_subid,
+    get_top_services,
+    calc_top_services_perc,
+    group_services,
+)
 
-GLOBAL_TOP_SERVICE_SOURCE = None
+from .totals import (
+    group_day,
+    group_period,
+    get_resolution,
+    add_running_totals,
+)
+from .query import slice_date_range
+from .query_cache import QueryCache
+from .utilities import prep_sub_ids, parse_url_params
+from .dataset import get_dataset, readin_data  # noqa: F401
 
 GLOBAL_PWD = os.path.dirname(os.path.realpath(__file__))
 
+# Executor shared by the sessions of a process to run their aggregations
+# outside of the IOLoop
+GLOBAL_QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=CONST_QUERY_WORKERS)
 
-def readin_data(data_path=None):
-    """Reads in raw Azure usage data.
-
-    Returns:
-        dataframe with the read in data
-    """
-
-    if data_path is None:
-        _data_path = os.path.join(
-            os.path.join(GLOBAL_PWD, "..", ".."), DATA_FOLDER
-        )
-    else:
-        _data_path = data_path
-
-    raw_usage = create_dataframe(_data_path)
-    last_update = read_timestamp(os.path.join(_data_path, TIMESTAMP_FILE))
-
-    return raw_usage, last_update
+# Results of the dashboard queries shared by the sessions of a process
+GLOBAL_QUERY_CACHE = QueryCache(
+    CONST_QUERY_CACHE_SIZE, CONST_QUERY_CACHE_MEMORY
+)
 
 
 def get_url_params(doc):
@@ -118,6 +115,34 @@ def get_url_params(doc):
     return parse_url_params(doc_args)
 
 
+def get_query_cache_metrics():
+    """Returns the counters of the query result cache of the process"""
+
+    return GLOBAL_QUERY_CACHE.metrics()
+
+
+def log_query_cache_metrics(session_context):
+    """
+    Prints the counters of the query result cache of the process. Called
+        when a session is closed.
+
+    Arguments:
+        session_context: context of the closed session (unused)
+    """
+
+    metrics = get_query_cache_metrics()
+
+    lookups = metrics["hits"] + metrics["misses"]
+
+    print(
+        "Query cache: {hits} hits, {misses} misses ({hit_rate:.0%}), "
+        "{evictions} evictions, {entries} entries, {bytes:,d} bytes".format(
+            hit_rate=metrics["hits"] / lookups if lookups else 0.0,
+            **metrics,
+        )
+    )
+
+
 def create_updates_tab():
     """
     Creates updates tab
@@ -172,13 +197,18 @@ def create_usage_bar_plot():
         tools="pan, reset, save, wheel_zoom, crosshair, hover",
         x_axis_type="datetime",
         tooltips=[
-            (CONST_COL_NAME_DATE, "@Date_str"),
+            (CONST_COL_NAME_DATE, "@Date{%F}"),
             (CONST_COL_NAME_COST, "@Cost{$0.2f}"),
         ],
         min_border_bottom=75,
         min_border_left=70,
     )
 
+    # dates are sent as numbers and formatted by the browser
+    bar_plot.select_one(HoverTool).formatters = {
+        "@" + CONST_COL_NAME_DATE: "datetime"
+    }
+
     bar_plot.xaxis.formatter = DatetimeTickFormatter(
         hours=["%d %B %Y"],
         days=["%d %B %Y"],
@@ -192,6 +222,57 @@ def create_usage_bar_plot():
     return bar_plot
 
 
+def create_running_totals_plot(x_range):
+    """
+    Creates a line plot to show the cumulative usage and the moving
+        average daily usage
+
+    Args:
+        x_range - range of the x axis, shared with the usage plot
+    """
+
+    tooltips = [(CONST_COL_NAME_DATE, "@End{%F}")]
+    for col in [CONST_COL_NAME_CUMULATIVE] + [
+        CONST_COL_NAME_ROLLING.format(window)
+        for window in CONST_ROLLING_WINDOWS
+    ]:
+        tooltips.append((col, "@{}{{$0.2f}}".format(col)))
+
+    line_plot = figure(
+        plot_height=300,
+        plot_width=1200,
+        title="",
+        tools="pan, reset, save, wheel_zoom, crosshair, hover",
+        x_axis_type="datetime",
+        x_range=x_range,
+        tooltips=tooltips,
+        min_border_bottom=75,
+        min_border_left=70,
+    )
+
+    line_plot.select_one(HoverTool).formatters = {
+        "@" + CONST_COL_NAME_END: "datetime"
+    }
+
+    # the cumulative usage is shown on its own axis on the right
+    line_plot.extra_y_ranges = {CONST_COL_NAME_CUMULATIVE: DataRange1d()}
+    line_plot.add_layout(
+        LinearAxis(y_range_name=CONST_COL_NAME_CUMULATIVE), "right"
+    )
+
+    line_plot.xaxis.formatter = DatetimeTickFormatter(
+        hours=["%d %B %Y"],
+        days=["%d %B %Y"],
+        months=["%d %B %Y"],
+        years=["%d %B %Y"],
+    )
+
+    line_plot.xaxis.major_label_orientation = pi / 4
+    line_plot.yaxis.major_label_text_font_size = "12pt"
+
+    return line_plot
+
+
 def create_top_services_pie_plot():
     """Creates top services pie plot"""
 
@@ -210,6 +291,151 @@ def create_top_services_pie_plot():
     return pie_plot
 
 
+def get_source_data(df):
+    """
+    Converts a dataframe to the data of a column data source.
+
+    Every column becomes a NumPy array of its own, so numeric and date
+    columns are sent to the browser as binary buffers and patching a source
+    never modifies the (possibly cached) dataframe. The index of the
+    dataframe is not sent.
+
+    Arguments:
+        df: dataframe to be shown
+
+    Returns:
+        a dictionary of column name to NumPy array
+    """
+
+    return {col: df[col].to_numpy(copy=True) for col in df.columns}
+
+
+def update_source(source, data):
+    """
+    Updates a column data source with as little data sent to the browser
+        as possible.
+
+    Rows which already are in the source are patched where their values
+    changed and new rows are streamed. The whole data is replaced when
+    the columns change, rows are removed or most of the values change
+    (binary buffers are smaller than the lists sent by patch and stream).
+
+    Arguments:
+        source: ColumnDataSource to be updated
+        data: the new data, a dictionary returned by get_source_data
+
+    Returns:
+        how the source was updated: "none", "patch", "stream", "patch+stream"
+        or "replace"
+    """
+
+    old_data = source.data
+
+    old_len = len(next(iter(old_data.values()), []))
+    new_len = len(next(iter(data.values()), []))
+
+    if set(old_data.keys()) != set(data.keys()) or new_len < old_len:
+        source.data = data
+        return "replace"
+
+    # the changed part of each column as a slice of the existing rows
+    patches = {}
+    patched_cnt = 0
+
+    for col, values in data.items():
+        changed = np.flatnonzero(np.asarray(old_data[col]) != values[:old_len])
+
+        if len(changed) > 0:
+            start, stop = int(changed[0]), int(changed[-1]) + 1
+            patches[col] = [(slice(start, stop), values[start:stop])]
+            patched_cnt += stop - start
+
+    streamed_cnt = (new_len - old_len) * len(data)
+
+    if patched_cnt + streamed_cnt > new_len * len(data) / 2:
+        source.data = data
+        return "replace"
+
+    kinds = []
+
+    if patches:
+        source.patch(patches)
+        kinds.append("patch")
+
+    if new_len > old_len:
+        source.stream({col: values[old_len:] for col, values in data.items()})
+        kinds.append("stream")
+
+    return "+".join(kinds) if kinds else "none"
+
+
+def get_top_services_plot_data(services, top_services_grp_md):
+    """
+    Prepares the top services of a grouping for the pie plot and the table
+
+    Args:
+        services - services grouped by group_services
+        top_services_grp_md - top services grouping
+    Returns:
+        top services dataframe with the angles and colors of the pie plot
+    """
+
+    top_services = get_top_services(
+        services, top_services_grp_md=top_services_grp_md
+    )
+
+    top_services_cnt = len(top_services)
+
+    if not services.empty and not top_services.empty:
+
+        top_services[CONST_COL_NAME_ANGLE] = (
+            top_services[CONST_COL_NAME_COST]
+            / top_services[CONST_COL_NAME_COST].sum()
+            * 2
+            * pi
+        )
+
+        if top_services_cnt > 2:
+            top_services["color"] = Category20c[top_services_cnt]
+        else:
+            top_services["color"] = Category20c[3][:top_services_cnt]
+    else:
+        # a single empty wedge, built as a new frame so that all the
+        # columns have the same length
+        top_services = top_services.reindex(range(1))
+        top_services[CONST_COL_NAME_ANGLE] = 0.0
+        top_services["color"] = Category20c[3][:1]
+
+    return top_services
+
+
+def get_patch_doc_size(events):
+    """
+    Returns the size of the message which sends document changes to the
+        browser.
+
+    Arguments:
+        events: document change events, as received by a callback
+            registered with Document.on_change
+
+    Returns:
+        size of the PATCH-DOC message in bytes, including binary buffers
+    """
+
+    if not events:
+        return 0
+
+    msg = Protocol().create("PATCH-DOC", events, use_buffers=True)
+
+    size = len(msg.header_json) + len(msg.metadata_json)
+    size += len(msg.content_json)
+
+    for header, payload in msg.buffers:
+        size += len(header) + len(payload)
+
+    return size
+
+
 # NO UNIT TESTS FOR ALL THE FOLLWING FUNCTIONS
 
 
@@ -220,416 +446,936 @@ def modify_doc(doc):
         doc: a bokeh document to which elements can be added.
 
     """
-    global GLOBAL_RAW_USAGE
-    global GLOBAL_LAST_UPDATE
 
     # get the url parameters
     url_params = get_url_params(doc)
 
-    # reads in the raw usage data
-    GLOBAL_RAW_USAGE, GLOBAL_LAST_UPDATE = readin_data()
+    # the raw usage data is loaded once per process and shared by sessions,
+    # widgets and data sources belong to the session
+    dashboard = UsageDashboard(get_dataset())
 
     # initialises data sources
-    initiliase_data_sources()
+    dashboard.initiliase_data_sources()
 
     # sets the layout of the webapp
-    _set_layout(doc, url_params)
+    dashboard.set_layout(doc, url_params)
 
     # plots the data
-    _update_data(doc, url_params)
+    dashboard.update_data()
 
     # changing title
     doc.title = DEFAULT_REPORT_NAME
 
+    # the use of the query cache is logged as the sessions close
+    doc.on_session_destroyed(log_query_cache_metrics)
 
-def initiliase_data_sources():
+
+class UsageDashboard:
     """
-    Initialises data sources
+    The state of a single Bokeh session: its widgets, plots and column data
+        sources.
+
+    The usage data is only referenced, never modified, so all the sessions
+    of a process share the same dataset.
+
+    Args:
+        dataset - UsageDataset to be served
     """
 
-    global GLOBAL_RAW_USAGE
-    global GLOBAL_SUB_RAW_USAGE
-    global GLOBAL_SUB_SERVICE_GRP
+    def __init__(self, dataset):
 
-    global GLOBAL_TOTAL_SOURCE
-    global GLOBAL_TOP_SERVICE_SOURCE
+        self.raw_usage = dataset.raw_usage
+        self.raw_index = dataset.raw_index
+        self.cube_index = dataset.cube_index
+        self.global_cube = dataset.global_cube
+        self.sub_names = dataset.sub_names
+        self.global_daily = dataset.global_daily
+        self.global_sorted = dataset.global_sorted
+        self.last_update = dataset.last_update
+        self.version = dataset.version
 
-    default_subid = ""
+        # results computed from an older dataset are no longer served
+        GLOBAL_QUERY_CACHE.set_version(self.version)
 
-    prep_sub_ids_list = prep_sub_ids(default_subid)
+        self.sub_raw_usage = None
+        self.sub_service_grp = None
 
-    GLOBAL_SUB_RAW_USAGE = get_data_for_subid(
-        GLOBAL_RAW_USAGE, prep_sub_ids_list
-    )
+        # daily usage of the selection and the (resolution, date window) of
+        # the bars plotted from it
+        self.daily_usage = None
+        self._plot_window = None
 
-    sub_raw_usage_grp = group_day(GLOBAL_SUB_RAW_USAGE, add_missing_days=True)
+        self.total_source = None
+        self.top_service_source = None
 
-    GLOBAL_TOTAL_SOURCE = ColumnDataSource(data=sub_raw_usage_grp)
+        self.widget_subid = None
+        self.date_picker_from = None
+        self.date_picker_to = None
+        self.widget_subscription_names = None
+        self.widget_total_text = None
+        self.widget_top_services_rb = None
 
-    # Generates a data frame of top services which costed more than min_cost,
-    #   rest of the costs added as Other
-    GLOBAL_SUB_SERVICE_GRP = get_top_services(GLOBAL_SUB_RAW_USAGE)
+        self.s1 = None
+        self.s2 = None
+        self.s3 = None
 
-    # calculate percentages for the top services
-    GLOBAL_SUB_SERVICE_GRP = calc_top_services_perc(GLOBAL_SUB_SERVICE_GRP)
+        self.doc = None
 
-    # set the data source object
-    GLOBAL_TOP_SERVICE_SOURCE = ColumnDataSource(data=GLOBAL_SUB_SERVICE_GRP)
+        # background updates: the number of requests made so far and the
+        # future of the latest one
+        self._request_cnt = 0
+        self._pending_update = None
 
+        # widget changes waiting to be coalesced into one update and the
+        # selection shown (or being computed) at the moment
+        self._scheduled_update = None
+        self._last_query = None
 
-def _update_data(*_):
-    """
-    Updates data
-    """
+        # zooming or panning of the usage plot waiting to be applied
+        self._scheduled_zoom = None
 
-    global GLOBAL_RAW_USAGE
-    global GLOBAL_TOTAL_SOURCE
-    global GLOBAL_TOP_SERVICE_SOURCE
+        # the updates of all the top services groupings of the selection
+        # shown, as a (selection, updates) tuple
+        self._selection_updates = None
 
-    global GLOBAL_WIDGET_SUBID
-    global GLOBAL_DATE_PICKER_FROM
-    global GLOBAL_DATE_PICKER_TO
-    global GLOBAL_WIDGET_SUBSCRIPTION_NAMES
-    global GLOBAL_WIDGET_TOTAL_TEXT
-    global GLOBAL_WIDGET_TOP_SERVICES_RB
+    def initiliase_data_sources(self):
+        """
+        Initialises data sources
+        """
 
-    all_mode = False
+        default_subid = ""
 
-    if GLOBAL_WIDGET_SUBID.value.upper() == "ALLMODE":
-        all_mode = True
-        new_sub_raw_usage = GLOBAL_RAW_USAGE.copy(deep=True)
-        prep_sub_ids_list = new_sub_raw_usage["SubscriptionGuid"].unique()
-    else:
-        prep_sub_ids_list = prep_sub_ids(GLOBAL_WIDGET_SUBID.value.upper())
-        new_sub_raw_usage = get_data_for_subid(
-            GLOBAL_RAW_USAGE, prep_sub_ids_list
+        prep_sub_ids_list = prep_sub_ids(default_subid)
+
+        # the plots are served from the pre-aggregated daily cube
+        self.sub_raw_usage = get_data_for_subid(
+            self.cube_index, prep_sub_ids_list
         )
 
-    # Adjusting date interval
-    if not new_sub_raw_usage.empty:
+        self.daily_usage = add_running_totals(
+            group_day(self.sub_raw_usage, add_missing_days=True)
+        )
 
-        date_st = pd.Timestamp(GLOBAL_DATE_PICKER_FROM.value)
-        date_end = pd.Timestamp(GLOBAL_DATE_PICKER_TO.value)
+        self.total_source = ColumnDataSource(
+            data=get_source_data(self.get_plot_data())
+        )
 
-        new_sub_raw_usage = new_sub_raw_usage.loc[
-            (new_sub_raw_usage.Date >= date_st)
-            & (new_sub_raw_usage.Date <= date_end)
-        ]
+        # Generates a data frame of top services which costed more than
+        #   min_cost, rest of the costs added as Other
+        self.sub_service_grp = get_top_services(self.sub_raw_usage)
 
-    # For each subscription get the most recently used name in the
-    # selected time period and show in UI
-    subscription_names = []
-    subscription_names_string = ""
-
-    if not all_mode:
-        for sub_id in prep_sub_ids_list:
-            single_sub_usage = new_sub_raw_usage[
-                (new_sub_raw_usage.SubscriptionGuid == sub_id)
-            ].sort_values(by=["Date"], ascending=False)
-            if single_sub_usage.empty:
-                pass
-            else:
-                subscription_name = single_sub_usage.iloc[0].SubscriptionName
-                subscription_names.append(subscription_name)
+        # calculate percentages for the top services
+        self.sub_service_grp = calc_top_services_perc(self.sub_service_grp)
 
-        if subscription_names:
-            subscription_names_string = ", ".join(subscription_names)
+        # set the data source object
+        self.top_service_source = ColumnDataSource(
+            data=get_source_data(self.sub_service_grp)
+        )
+
+    def get_query(self):
+        """
+        Reads the current selection from the widgets
+
+        Returns:
+            a (subscription ids text, date from, date to, top services
+            grouping) tuple
+        """
 
-    if all_mode:
-        GLOBAL_WIDGET_SUBSCRIPTION_NAMES.text = (
-            "<b>{0} subscriptions selected</b>".format(len(prep_sub_ids_list))
+        return (
+            self.widget_subid.value.upper(),
+            pd.Timestamp(self.date_picker_from.value),
+            pd.Timestamp(self.date_picker_to.value),
+            self.widget_top_services_rb.active,
         )
-    else:
-        GLOBAL_WIDGET_SUBSCRIPTION_NAMES.text = (
-            "<b>{0} subscriptions selected:</b> {1}".format(
-                len(subscription_names), subscription_names_string
+
+    def get_selection_key(self, selection):
+        """
+        Normalises a selection, so that the selections of the same
+            subscriptions and dates compare equal (e.g. ids typed with
+            extra spaces)
+
+        Arguments:
+            selection: a (subscription ids text, date from, date to) tuple
+
+        Returns:
+            a (subscription ids, date from, date to) tuple
+        """
+
+        sub_ids_text, date_st, date_end = selection
+
+        if sub_ids_text == "ALLMODE":
+            sub_ids_key = sub_ids_text
+        else:
+            sub_ids_key = tuple(prep_sub_ids(sub_ids_text))
+
+        return (sub_ids_key, date_st, date_end)
+
+    def is_same_query(self, query, other):
+        """
+        Checks whether two queries returned by get_query select the same
+            data (other may be None)
+        """
+
+        if other is None or query[-1] != other[-1]:
+            return False
+
+        return self.get_selection_key(query[:-1]) == self.get_selection_key(
+            other[:-1]
+        )
+
+    def compute_update(self, query):
+        """
+        Returns the data for a selection, from the query cache if the same
+            selection has been made on the same dataset before. Only the
+            shared dataset is read, so this can run outside of the session's
+            IOLoop.
+
+        Arguments:
+            query: a selection returned by get_query
+
+        Returns:
+            a dictionary with the data and texts to be shown, which must not
+            be modified
+        """
+
+        return self.compute_selection(query[:-1])[query[-1]]
+
+    def compute_selection(self, selection):
+        """
+        Returns the data for a selection with all the top services
+            groupings, from the query cache if the same selection has been
+            made on the same dataset before.
+
+        Arguments:
+            selection: a (subscription ids text, date from, date to) tuple,
+                i.e. a query without the top services grouping
+
+        Returns:
+            a dictionary of the updates (see compute_update) by top services
+            grouping, which must not be modified
+        """
+
+        key = self.get_selection_key(selection) + (self.version,)
+
+        updates = GLOBAL_QUERY_CACHE.get(key)
+
+        if updates is None:
+            updates = self.aggregate_selection(selection)
+            GLOBAL_QUERY_CACHE.put(key, updates)
+
+        return updates
+
+    def aggregate_update(self, query):
+        """
+        Aggregates the data for a selection.
+
+        Arguments:
+            query: a selection returned by get_query
+
+        Returns:
+            a dictionary with the data and texts to be shown
+        """
+
+        return self.aggregate_selection(query[:-1])[query[-1]]
+
+    def aggregate_selection(self, selection):
+        """
+        Aggregates the data for a selection with all the top services
+            groupings. The usage is grouped by service once, at the finest
+            grain, and each grouping is rolled up from that.
+
+        Arguments:
+            selection: a (subscription ids text, date from, date to) tuple
+
+        Returns:
+            a dictionary of the updates (see aggregate_update) by top
+            services grouping
+        """
+
+        sub_ids_text, date_st, date_end = selection
+
+        all_mode = False
+
+        if sub_ids_text == "ALLMODE":
+            all_mode = True
+            prep_sub_ids_list = self.cube_index.sub_ids
+        else:
+            prep_sub_ids_list = prep_sub_ids(sub_ids_text)
+
+        if all_mode:
+            # all the subscriptions are served from their pre-aggregated
+            # usage, only the date interval is sliced out
+            new_sub_usage = slice_date_range(
+                self.global_cube, date_st, date_end, self.global_sorted
+            )
+            new_sub_daily_usage = slice_date_range(
+                self.global_daily, date_st, date_end, self.global_sorted
+            )
+        else:
+            # totals and top services are aggregated from the daily cube,
+            # the date interval is sliced out of each subscription's rows by
+            # binary search
+            new_sub_usage = self.cube_index.get_rows(
+                prep_sub_ids_list, date_st, date_end
+            )
+            new_sub_daily_usage = new_sub_usage
+
+        # For each subscription get the most recently used name in the
+        # selected time period and show in UI
+        subscription_names = []
+        subscription_names_string = ""
+
+        if not all_mode:
+            subscription_names = self.sub_names.get_latest_names(
+                prep_sub_ids_list, date_st, date_end
+            )
+
+            if subscription_names:
+                subscription_names_string = ", ".join(subscription_names)
+
+        if all_mode:
+            subscription_names_text = (
+                "<b>{0} subscriptions selected</b>".format(
+                    len(prep_sub_ids_list)
+                )
+            )
+        else:
+            subscription_names_text = (
+                "<b>{0} subscriptions selected:</b> {1}".format(
+                    len(subscription_names), subscription_names_string
+                )
             )
+
+        # TOTAL USAGE, with the running totals of the selection
+        new_sub_raw_usage_grp = add_running_totals(
+            group_day(new_sub_daily_usage, add_missing_days=True)
         )
 
-    # TOTAL USAGE
-    new_sub_raw_usage_grp = group_day(new_sub_raw_usage, add_missing_days=True)
+        # Ploting TOP SERVICES
+        services = group_services(new_sub_usage)
 
-    GLOBAL_TOTAL_SOURCE.data = dict(
-        ColumnDataSource(data=new_sub_raw_usage_grp).data
-    )
+        total_text = "Total usage: ${:,.2f}".format(
+            new_sub_raw_usage_grp[CONST_COL_NAME_COST].sum()
+        )
 
-    # Ploting TOP SERVICES
-    new_sub_service_grp = get_top_services(
-        new_sub_raw_usage,
-        top_services_grp_md=GLOBAL_WIDGET_TOP_SERVICES_RB.active,
-    )
+        return {
+            top_services_grp_md: {
+                "subscription_names": subscription_names_text,
+                "total_usage": new_sub_raw_usage_grp,
+                "top_services": get_top_services_plot_data(
+                    services, top_services_grp_md
+                ),
+                "total_text": total_text,
+            }
+            for top_services_grp_md in CONST_RB_VALUES
+        }
+
+    def apply_update(self, update):
+        """
+        Shows the result of compute_update in the session's widgets and
+            plots. Must run on the session's IOLoop.
+
+        Arguments:
+            update: a dictionary returned by compute_update
+        """
+
+        self.widget_subscription_names.text = update["subscription_names"]
+
+        self.daily_usage = update["total_usage"]
+
+        # only the changes are sent to the browser, the bars are kept at
+        # the resolution of the range the plot is zoomed to
+        update_source(
+            self.total_source,
+            get_source_data(self.get_plot_data(self.get_visible_range())),
+        )
 
-    new_sub_service_grp_cnt = len(new_sub_service_grp)
+        update_source(
+            self.top_service_source, get_source_data(update["top_services"])
+        )
 
-    if not new_sub_raw_usage.empty and not new_sub_service_grp.empty:
+        self.widget_total_text.text = update["total_text"]
 
-        new_sub_service_grp[CONST_COL_NAME_ANGLE] = (
-            new_sub_service_grp[CONST_COL_NAME_COST]
-            / new_sub_service_grp[CONST_COL_NAME_COST].sum()
-            * 2
-            * pi
+    def update_data(self, *_):
+        """
+        Updates data synchronously
+        """
+
+        self._last_query = self.get_query()
+
+        self.apply_selection(
+            self._last_query, self.compute_selection(self._last_query[:-1])
         )
 
-        if new_sub_service_grp_cnt > 2:
-            new_sub_service_grp["color"] = Category20c[new_sub_service_grp_cnt]
-        else:
-            new_sub_service_grp["color"] = Category20c[3][
-                :new_sub_service_grp_cnt
-            ]
-    else:
-        new_sub_service_grp[CONST_COL_NAME_ANGLE] = 0
-        new_sub_service_grp["color"] = Category20c[3][:1]
+    def apply_selection(self, query, updates):
+        """
+        Shows the update of a query and keeps the updates of the other top
+            services groupings of its selection for switch_top_services.
+            Must run on the session's IOLoop.
 
-    GLOBAL_TOP_SERVICE_SOURCE.data = dict(
-        ColumnDataSource(data=new_sub_service_grp).data
-    )
+        Arguments:
+            query: a selection returned by get_query
+            updates: a dictionary returned by compute_selection
+        """
 
-    GLOBAL_WIDGET_TOTAL_TEXT.text = "Total usage: ${:,.2f}".format(
-        new_sub_raw_usage_grp.sum()[CONST_COL_NAME_COST]
-    )
+        self._selection_updates = (query[:-1], updates)
 
+        self.apply_update(updates[query[-1]])
 
-def _create_analysis_tab(doc, url_params):
-    """
-    Creates analysis tab
+    def switch_top_services(self):
+        """
+        Shows the top services grouping chosen. The groupings of the
+            selection shown are switched right away, as they have been
+            computed with it, any other change is scheduled as usual.
+        """
 
-    Arguments:
-        doc: a bokeh document to which elements can be added.
-        url_params: url parameters passed with the url
-    """
+        query = self.get_query()
 
-    global GLOBAL_WIDGET_SUBID
-    global GLOBAL_DATE_PICKER_FROM
-    global GLOBAL_DATE_PICKER_TO
-    global GLOBAL_WIDGET_SUBSCRIPTION_NAMES
-    global GLOBAL_WIDGET_TOTAL_TEXT
-    global GLOBAL_WIDGET_TOP_SERVICES_RB
+        if self._selection_updates is None or self.get_selection_key(
+            self._selection_updates[0]
+        ) != self.get_selection_key(query[:-1]):
+            self.schedule_update()
+            return
 
-    global GLOBAL_S1
-    global GLOBAL_S2
+        # a request for another selection still being computed is superseded
+        if self._pending_update is not None:
+            self._request_cnt += 1
+            self._pending_update.cancel()
+            self._pending_update = None
 
-    global GLOBAL_RAW_USAGE
-    global GLOBAL_LAST_UPDATE
-    global GLOBAL_SUB_RAW_USAGE
+        self._last_query = query
 
-    widget_input_text = Div(
-        text=url_params[URL_PARAM_REPORT],
-        style={"font-size": "200%", "color": "black"},
-    )
+        self.apply_update(self._selection_updates[1][query[-1]])
 
-    if GLOBAL_LAST_UPDATE is not None:
-        last_update_text = Div(
-            text="Last updated: {}".format(
-                GLOBAL_LAST_UPDATE.tz_convert(DEFAULT_TIMEZONE).strftime(
-                    "%B %d, %Y, %R (%Z)"
-                )
-            ),
-            style={"font-size": "125%", "color": "black"},
+    def schedule_update(self):
+        """
+        Schedules an update after a widget change. Changes made within
+            CONST_UPDATE_DEBOUNCE ms of each other (e.g. typing or setting
+            both dates) restart the wait and are coalesced into one update.
+        """
+
+        if self._scheduled_update is not None:
+            self.doc.remove_timeout_callback(self._scheduled_update)
+
+        self._scheduled_update = self.doc.add_timeout_callback(
+            self._run_scheduled_update, CONST_UPDATE_DEBOUNCE
         )
-    else:
-        last_update_text = Div(text="Last updated:")
 
-    GLOBAL_WIDGET_SUBID = TextInput(
-        title="Subscription IDs (comma separated)",
-        value=url_params[URL_PARAM_SUB_IDS],
-        css_classes=["customTextInput"],
-    )
+    def _run_scheduled_update(self):
+        """Requests an update unless the selection has not changed"""
 
-    if not url_params[URL_PARAM_DT_FROM]:
-        if not GLOBAL_SUB_RAW_USAGE.empty:
-            date_min = GLOBAL_SUB_RAW_USAGE.Date.min().date()
-        elif not GLOBAL_RAW_USAGE.empty:
-            date_min = GLOBAL_RAW_USAGE.Date.min().date()
-        else:
-            date_min = pd.to_datetime("2016-01-01").date()
-    else:
-        date_min = url_params[URL_PARAM_DT_FROM].date()
+        self._scheduled_update = None
 
-    if not url_params[URL_PARAM_DT_TO]:
-        if not GLOBAL_SUB_RAW_USAGE.empty:
-            date_max = GLOBAL_SUB_RAW_USAGE.Date.min().date()
-        elif not GLOBAL_RAW_USAGE.empty:
-            date_max = GLOBAL_RAW_USAGE.Date.max().date()
-        else:
-            date_max = pd.to_datetime("2021-12-31").date()
-    else:
-        date_max = url_params[URL_PARAM_DT_TO].date()
+        if self.is_same_query(self.get_query(), self._last_query):
+            return
 
-    GLOBAL_DATE_PICKER_FROM = DatePicker(value=date_min, title="Date from")
-    GLOBAL_DATE_PICKER_TO = DatePicker(value=date_max, title="Date to")
+        self.request_update()
 
-    GLOBAL_WIDGET_SUBSCRIPTION_NAMES = Div(
-        text="", style={"font-size": "100%", "color": "black"}
-    )
+    def request_update(self):
+        """
+        Updates data in the background: the aggregations run on the query
+            executor and the result is applied on the next tick of the
+            session's IOLoop. A request superseded by a newer one (e.g. while
+            the user is still typing) is cancelled if it has not started
+            yet, and its result is discarded otherwise.
+        """
 
-    widget_usage_text = Div(
-        text="Usage ($):", style={"font-size": "150%", "color": "black"}
-    )
+        self._request_cnt += 1
+        request_id = self._request_cnt
 
-    GLOBAL_S1 = create_usage_bar_plot()
+        if self._pending_update is not None:
+            self._pending_update.cancel()
 
-    GLOBAL_WIDGET_TOTAL_TEXT = Div(
-        text="Total usage: ${:,.2f}".format(0),
-        style={"font-size": "200%", "color": "blue"},
-    )
+        self._last_query = self.get_query()
 
-    widget_top_services_text = Div(
-        text="Top services:", style={"font-size": "150%", "color": "black"}
-    )
+        future = GLOBAL_QUERY_EXECUTOR.submit(
+            self._compute_request, request_id, self._last_query
+        )
+        future.add_done_callback(partial(self._on_request_done, request_id))
 
-    # top services grouping button
-    GLOBAL_WIDGET_TOP_SERVICES_RB = RadioButtonGroup(
-        labels=[
-            CONST_RB_LABEL_0,
-            CONST_RB_LABEL_1,
-            CONST_RB_LABEL_2,
-            CONST_RB_LABEL_3,
-        ],
-        active=CONST_RB_DEFAULT,
-    )
+        self._pending_update = future
+
+    def _compute_request(self, request_id, query):
+        """Runs compute_selection unless the request has been superseded"""
+
+        if request_id != self._request_cnt:
+            return None
+
+        return query, self.compute_selection(query[:-1])
+
+    def _on_request_done(self, request_id, future):
+        """Schedules a computed update to be applied by the session"""
+
+        if future.cancelled() or request_id != self._request_cnt:
+            return
+
+        if future.exception() is not None:
+            print(
+                "Update {} failed: {}".format(request_id, future.exception())
+            )
+            self.doc.add_next_tick_callback(
+                partial(self._fail_request, request_id)
+            )
+            return
+
+        result = future.result()
+
+        if result is not None:
+            self.doc.add_next_tick_callback(
+                partial(self._apply_request, request_id, *result)
+            )
+
+    def _apply_request(self, request_id, query, updates):
+        """Applies an update unless a newer request has been made since"""
+
+        if request_id == self._request_cnt:
+            self._pending_update = None
+            self.apply_selection(query, updates)
+
+    def _fail_request(self, request_id):
+        """
+        Forgets a failed request, so that the same selection can be
+            requested again
+        """
+
+        if request_id == self._request_cnt:
+            self._pending_update = None
+            self._last_query = None
+
+    def get_plot_window(self, visible=None):
+        """
+        Decides how the daily usage of the selection is plotted. A selection
+            too long to be shown by day is shown by week or by month. When
+            zoomed in, finer bars are shown for the visible dates and for
+            one visible range on each side of them.
+
+        Arguments:
+            visible: (first, last) date visible in the usage plot, None for
+                the whole selection
+
+        Returns:
+            a (resolution, date window) tuple, the window is None when the
+            whole selection is plotted
+        """
+
+        if self.daily_usage.empty:
+            return CONST_RESOLUTION_DAY, None
+
+        dates = self.daily_usage[CONST_COL_NAME_DATE]
+        resolution = get_resolution(dates.iloc[0], dates.iloc[-1])
+
+        # a range outside of the selection is left from another one
+        if (
+            visible is None
+            or visible[1] < dates.iloc[0]
+            or visible[0] > dates.iloc[-1]
+        ):
+            return resolution, None
+
+        resolutions = [
+            CONST_RESOLUTION_DAY,
+            CONST_RESOLUTION_WEEK,
+            CONST_RESOLUTION_MONTH,
+        ]
+
+        visible_resolution = get_resolution(*visible)
+
+        if resolutions.index(visible_resolution) >= resolutions.index(
+            resolution
+        ):
+            return resolution, None
+
+        span = visible[1] - visible[0]
+
+        return visible_resolution, (visible[0] - span, visible[1] + span)
+
+    def get_plot_data(self, visible=None):
+        """
+        Returns the bars of the usage plot (see get_plot_window). When
+            zoomed in, the finer bars of the window are shown together with
+            the coarse bars of the rest of the selection, so that the plot
+            is still ranged (and reset) to the whole selection.
+
+        Arguments:
+            visible: (first, last) date visible in the usage plot, None for
+                the whole selection
+
+        Returns:
+            a dataframe returned by totals.group_period
+        """
+
+        self._plot_window = self.get_plot_window(visible)
+
+        resolution, window = self._plot_window
+
+        daily_usage = self.daily_usage
 
-    # top services pie plot
-    GLOBAL_S2 = create_top_services_pie_plot()
-    top_services_table = _create_top_services_tbl()
+        if window is None:
+            return group_period(daily_usage, resolution)
 
-    analysis_widgets = layout(
-        [
-            layout([widget_input_text, last_update_text]),
+        dates = daily_usage[CONST_COL_NAME_DATE]
+        coarse_bars = group_period(
+            daily_usage, get_resolution(dates.iloc[0], dates.iloc[-1])
+        )
+
+        # the window is widened to whole coarse bars, which are replaced by
+        # the finer bars (the daily usage is sorted by date, see group_day)
+        bar_starts = coarse_bars[CONST_COL_NAME_DATE]
+        first_bar = max(bar_starts.searchsorted(window[0], "right") - 1, 0)
+        next_bar = bar_starts.searchsorted(window[1], "right")
+
+        fine_bars = group_period(
+            slice_date_range(
+                daily_usage,
+                bar_starts.iloc[first_bar],
+                bar_starts.iloc[next_bar] - pd.Timedelta(days=1)
+                if next_bar < len(bar_starts)
+                else None,
+                is_sorted=True,
+            ),
+            resolution,
+        )
+
+        return pd.concat(
             [
-                GLOBAL_WIDGET_SUBID,
-                GLOBAL_DATE_PICKER_FROM,
-                GLOBAL_DATE_PICKER_TO,
+                coarse_bars.iloc[:first_bar],
+                fine_bars,
+                coarse_bars.iloc[next_bar:],
             ],
-            [GLOBAL_WIDGET_SUBSCRIPTION_NAMES],
-            [widget_usage_text],
-            [GLOBAL_S1],
-            [GLOBAL_WIDGET_TOTAL_TEXT],
-            [widget_top_services_text],
-            [GLOBAL_S2, [GLOBAL_WIDGET_TOP_SERVICES_RB, top_services_table]],
-        ],
-        sizing_mode="scale_width",
-    )
+            ignore_index=True,
+        )
 
-    for widget in [
-        GLOBAL_WIDGET_SUBID,
-        GLOBAL_DATE_PICKER_FROM,
-        GLOBAL_DATE_PICKER_TO,
-    ]:
-        widget.on_change(
-            "value", lambda attr, old, new: _update_data(doc, url_params)
+    def get_visible_range(self):
+        """
+        Returns the (first, last) date visible in the usage plot, None if
+            the plot has not been ranged yet
+        """
+
+        x_range = self.s1.x_range
+
+        if x_range.start is None or x_range.end is None:
+            return None
+
+        return (
+            pd.to_datetime(x_range.start, unit="ms"),
+            pd.to_datetime(x_range.end, unit="ms"),
         )
 
-    GLOBAL_WIDGET_TOP_SERVICES_RB.on_change(
-        "active", lambda attr, old, new: _update_data(doc, url_params)
-    )
+    def schedule_zoom(self):
+        """
+        Schedules re-plotting the usage after the plot has been zoomed or
+            panned, coalescing the range changes made within
+            CONST_UPDATE_DEBOUNCE ms of each other.
+        """
 
-    return Panel(child=analysis_widgets, title="Analysis")
+        if self._scheduled_zoom is not None:
+            self.doc.remove_timeout_callback(self._scheduled_zoom)
 
+        self._scheduled_zoom = self.doc.add_timeout_callback(
+            self._run_scheduled_zoom, CONST_UPDATE_DEBOUNCE
+        )
 
-def _create_top_services_tbl():
-    """Creates top services table"""
+    def _run_scheduled_zoom(self):
+        """Re-plots the usage if the visible range needs other bars"""
 
-    global GLOBAL_SUB_SERVICE_GRP
-    global GLOBAL_TOP_SERVICE_SOURCE
+        self._scheduled_zoom = None
 
-    # Top services table
-    cols = []
-    for col in GLOBAL_SUB_SERVICE_GRP.columns:
+        visible = self.get_visible_range()
 
-        if col == CONST_COL_NAME_COST:
-            cols.append(
-                TableColumn(
-                    field=col,
-                    title=col,
-                    formatter=NumberFormatter(
-                        format="$0,0[.]00", text_align="right", language="it"
-                    ),
-                    width=100,
-                )
-            )
-        elif col == CONST_COL_NAME_PERC:
-            cols.append(
-                TableColumn(
-                    field=col,
-                    title=col,
-                    formatter=NumberFormatter(
-                        format="0,0[.]00%", text_align="right", language="it"
-                    ),
-                    width=50,
-                )
+        if visible is None:
+            return
+
+        resolution, window = self.get_plot_window(visible)
+        plot_resolution, plot_window = self._plot_window
+
+        # the bars plotted already cover the visible range
+        if resolution == plot_resolution:
+            if plot_window is None:
+                return
+
+            if plot_window[0] <= visible[0] and visible[1] <= plot_window[1]:
+                return
+
+        update_source(
+            self.total_source, get_source_data(self.get_plot_data(visible))
+        )
+
+    def create_analysis_tab(self, url_params):
+        """
+        Creates analysis tab
+
+        Arguments:
+            url_params: url parameters passed with the url
+        """
+
+        widget_input_text = Div(
+            text=url_params[URL_PARAM_REPORT],
+            style={"font-size": "200%", "color": "black"},
+        )
+
+        if self.last_update is not None:
+            last_update_text = Div(
+                text="Last updated: {}".format(
+                    self.last_update.tz_convert(DEFAULT_TIMEZONE).strftime(
+                        "%B %d, %Y, %R (%Z)"
+                    )
+                ),
+                style={"font-size": "125%", "color": "black"},
             )
-        elif col in [CONST_COL_NAME_ANGLE, "color"]:
-            continue
         else:
-            cols.append(TableColumn(field=col, title=col))
+            last_update_text = Div(text="Last updated:")
 
-    top_services_table = DataTable(
-        columns=cols, source=GLOBAL_TOP_SERVICE_SOURCE, width=400
-    )
+        self.widget_subid = TextInput(
+            title="Subscription IDs (comma separated)",
+            value=url_params[URL_PARAM_SUB_IDS],
+            css_classes=["customTextInput"],
+        )
 
-    return top_services_table
+        if not url_params[URL_PARAM_DT_FROM]:
+            if not self.sub_raw_usage.empty:
+                date_min = self.sub_raw_usage.Date.min().date()
+            elif not self.raw_usage.empty:
+                date_min = self.raw_usage.Date.min().date()
+            else:
+                date_min = pd.to_datetime("2016-01-01").date()
+        else:
+            date_min = url_params[URL_PARAM_DT_FROM].date()
 
+        if not url_params[URL_PARAM_DT_TO]:
+            if not self.sub_raw_usage.empty:
+                date_max = self.sub_raw_usage.Date.min().date()
+            elif not self.raw_usage.empty:
+                date_max = self.raw_usage.Date.max().date()
+            else:
+                date_max = pd.to_datetime("2021-12-31").date()
+        else:
+            date_max = url_params[URL_PARAM_DT_TO].date()
 
-def _set_layout(doc, url_params):
-    """Sets the layout of the document.
+        self.date_picker_from = DatePicker(value=date_min, title="Date from")
+        self.date_picker_to = DatePicker(value=date_max, title="Date to")
 
-    Arguments:
-        doc: a bokeh document to which elements can be added.
-        url_params: parameters passed with the url
-    """
+        self.widget_subscription_names = Div(
+            text="", style={"font-size": "100%", "color": "black"}
+        )
 
-    tabs = Tabs(
-        tabs=[
-            _create_analysis_tab(doc, url_params),
-            create_updates_tab(),
-            create_about_tab(),
-        ]
-    )
+        widget_usage_text = Div(
+            text="Usage ($):", style={"font-size": "150%", "color": "black"}
+        )
 
-    _plot_total_usage()
+        self.s1 = create_usage_bar_plot()
 
-    _plot_top_services()
+        # running totals plot, zoomed and panned with the usage plot
+        self.s3 = create_running_totals_plot(self.s1.x_range)
 
-    doc.add_root(tabs)
+        self.widget_total_text = Div(
+            text="Total usage: ${:,.2f}".format(0),
+            style={"font-size": "200%", "color": "blue"},
+        )
 
+        widget_top_services_text = Div(
+            text="Top services:",
+            style={"font-size": "150%", "color": "black"},
+        )
 
-def _plot_total_usage():
-    """Plots total usgae by the subscription."""
+        # top services grouping button
+        self.widget_top_services_rb = RadioButtonGroup(
+            labels=[
+                CONST_RB_LABEL_0,
+                CONST_RB_LABEL_1,
+                CONST_RB_LABEL_2,
+                CONST_RB_LABEL_3,
+            ],
+            active=CONST_RB_DEFAULT,
+        )
 
-    global GLOBAL_S1
-    global GLOBAL_TOTAL_SOURCE
+        # top services pie plot
+        self.s2 = create_top_services_pie_plot()
+        top_services_table = self.create_top_services_tbl()
 
-    GLOBAL_S1.vbar(
-        x=CONST_COL_NAME_DATE,
-        top=CONST_COL_NAME_COST,
-        width=8.64e7 * 0.9,
-        source=GLOBAL_TOTAL_SOURCE,
-    )
+        analysis_widgets = layout(
+            [
+                layout([widget_input_text, last_update_text]),
+                [
+                    self.widget_subid,
+                    self.date_picker_from,
+                    self.date_picker_to,
+                ],
+                [self.widget_subscription_names],
+                [widget_usage_text],
+                [self.s1],
+                [self.s3],
+                [self.widget_total_text],
+                [widget_top_services_text],
+                [
+                    self.s2,
+                    [self.widget_top_services_rb, top_services_table],
+                ],
+            ],
+            sizing_mode="scale_width",
+        )
+
+        for widget in [
+            self.widget_subid,
+            self.date_picker_from,
+            self.date_picker_to,
+        ]:
+            widget.on_change(
+                "value", lambda attr, old, new: self.schedule_update()
+            )
 
-    GLOBAL_S1.y_range.start = 0
+        self.widget_top_services_rb.on_change(
+            "active", lambda attr, old, new: self.switch_top_services()
+        )
+
+        return Panel(child=analysis_widgets, title="Analysis")
+
+    def create_top_services_tbl(self):
+        """Creates top services table"""
+
+        # Top services table
+        cols = []
+        for col in self.sub_service_grp.columns:
+
+            if col == CONST_COL_NAME_COST:
+                cols.append(
+                    TableColumn(
+                        field=col,
+                        title=col,
+                        formatter=NumberFormatter(
+                            format="$0,0[.]00",
+                            text_align="right",
+                            language="it",
+                        ),
+                        width=100,
+                    )
+                )
+            elif col == CONST_COL_NAME_PERC:
+                cols.append(
+                    TableColumn(
+                        field=col,
+                        title=col,
+                        formatter=NumberFormatter(
+                            format="0,0[.]00%",
+                            text_align="right",
+                            language="it",
+                        ),
+                        width=50,
+                    )
+                )
+            elif col in [CONST_COL_NAME_ANGLE, "color"]:
+                continue
+            else:
+                cols.append(TableColumn(field=col, title=col))
 
+        top_services_table = DataTable(
+            columns=cols, source=self.top_service_source, width=400
+        )
 
-def _plot_top_services():
-    """Plots top services pie chart"""
-    global GLOBAL_S2
-    global GLOBAL_TOP_SERVICE_SOURCE
+        return top_services_table
 
-    GLOBAL_S2.wedge(
-        x=0,
-        y=1,
-        radius=0.4,
-        start_angle=cumsum(CONST_COL_NAME_ANGLE, include_zero=True),
-        end_angle=cumsum(CONST_COL_NAME_ANGLE),
-        line_color="white",
-        fill_color="color",
-        legend_field=CONST_COL_NAME_SERVICE,
-        source=GLOBAL_TOP_SERVICE_SOURCE,
-    )
+    def set_layout(self, doc, url_params):
+        """Sets the layout of the document.
+
+        Arguments:
+            doc: a bokeh document to which elements can be added.
+            url_params: parameters passed with the url
+        """
+
+        self.doc = doc
+
+        tabs = Tabs(
+            tabs=[
+                self.create_analysis_tab(url_params),
+                create_updates_tab(),
+                create_about_tab(),
+            ]
+        )
+
+        self.plot_total_usage()
+
+        self.plot_running_totals()
+
+        self.plot_top_services()
+
+        doc.add_root(tabs)
+
+    def plot_total_usage(self):
+        """Plots total usgae by the subscription."""
+
+        self.s1.quad(
+            left=CONST_COL_NAME_DATE,
+            right=CONST_COL_NAME_END,
+            top=CONST_COL_NAME_COST,
+            bottom=0,
+            source=self.total_source,
+        )
+
+        self.s1.y_range.start = 0
+
+        # finer bars are plotted when zoomed in
+        for attr in ["start", "end"]:
+            self.s1.x_range.on_change(
+                attr, lambda attr, old, new: self.schedule_zoom()
+            )
+
+    def plot_running_totals(self):
+        """
+        Plots the cumulative usage and the moving average daily usage of the
+            selection. The lines are drawn from the columns of the usage
+            plot's source, at the end of each bar.
+        """
+
+        cumulative_line = self.s3.line(
+            x=CONST_COL_NAME_END,
+            y=CONST_COL_NAME_CUMULATIVE,
+            y_range_name=CONST_COL_NAME_CUMULATIVE,
+            line_width=2,
+            color=Category20c[3][0],
+            legend_label=CONST_COL_NAME_CUMULATIVE + " (right axis)",
+            source=self.total_source,
+        )
+
+        rolling_lines = []
+        for window, color in zip(CONST_ROLLING_WINDOWS, Category20c[20][4::4]):
+            rolling_lines.append(
+                self.s3.line(
+                    x=CONST_COL_NAME_END,
+                    y=CONST_COL_NAME_ROLLING.format(window),
+                    line_width=2,
+                    color=color,
+                    legend_label="{}-day average".format(window),
+                    source=self.total_source,
+                )
+            )
+
+        # each axis is fitted to its own lines
+        self.s3.extra_y_ranges[CONST_COL_NAME_CUMULATIVE].renderers = [
+            cumulative_line
+        ]
+        self.s3.y_range.renderers = rolling_lines
+        self.s3.y_range.start = 0
+
+        self.s3.legend.location = "top_left"
+
+    def plot_top_services(self):
+        """Plots top services pie chart"""
+
+        self.s2.wedge(
+            x=0,
+            y=1,
+            radius=0.4,
+            start_angle=cumsum(CONST_COL_NAME_ANGLE, include_zero=True),
+            end_angle=cumsum(CONST_COL_NAME_ANGLE),
+            line_color="white",
+            fill_color="color",
+            legend_field=CONST_COL_NAME_SERVICE,
+            source=self.top_service_source,
+        )
 
-    GLOBAL_S2.legend.location = "top_right"
-    GLOBAL_S2.legend.label_width = 180
-    GLOBAL_S2.legend.label_text_font_size = "8pt"
+        self.s2.legend.location = "top_right"
+        self.s2.legend.label_width = 180
+        self.s2.legend.label_text_font_size = "8pt"
 
-    GLOBAL_S2.axis.axis_label = None
-    GLOBAL_S2.axis.visible = False
-    GLOBAL_S2.grid.grid_line_color = None
+        self.s2.axis.axis_label = None
+        self.s2.axis.visible = False
+        self.s2.grid.grid_line_color = None
@@ -24,6 +24,24 @@ UPDATES_FILE = "UPDATES.txt"
 TIMESTAMP_FILE = "update.log"
 DEFAULT_TIMEZONE = "Europe/London"
 DATA_FOLDER = "data"
+USAGE_STORE_FOLDER = "usage.parquet"
+# smallest number of usage files read in with a process pool
+CONST_PARALLEL_MIN_FILES = 8
+# how often (ms) the server checks the data folder for new usage data
+CONST_DATA_REFRESH_INTERVAL = 60000
+# number of threads running the dashboard queries of a server process
+CONST_QUERY_WORKERS = 4
+# how long (ms) the dashboard waits for more widget changes before updating
+CONST_UPDATE_DEBOUNCE = 300
+# maximum number of dashboard query results cached by a server process and
+# the maximum memory (bytes) they may hold
+CONST_QUERY_CACHE_SIZE = 256
+CONST_QUERY_CACHE_MEMORY = 64 * 1024 * 1024
+# maximum number of bars of the usage plot, longer periods are shown by week
+# or by month
+CONST_MAX_BARS = 400
+# windows (days) of the moving average usage
+CONST_ROLLING_WINDOWS = [7, 30]
 CONST_TEST_FOLDER = "tests"
 
 DEFAULT_REPORT_NAME = "Azure usage analysis"
@@ -45,6 +63,12 @@ CONST_COL_NAME_ANGLE = "angle"
 CONST_COL_NAME_IDEALCOST = "Ideal_Cost"
 CONST_COL_NAME_AVAILCOST = "Avail_Cost"
 CONST_COL_NAME_SUB = "Subscription"
+CONST_COL_NAME_END = "End"
+CONST_COL_NAME_DATE_FROM = "DateFrom"
+CONST_COL_NAME_DATE_TO = "DateTo"
+CONST_COL_NAME_CUMULATIVE = "Cumulative"
+# moving average usage over a window of days, e.g. Avg7D
+CONST_COL_NAME_ROLLING = "Avg{}D"
 
 CONST_COL_NAME_HANDOUTNAME = "HandoutName"
 CONST_COL_NAME_LABNAME = "LabName"
@@ -52,6 +76,34 @@ CONST_COL_NAME_COURSENAME = "CourseName"
 
 CONST_NAME_OTHER = "Other"
 
+# low cardinality columns stored as categoricals in the compact in-memory
+# schema and in the columnar usage store
+CONST_CATEGORICAL_COLS = [
+    CONST_COL_NAME_SNAME,
+    CONST_COL_NAME_SGUID,
+    CONST_COL_NAME_SERVICENAME,
+    CONST_COL_NAME_SERVICETYPE,
+    "ServiceRegion",
+    CONST_COL_NAME_SERVICERESOURCE,
+    CONST_COL_NAME_SOURCEFILE,
+]
+
+# high cardinality columns whose repeated values share one string object in
+# the compact in-memory schema
+CONST_INTERNED_COLS = ["ResourceGuid"]
+
+# whether the webapp keeps Quantity as float32 (Cost is always float64)
+CONST_FLOAT32_QUANTITY = False
+
+# grain of the daily cube of usage pre-aggregated for the dashboard
+CONST_CUBE_COLS = [
+    CONST_COL_NAME_SGUID,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_SERVICENAME,
+    CONST_COL_NAME_SERVICETYPE,
+    CONST_COL_NAME_SERVICERESOURCE,
+]
+
 CONST_TEST_DIR = os.path.abspath(
     os.path.join(
         os.path.dirname(os.path.realpath(__file__)), "..", CONST_TEST_FOLDER
@@ -70,6 +122,11 @@ CONST_TEST_DIR_5 = "5_missing_days"
 CONST_TEST_DIR_6 = "6_multiple_services"
 CONST_TEST_DIR_8 = "8_eduhub"
 
+# resolutions of the usage plot
+CONST_RESOLUTION_DAY = "D"
+CONST_RESOLUTION_WEEK = "W"
+CONST_RESOLUTION_MONTH = "M"
+
 CONST_RB_DEFAULT = 0
 CONST_RB_LABEL_0 = "Type"
 CONST_RB_VALUE_0 = 0
@@ -79,5 +136,28 @@ CONST_RB_LABEL_2 = "Name + Type"
 CONST_RB_VALUE_2 = 2
 CONST_RB_LABEL_3 = "Name + Resource"
 CONST_RB_VALUE_3 = 3
+# all the top services groupings, computed together for a selection
+CONST_RB_VALUES = [
+    CONST_RB_VALUE_0,
+    CONST_RB_VALUE_1,
+    CONST_RB_VALUE_2,
+    CONST_RB_VALUE_3,
+]
 
 CONST_ENCODING = "utf-8"
+
+# Date formats used in the usage export files
+CONST_DATE_FORMAT_US = "%m/%d/%Y"
+CONST_DATE_FORMAT_UK = "%d/%m/%Y"
+CONST_DATE_FORMAT_ISO = "%Y-%m-%d"
+
+# In January 2020, MS changed the date format used in the usage export files
+# from US to UK. Files starting after this date default to the UK format when
+# their dates are ambiguous (no day above 12).
+CONST_DATE_FORMAT_SWITCH = "2020-01-24"
+
+# Explicit date formats of usage files, keyed by file name. They are only
+# used when all the dates of a file are ambiguous (no day above 12), instead
+# of the default of its start date. The daily files exported during the
+# switch (24/01/2020 - 28/01/2020) all have days above 12 and need none.
+CONST_DATE_FORMAT_OVERRIDES = {}
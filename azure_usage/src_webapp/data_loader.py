@@ -8,14 +8,41 @@ Usage:
          of csv files.
      create_dataframe(<base_directory>)
          will loop through the subdirectories of a base directory,
-         calling the above method on each, concatenating the
-         dataframes and deduplicating (taking the last entry).
+         reading in their files, concatenating the dataframes and
+         deduplicating (taking the last entry).
+     create_dataframe(<base_directory>, cache_dir=<cache_directory>)
+         same as above, but parsed files are kept in a persistent cache
+         and only new or changed files are parsed.
+     write_usage_store(<dataframe>, <store_directory>)
+     read_usage_store(<store_directory>)
+         will write/read the deduplicated usage to/from a typed columnar
+         store (Parquet, partitioned by Year-Month).
+     compact_dataframe(<dataframe>)
+         will convert the usage to a compact in-memory schema,
+         memory_report(<dataframe>) shows the memory used per column
+         (memory_report(<dataframe>, dedup_objects=True) counts shared
+         strings once).
 """
 
 import os
+import sys
+import time
+import hashlib
+import shutil
 import datetime
+import tempfile
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pandas.api.types import (
+    is_bool_dtype,
+    is_numeric_dtype,
+)
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from .constants import (
     CONST_COL_NAME_QUANTITY,
@@ -26,7 +53,17 @@ from .constants import (
     CONST_COL_NAME_LABNAME,
     CONST_COL_NAME_COURSENAME,
     CONST_COL_NAME_SNAME,
+    CONST_COL_NAME_YM,
+    CONST_CATEGORICAL_COLS,
+    CONST_INTERNED_COLS,
+    CONST_DATE_FORMAT_US,
+    CONST_DATE_FORMAT_UK,
+    CONST_DATE_FORMAT_ISO,
+    CONST_DATE_FORMAT_SWITCH,
+    CONST_DATE_FORMAT_OVERRIDES,
+    CONST_PARALLEL_MIN_FILES,
 )
+from .ingest_cache import load_cached_frame, store_cached_frame
 
 
 def check_filename_convention(filename):
@@ -67,88 +104,613 @@ def check_filename_convention(filename):
     return True, start_date, end_date
 
 
-def create_dataframe_from_dir(directory):
+def detect_date_format(dates, start_date, filename=None):
+    """
+    Detects the date format of a usage file's Date column, so that it can be
+    parsed in a single pass.
+
+    The unique date strings are checked once: ISO dates contain dashes, a
+    first field above 12 means UK dates and a second field above 12 means US
+    dates. Files with only ambiguous dates use the explicit override table
+    or, otherwise, the format MS used at the file's start date (US before
+    the switch in January 2020, UK after). Unambiguous dates are never
+    overridden, so a wrong entry in the table cannot break a file.
+
+    Args:
+        dates - a series with the raw date strings
+        start_date - start date of the file's time period
+        filename - name of the file, used to look up the override table
+    Returns:
+        the date format string
+    """
+
+    switch_date = datetime.datetime.strptime(
+        CONST_DATE_FORMAT_SWITCH, CONST_DATE_FORMAT_ISO
+    )
+
+    if filename in CONST_DATE_FORMAT_OVERRIDES:
+        default_format = CONST_DATE_FORMAT_OVERRIDES[filename]
+    elif start_date > switch_date:
+        default_format = CONST_DATE_FORMAT_UK
+    else:
+        default_format = CONST_DATE_FORMAT_US
+
+    unique_dates = pd.Series(dates.dropna().unique()).astype(str)
+
+    if unique_dates.empty:
+        return default_format
+
+    if unique_dates.str.contains("-", regex=False).all():
+        return CONST_DATE_FORMAT_ISO
+
+    date_parts = unique_dates.str.split("/", expand=True)
+
+    if len(date_parts.columns) < 2:
+        return default_format
+
+    first = pd.to_numeric(date_parts[0], errors="coerce")
+    second = pd.to_numeric(date_parts[1], errors="coerce")
+
+    if (first > 12).any():
+        return CONST_DATE_FORMAT_UK
+
+    if (second > 12).any():
+        return CONST_DATE_FORMAT_US
+
+    return default_format
+
+
+def parse_dates(dates, start_date, filename=None):
+    """
+    Parses the raw date strings of a usage file in a single pass: the column
+    is factorised once, the format is detected and only the unique strings
+    are parsed before being mapped back to the rows.
+
+    Args:
+        dates - a series with the raw date strings
+        start_date - start date of the file's time period
+        filename - name of the file, used to look up the override table
+    Returns:
+        a datetime series aligned with dates
+    """
+
+    codes, unique_dates = pd.factorize(dates)
+
+    date_format = detect_date_format(
+        pd.Series(unique_dates), start_date, filename
+    )
+
+    # the extra NaT at the end is picked up by missing values (code -1)
+    parsed = np.append(
+        pd.to_datetime(unique_dates.astype(object), format=date_format).values,
+        np.datetime64("NaT", "ns"),
+    )
+
+    values = parsed.take(codes)
+
+    return pd.Series(values, index=dates.index, name=dates.name)
+
+
+def read_usage_file(directory, filename):
+    """
+    Reads in a single usage file, converts the 'Date' column to datetime and
+    normalises EduHub specific columns.
+
+    Args:
+        directory - directory containing the file
+        filename - name of the csv file
+    Returns:
+        a dataframe with the file's usage or None if the file is named
+        incorrectly
+    """
+
+    # Assert that the file is named correctly
+    _, start_date, end_date = check_filename_convention(filename)
+
+    if start_date is None or end_date is None:
+        return None
+
+    df = pd.read_csv(os.path.join(directory, filename))
+    df = df.assign(SourceFile=filename)
+
+    df[CONST_COL_NAME_DATE] = parse_dates(
+        df[CONST_COL_NAME_DATE], start_date, filename
+    )
+
+    # Check if data comes from EduHub
+    if CONST_COL_NAME_HANDOUTNAME in df.columns:
+
+        # Renaming HandoutName to SubscriptionName
+        df = df.rename(
+            columns={CONST_COL_NAME_HANDOUTNAME: CONST_COL_NAME_SNAME}
+        )
+
+        # Dropping columns CourseName,LabName
+        df = df.drop(
+            columns=[CONST_COL_NAME_LABNAME, CONST_COL_NAME_COURSENAME]
+        )
+
+    return df
+
+
+def read_usage_file_cached(directory, filename, cache_dir=None):
+    """
+    Reads in a single usage file using the ingest cache: only new or changed
+    files are parsed, the rest are served from the cache.
+
+    Args:
+        directory - directory containing the file
+        filename - name of the csv file
+        cache_dir - ingest cache directory, the cache is not used if None
+    Returns:
+        a dataframe with the file's usage or None if the file is named
+        incorrectly
+    """
+
+    if cache_dir is None:
+        return read_usage_file(directory, filename)
+
+    file_path = os.path.join(directory, filename)
+
+    df = load_cached_frame(cache_dir, file_path)
+
+    if df is None:
+        df = read_usage_file(directory, filename)
+
+        if df is not None:
+            store_cached_frame(cache_dir, file_path, df)
+
+    return df
+
+
+def _read_usage_file_timed(directory, filename, cache_dir=None):
+    """
+    Reads in a single usage file and times it. Defined at module level so
+    that it can be run in a process pool.
+    """
+
+    time_st = time.perf_counter()
+
+    df = read_usage_file_cached(directory, filename, cache_dir)
+
+    return df, time.perf_counter() - time_st
+
+
+def list_usage_files(directory):
+    """
+    Lists the csv usage files of a directory sorted by name, skipping files
+    starting with an underscore.
+    """
+
+    if not os.path.exists(directory):
+        return []
+
+    file_list = os.listdir(directory)
+
+    file_list.sort()
+
+    return [
+        filename
+        for filename in file_list
+        if not filename.startswith("_") and filename.endswith(".csv")
+    ]
+
+
+def iter_usage_files(file_paths, cache_dir=None, workers=None, timings=None):
+    """
+    Reads in usage files one at a time, yielding their dataframes in the
+    order of file_paths. Files are read in a process pool if workers > 1
+    and there are at least CONST_PARALLEL_MIN_FILES files, otherwise one
+    after another. At most 2 * workers files are read ahead of the consumer.
+
+    Args:
+        file_paths - paths to the csv files
+        cache_dir - ingest cache directory, the cache is not used if None
+        workers - number of worker processes
+        timings - an optional dictionary filled with the time (seconds)
+            taken to read in each file, keyed by its path
+    Yields:
+        dataframes (None for files named incorrectly)
+    """
+
+    if (
+        workers is not None
+        and workers > 1
+        and len(file_paths) >= CONST_PARALLEL_MIN_FILES
+    ):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = deque()
+
+            for file_path in file_paths:
+                futures.append(
+                    (
+                        file_path,
+                        executor.submit(
+                            _read_usage_file_timed,
+                            os.path.dirname(file_path),
+                            os.path.basename(file_path),
+                            cache_dir,
+                        ),
+                    )
+                )
+
+                if len(futures) >= 2 * workers:
+                    yield _pop_file_result(futures, timings)
+
+            while futures:
+                yield _pop_file_result(futures, timings)
+
+    else:
+        for file_path in file_paths:
+            df, file_time = _read_usage_file_timed(
+                os.path.dirname(file_path),
+                os.path.basename(file_path),
+                cache_dir,
+            )
+
+            if timings is not None:
+                timings[file_path] = file_time
+
+            yield df
+
+
+def _pop_file_result(futures, timings):
+    """Waits for the oldest submitted file and records its timing"""
+
+    file_path, future = futures.popleft()
+    df, file_time = future.result()
+
+    if timings is not None:
+        timings[file_path] = file_time
+
+    return df
+
+
+def read_usage_files(file_paths, cache_dir=None, workers=None, timings=None):
+    """
+    Reads in usage files, see iter_usage_files.
+
+    Returns:
+        a list of dataframes (None for files named incorrectly) in the same
+        order as file_paths
+    """
+
+    return list(iter_usage_files(file_paths, cache_dir, workers, timings))
+
+
+def _concat_file_dataframes(df_list):
+    """Concatenates the dataframes of the files of a directory"""
+
+    df_list = [df for df in df_list if df is not None]
+
+    if len(df_list) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(df_list, axis=0, ignore_index=True)
+
+
+def create_dataframe_from_dir(
+    directory, cache_dir=None, workers=None, timings=None
+):
     """
     Given a directory containing csv files, create a dataframe
     from each file, convert the 'Date' column to datetime, and concatenate.
+
+    If cache_dir is given, parsed files are cached there and only new or
+    changed files are parsed again. If workers > 1, files are read in a
+    process pool (see read_usage_files).
     """
 
     if not os.path.exists(directory):
         return pd.DataFrame()
 
-    file_list = os.listdir(directory)
+    file_paths = [
+        os.path.join(directory, filename)
+        for filename in list_usage_files(directory)
+    ]
 
-    file_list.sort()
+    return _concat_file_dataframes(
+        read_usage_files(file_paths, cache_dir, workers, timings)
+    )
 
-    df_list = []
-    for filename in file_list:
 
-        if filename.startswith("_") or (not filename.endswith(".csv")):
-            continue
+def get_dedup_columns(df):
+    """
+    Columns identifying a usage entry: all columns except for 'Quantity',
+    'Cost' and 'SourceFile'.
+    """
 
-        # Assert that the file is named correctly
-        _, start_date, end_date = check_filename_convention(filename)
+    return [
+        col
+        for col in df.columns
+        if col
+        not in [
+            CONST_COL_NAME_QUANTITY,
+            CONST_COL_NAME_COST,
+            CONST_COL_NAME_SOURCEFILE,
+        ]
+    ]
 
-        df = pd.read_csv(os.path.join(directory, filename))
-        df = df.assign(SourceFile=filename)
 
-        # In January 2020, MS changed the date format used in the usage
-        # export files from US to UK. This happen between 24/01/2020 -
-        # 28/01/2020. The following if statement is to deal with this
-        # change.
-        if start_date is None or end_date is None:
-            continue
+def _column_salt(col):
+    """An odd 64-bit multiplier derived from a column name"""
 
-        if start_date > datetime.datetime(2020, 1, 24, 0, 0):
-            try:
-                df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                    df[CONST_COL_NAME_DATE], format="%d/%m/%Y"
-                )
-            except Exception:
-                try:
-                    df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                        df[CONST_COL_NAME_DATE], format="%m/%d/%Y"
-                    )
-                except Exception:
-                    df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                        df[CONST_COL_NAME_DATE], format="%Y-%m-%d"
-                    )
-        else:
-            try:
-                df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                    df[CONST_COL_NAME_DATE], format="%m/%d/%Y"
+    digest = hashlib.sha1(str(col).encode("utf-8")).digest()
+
+    return np.uint64(int.from_bytes(digest[:8], "little") | 1)
+
+
+def hash_usage_rows(df, columns):
+    """
+    Computes a 64-bit key for each row of a dataframe over the given
+    columns.
+
+    Every column is hashed on its own, salted with the column name and the
+    results are summed, so that the key does not depend on the order of the
+    columns, and missing values contribute nothing: a row with a missing
+    value in a column gets the same key as a row without that column, as
+    they would compare equal once the dataframes are concatenated.
+
+    Args:
+        df - dataframe
+        columns - columns identifying a row
+    Returns:
+        a numpy array of uint64 keys
+    """
+
+    keys = np.zeros(len(df.index), dtype=np.uint64)
+
+    for col in columns:
+        values = df[col]
+
+        # numbers compare equal across int and float columns
+        if is_numeric_dtype(values) and not is_bool_dtype(values):
+            values = values.astype(np.float64)
+
+        # hashing the unique values only, missing values get code -1
+        codes, uniques = pd.factorize(values)
+        col_hash = np.append(
+            pd.util.hash_pandas_object(
+                uniques, index=False, categorize=False
+            ).values,
+            np.uint64(0),
+        ).take(codes)
+
+        keys += col_hash * _column_salt(col)
+
+    return keys
+
+
+class _UsageKeys:
+    """
+    The 64-bit keys of the entries kept so far by dedup_dataframes, with
+    their row labels.
+
+    The keys are held in sorted runs, one per dataframe to begin with, and
+    a new run is merged with the previous one while it is at least as long,
+    so every key is merged O(log n) times overall and the keys of a new
+    dataframe are looked up in O(log n) runs by binary search. Superseded
+    entries are marked dead and left out when their run is merged.
+    """
+
+    def __init__(self):
+
+        # (keys, labels, alive) of each run, sorted by key
+        self._runs = []
+
+    def find(self, keys):
+        """
+        Finds the live entries with the same keys as the given ones.
+
+        Args:
+            keys - numpy array of keys
+        Returns:
+            a (positions in keys, run ids, positions in the runs, labels)
+            tuple of numpy arrays, one entry per match
+        """
+
+        found = []
+
+        # binary searches for sorted keys are much more cache friendly
+        order = np.argsort(keys)
+        keys = keys[order]
+
+        for run_id, (run_keys, run_labels, run_alive) in enumerate(self._runs):
+            starts = np.searchsorted(run_keys, keys, side="left")
+            counts = np.searchsorted(run_keys, keys, side="right") - starts
+
+            if not counts.any():
+                continue
+
+            # all the matches of a key, a run may hold the same key more
+            # than once if different entries collide
+            key_pos = np.repeat(order, counts)
+            run_pos = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            run_pos += np.arange(len(run_pos))
+
+            live = run_alive[run_pos]
+
+            found.append(
+                (
+                    key_pos[live],
+                    np.full(live.sum(), run_id),
+                    run_pos[live],
+                    run_labels[run_pos[live]],
                 )
-            except Exception:
-                try:
-                    df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                        df[CONST_COL_NAME_DATE], format="%d/%m/%Y"
-                    )
-                except Exception:
-                    df[CONST_COL_NAME_DATE] = pd.to_datetime(
-                        df[CONST_COL_NAME_DATE], format="%Y-%m-%d"
-                    )
+            )
+
+        if len(found) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, empty
+
+        return tuple(np.concatenate(arrays) for arrays in zip(*found))
+
+    def kill(self, run_ids, run_pos):
+        """Marks entries returned by find as superseded"""
+
+        for run_id in np.unique(run_ids):
+            self._runs[run_id][2][run_pos[run_ids == run_id]] = False
+
+    def add(self, keys, labels):
+        """Adds the keys and the row labels of new entries"""
+
+        order = np.argsort(keys, kind="mergesort")
+        self._runs.append(
+            (keys[order], labels[order], np.ones(len(keys), dtype=bool))
+        )
 
-        # Check if data comes from EduHub
-        if CONST_COL_NAME_HANDOUTNAME in df.columns:
+        while len(self._runs) > 1 and (
+            len(self._runs[-2][0]) <= len(self._runs[-1][0])
+        ):
+            runs = [self._runs.pop(), self._runs.pop()]
 
-            # Renaming HandoutName to SubscriptionName
-            df = df.rename(
-                columns={CONST_COL_NAME_HANDOUTNAME: CONST_COL_NAME_SNAME}
+            keys = np.concatenate([run[0][run[2]] for run in runs])
+            labels = np.concatenate([run[1][run[2]] for run in runs])
+
+            order = np.argsort(keys, kind="mergesort")
+            self._runs.append(
+                (keys[order], labels[order], np.ones(len(keys), dtype=bool))
             )
 
-            # Dropping columns CourseName,LabName
-            df = df.drop(
-                columns=[CONST_COL_NAME_LABNAME, CONST_COL_NAME_COURSENAME]
+
+def _drop_labels(parts, part_offsets, labels):
+    """
+    Drops rows by their labels from the parts they belong to. Parts hold
+    consecutive ranges of labels starting at part_offsets.
+    """
+
+    part_ids = np.searchsorted(part_offsets, labels, side="right") - 1
+
+    for part_id in np.unique(part_ids):
+        part = parts[part_id]
+        parts[part_id] = part[~part.index.isin(labels[part_ids == part_id])]
+
+
+def _get_labelled_rows(parts, part_offsets, labels):
+    """Returns rows by their labels from the parts they belong to"""
+
+    part_ids = np.searchsorted(part_offsets, labels, side="right") - 1
+
+    rows = pd.concat(
+        [
+            parts[part_id].loc[np.unique(labels[part_ids == part_id])]
+            for part_id in np.unique(part_ids)
+        ]
+    )
+
+    return rows.loc[labels]
+
+
+def _equal_rows(rows_a, rows_b):
+    """
+    Compares two dataframes of the same length row by row on all the
+    columns except for 'Quantity', 'Cost' and 'SourceFile', as
+    drop_duplicates would after concatenating them: a column missing from a
+    dataframe counts as missing values and missing values are equal.
+
+    Returns:
+        a boolean numpy array
+    """
+
+    equal = np.ones(len(rows_a.index), dtype=bool)
+
+    columns = get_dedup_columns(rows_a) + [
+        col for col in get_dedup_columns(rows_b) if col not in rows_a.columns
+    ]
+
+    for col in columns:
+        if col not in rows_a.columns or col not in rows_b.columns:
+            values = rows_b[col] if col in rows_b.columns else rows_a[col]
+            equal &= values.isna().values
+            continue
+
+        values_a = rows_a[col].to_numpy()
+        values_b = rows_b[col].to_numpy()
+
+        missing_a = pd.isna(values_a)
+        missing_b = pd.isna(values_b)
+
+        with np.errstate(invalid="ignore"):
+            same = np.asarray(values_a == values_b, dtype=bool)
+
+        equal &= (same & ~missing_a & ~missing_b) | (missing_a & missing_b)
+
+    return equal
+
+
+def dedup_dataframes(dfs):
+    """
+    Deduplicates usage dataframes as they stream in, taking the last entry
+    (i.e. we assume that the dataframes are passed to it most-recent-last).
+
+    Entries are identified by a 64-bit key over all the columns except for
+    'Quantity', 'Cost' and 'SourceFile' (see hash_usage_rows). The keys of
+    the entries kept so far are looked up for the keys of each new
+    dataframe (see _UsageKeys), and the entries with the same key are
+    compared in full before the earlier one is dropped, so two different
+    entries hashing to the same key are both kept. Only the surviving
+    entries, their keys and one new dataframe are held in memory. The
+    result is the same as concatenating all the dataframes and calling
+    drop_duplicates, including the index.
+
+    Args:
+        dfs - an iterable of dataframes (None entries are skipped)
+    Returns:
+        the deduplicated dataframe
+    """
+
+    # surviving parts of the dataframes and the first label of each
+    parts = []
+    part_offsets = []
+
+    usage_keys = _UsageKeys()
+
+    row_offset = 0
+
+    for df in dfs:
+        if df is None or (df.empty and len(df.columns) == 0):
+            continue
+
+        # labels the rows as pd.concat(..., ignore_index=True) would,
+        # without copying the data or relabelling the caller's dataframe
+        df = df.copy(deep=False)
+        df.index = pd.RangeIndex(row_offset, row_offset + len(df.index))
+        part_offsets.append(row_offset)
+        row_offset += len(df.index)
+
+        keys = hash_usage_rows(df, get_dedup_columns(df))
+
+        # duplicates within the dataframe, keeping the last one
+        shared = pd.Series(keys).duplicated(keep=False).values
+        if shared.any():
+            keep = np.ones(len(keys), dtype=bool)
+            keep[shared] = (
+                ~df[shared][get_dedup_columns(df)]
+                .duplicated(keep="last")
+                .values
             )
+            df = df[keep]
+            keys = keys[keep]
 
-        df_list.append(df)
+        # entries superseded by the new dataframe
+        key_pos, run_ids, run_pos, labels = usage_keys.find(keys)
 
-    if len(df_list) == 0:
-        return pd.DataFrame()
+        if len(labels) > 0:
+            same = _equal_rows(
+                _get_labelled_rows(parts, part_offsets, labels),
+                df.iloc[key_pos],
+            )
+
+            usage_keys.kill(run_ids[same], run_pos[same])
+            _drop_labels(parts, part_offsets, np.unique(labels[same]))
+
+        usage_keys.add(keys, df.index.values.astype(np.int64))
+        parts.append(df)
 
-    total_df = pd.concat(df_list, axis=0, ignore_index=True)
+    if len(parts) == 0:
+        return pd.DataFrame()
 
-    return total_df
+    return pd.concat(parts, axis=0)
 
 
 def concat_dataframes(df_list):
@@ -159,52 +721,226 @@ def concat_dataframes(df_list):
     most-recent-last).
     """
 
-    if len(df_list) == 0:
-        return pd.DataFrame()
-
-    total_df = pd.concat(df_list, axis=0, ignore_index=True)
-
-    columns_to_dedup = list(total_df.columns)
-
-    # if dataframe is empty and does not have any columns
-    # do not need to do anything
-    if total_df.empty and (len(columns_to_dedup) == 0):
-        return total_df
-
-    columns_to_dedup.remove(CONST_COL_NAME_QUANTITY)
-    columns_to_dedup.remove(CONST_COL_NAME_COST)
-    columns_to_dedup.remove(CONST_COL_NAME_SOURCEFILE)
-
-    return total_df.drop_duplicates(columns_to_dedup, keep="last")
+    return dedup_dataframes(df_list)
 
 
-def create_dataframe(base_dir):
+def create_dataframe(base_dir, cache_dir=None, workers=None, timings=None):
     """
     Given a directory that contains some other directories (ideally
     ordered by date when sorted by name), loop through all these
-    directories, create a data frame for each, and concatenate
-    them using the concat_dataframes method (which will remove
-    duplicateskeeping the latest).
+    directories, create a data frame for each file, and deduplicate
+    them as they are read in using the dedup_dataframes method (which
+    keeps the latest entries).
+
+    If cache_dir is given, parsed files are kept in a persistent ingest
+    cache so that a reload only parses new or changed files.
+
+    If workers > 1, the files of all the directories are read in a single
+    process pool; the frames keep the serial order, so the "keep last"
+    deduplication gives the same result. Per file timings are added to the
+    timings dictionary if one is passed.
     """
 
     if not os.path.exists(base_dir):
         return pd.DataFrame()
 
-    df_list = [
-        create_dataframe_from_dir(os.path.join(base_dir, directory))
+    directories = [
+        os.path.join(base_dir, directory)
         for directory in os.listdir(base_dir)
         if os.path.isdir(os.path.join(base_dir, directory))
     ]
+    directories.append(base_dir)
 
-    df_basedir = create_dataframe_from_dir(base_dir)
-    if df_basedir is not None:
-        df_list.append(df_basedir)
+    file_paths = [
+        os.path.join(directory, filename)
+        for directory in directories
+        for filename in list_usage_files(directory)
+    ]
 
-    final_df = concat_dataframes(df_list)
+    # the files are deduplicated as they are read in
+    final_df = dedup_dataframes(
+        iter_usage_files(file_paths, cache_dir, workers, timings)
+    )
 
     return final_df
 
 
+def _intern_column(values):
+    """
+    Returns a copy of an object column in which equal strings are the same
+    object, so each distinct value is held in memory only once.
+    """
+
+    codes, uniques = pd.factorize(values)
+
+    # missing values (code -1) take the appended NaN
+    uniques = np.append(np.asarray(uniques, dtype=object), np.nan)
+
+    return pd.Series(uniques.take(codes), index=values.index, name=values.name)
+
+
+def compact_dataframe(df, float32_quantity=False):
+    """
+    Converts raw usage to a compact in-memory schema: the low cardinality
+    string columns become categoricals, the resource GUIDs are interned and,
+    optionally, Quantity is downcast to float32. Cost is kept as float64, so
+    the aggregated costs are not changed.
+
+    Args:
+        df - raw usage dataframe
+        float32_quantity - flag to store Quantity as float32
+    Returns:
+        the compacted dataframe (df itself is not modified)
+    """
+
+    if df.empty and len(df.columns) == 0:
+        return df
+
+    compact_df = df.copy(deep=False)
+
+    for col in CONST_CATEGORICAL_COLS:
+        if col in compact_df.columns:
+            compact_df[col] = compact_df[col].astype("category")
+
+    for col in CONST_INTERNED_COLS:
+        if col in compact_df.columns and compact_df[col].dtype == object:
+            compact_df[col] = _intern_column(compact_df[col])
+
+    if float32_quantity and CONST_COL_NAME_QUANTITY in compact_df.columns:
+        compact_df[CONST_COL_NAME_QUANTITY] = compact_df[
+            CONST_COL_NAME_QUANTITY
+        ].astype(np.float32)
+
+    return compact_df
+
+
+def memory_report(df, dedup_objects=False):
+    """
+    Reports the memory used by a usage dataframe, column by column.
+
+    By default this is pandas' deep memory usage. With dedup_objects, a
+    string object shared by several rows of an object column (e.g. an
+    interned GUID) is counted only once; this goes through every value in
+    Python, so it is meant for diagnostics rather than for every load.
+
+    Args:
+        df - usage dataframe
+        dedup_objects - count objects shared by several rows only once
+    Returns:
+        a dataframe indexed by column name (plus 'Index' and 'Total') with
+        the dtype and the number of bytes of each column
+    """
+
+    report_rows = [
+        ["Index", str(df.index.dtype), int(df.index.memory_usage(deep=True))]
+    ]
+
+    for col in df.columns:
+        values = df[col]
+
+        if dedup_objects and values.dtype == object:
+            unique_objs = {id(value): value for value in values.values}
+            col_bytes = values.values.nbytes + sum(
+                sys.getsizeof(value) for value in unique_objs.values()
+            )
+        else:
+            col_bytes = values.memory_usage(index=False, deep=True)
+
+        report_rows.append([col, str(values.dtype), int(col_bytes)])
+
+    report = pd.DataFrame(report_rows, columns=["Column", "Dtype", "Bytes"])
+    report = report.set_index("Column")
+
+    report.loc["Total"] = ["", report["Bytes"].sum()]
+
+    return report
+
+
+def write_usage_store(df, store_path):
+    """
+    Writes deduplicated usage to a typed columnar store: a Parquet dataset
+    partitioned by Year-Month, with categorical string columns and a native
+    datetime Date column. An existing store at store_path is replaced.
+
+    The store is written to a temporary directory next to store_path and
+    renamed into place when complete, so a reader never sees a partially
+    written store.
+
+    Args:
+        df - raw usage dataframe
+        store_path - path to the store directory
+    """
+
+    store_path = os.path.abspath(store_path)
+    store_dir, store_name = os.path.split(store_path)
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    tmp_path = tempfile.mkdtemp(prefix="." + store_name + ".", dir=store_dir)
+
+    # mkdtemp makes the directory private to the owner
+    os.chmod(tmp_path, 0o755)
+
+    try:
+        _write_usage_store_dir(df, tmp_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # a directory can only be renamed over an empty one, so the old store
+    # is moved aside first and removed once the new one is in place
+    old_path = None
+    if os.path.isdir(store_path):
+        old_path = tempfile.mkdtemp(
+            prefix="." + store_name + ".old.", dir=store_dir
+        )
+        os.replace(store_path, os.path.join(old_path, store_name))
+
+    os.replace(tmp_path, store_path)
+
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def _write_usage_store_dir(df, store_path):
+    """Writes the Parquet dataset of a usage store to an empty directory"""
+
+    store_df = df.reset_index(drop=True)
+
+    for col in CONST_CATEGORICAL_COLS:
+        if col in store_df.columns:
+            store_df[col] = store_df[col].astype("category")
+
+    store_df[CONST_COL_NAME_YM] = store_df[CONST_COL_NAME_DATE].dt.strftime(
+        "%Y-%m"
+    )
+
+    pq.write_to_dataset(
+        pa.Table.from_pandas(store_df, preserve_index=False),
+        store_path,
+        partition_cols=[CONST_COL_NAME_YM],
+    )
+
+
+def read_usage_store(store_path):
+    """
+    Reads in usage from a columnar store created with write_usage_store.
+    The Parquet files are memory-mapped rather than parsed like csv files.
+
+    Args:
+        store_path - path to the store directory
+    Returns:
+        raw usage dataframe
+    """
+
+    if not os.path.isdir(store_path):
+        return pd.DataFrame()
+
+    df = pq.read_table(store_path, memory_map=True).to_pandas()
+
+    return df.drop(columns=[CONST_COL_NAME_YM])
+
+
 # NO UNIT TESTS FOR ALL THE FOLLWING FUNCTIONS
 
 def check_missing_data(df, date_from, date_to, ignore_from_today=True):
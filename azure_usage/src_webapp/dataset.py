@@ -0,0 +1,328 @@
+#!/usr/bin/python
+"""
+Process-wide store for the Azure usage dataset.
+
+The usage data is loaded once per process and shared read-only by all the
+Bokeh sessions. When the data directory changes (new export files or a new
+update.log), the dataset is reloaded and swapped atomically, so sessions that
+are already open keep working with the snapshot they started with.
+"""
+
+import os
+import time
+import hashlib
+import resource
+import threading
+
+from .constants import (
+    DATA_FOLDER,
+    TIMESTAMP_FILE,
+    USAGE_STORE_FOLDER,
+    CONST_FLOAT32_QUANTITY,
+    CONST_COL_NAME_DATE,
+)
+from .data_loader import (
+    create_dataframe,
+    read_usage_store,
+    compact_dataframe,
+)
+from .query import SubscriptionIndex
+from .subs import SubscriptionNames
+from .totals import create_daily_cube, create_global_cube, group_day
+from .utilities import read_timestamp
+
+GLOBAL_PWD = os.path.dirname(os.path.realpath(__file__))
+
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.join(GLOBAL_PWD, "..", ".."), DATA_FOLDER
+)
+
+# The dataset currently served and the lock guarding its replacement
+GLOBAL_DATASET = None
+GLOBAL_DATASET_LOCK = threading.Lock()
+
+# Held while a refresh is in flight, overlapping refreshes are skipped
+GLOBAL_REFRESH_LOCK = threading.Lock()
+
+
+class UsageDataset:
+    """
+    An immutable snapshot of the usage data together with its load metrics.
+
+    Both the raw usage and the daily cube are kept sorted by subscription
+    and date, each with a SubscriptionIndex to query it. The usage of all
+    the subscriptions together (ALLMODE) is pre-aggregated by day and
+    service, and by day, both sorted by date.
+
+    Args:
+        raw_index - SubscriptionIndex of the raw usage dataframe
+        cube_index - SubscriptionIndex of the usage pre-aggregated by
+            subscription, day and service (see totals.create_daily_cube)
+        global_cube - usage of all the subscriptions pre-aggregated by day
+            and service (see totals.create_global_cube)
+        sub_names - SubscriptionNames with the name history of the
+            subscriptions
+        last_update - time stamp when the data was prepared
+        data_path - path to the data directory the snapshot was read from
+        version - fingerprint of the data directory at load time
+        load_time - time taken to load the data (seconds)
+    """
+
+    def __init__(
+        self,
+        raw_index,
+        cube_index,
+        global_cube,
+        sub_names,
+        last_update,
+        data_path,
+        version,
+        load_time,
+    ):
+        self.raw_index = raw_index
+        self.cube_index = cube_index
+        self.raw_usage = raw_index.df
+        self.daily_cube = cube_index.df
+        self.global_cube = global_cube
+        self.sub_names = sub_names
+
+        if CONST_COL_NAME_DATE in global_cube.columns:
+            self.global_daily = group_day(global_cube)
+        else:
+            self.global_daily = global_cube
+
+        # recorded once, so that slicing the date range of a query does not
+        # scan all the dates again (see query.slice_date_range)
+        self.global_sorted = all(
+            CONST_COL_NAME_DATE not in df.columns
+            or df[CONST_COL_NAME_DATE].is_monotonic_increasing
+            for df in [self.global_cube, self.global_daily]
+        )
+
+        self.last_update = last_update
+        self.data_path = data_path
+        self.version = version
+        self.load_time = load_time
+        self.memory_usage = int(
+            self.raw_usage.memory_usage(index=True, deep=True).sum()
+        )
+
+    def metrics(self):
+        """Returns a dictionary with the load metrics of the snapshot"""
+
+        return {
+            "version": self.version,
+            "rows": len(self.raw_usage.index),
+            "cube_rows": len(self.daily_cube.index),
+            "global_cube_rows": len(self.global_cube.index),
+            "load_time": self.load_time,
+            "memory_usage": self.memory_usage,
+            "max_rss": get_max_rss(),
+        }
+
+
+def get_max_rss():
+    """Returns the peak resident set size of the process in bytes"""
+
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def readin_data(data_path=None):
+    """Reads in raw Azure usage data.
+
+    The columnar usage store written by prep_data.py is preferred over the
+    csv files when it is present. The data is held in the compact in-memory
+    schema (see data_loader.compact_dataframe).
+
+    Args:
+        data_path - path to the data directory, defaults to DATA_FOLDER
+    Returns:
+        dataframe with the read in data and the last update time stamp
+    """
+
+    if data_path is None:
+        _data_path = DEFAULT_DATA_PATH
+    else:
+        _data_path = data_path
+
+    store_path = os.path.join(_data_path, USAGE_STORE_FOLDER)
+
+    if os.path.isdir(store_path):
+        raw_usage = read_usage_store(store_path)
+    else:
+        raw_usage = create_dataframe(_data_path)
+
+    raw_usage = compact_dataframe(
+        raw_usage, float32_quantity=CONST_FLOAT32_QUANTITY
+    )
+
+    last_update = read_timestamp(os.path.join(_data_path, TIMESTAMP_FILE))
+
+    return raw_usage, last_update
+
+
+def get_data_version(data_path=None):
+    """
+    Fingerprints the data directory using the names, sizes and modification
+        times of the usage files (csv or the columnar store) and of the time
+        stamp file.
+
+    Args:
+        data_path - path to the data directory, defaults to DATA_FOLDER
+    Returns:
+        a hex digest identifying the current state of the directory
+    """
+
+    if data_path is None:
+        data_path = DEFAULT_DATA_PATH
+
+    entries = []
+
+    for directory, dir_names, file_names in os.walk(data_path):
+        dir_names.sort()
+
+        for name in sorted(file_names):
+            if not (
+                name.endswith(".csv")
+                or name.endswith(".parquet")
+                or name == TIMESTAMP_FILE
+            ):
+                continue
+
+            file_path = os.path.join(directory, name)
+            stat = os.stat(file_path)
+            entries.append(
+                "{}:{}:{}".format(
+                    os.path.relpath(file_path, data_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+            )
+
+    return hashlib.sha1("\n".join(entries).encode("utf-8")).hexdigest()
+
+
+def load_dataset(data_path=None):
+    """
+    Loads the usage data and makes it the dataset served to new sessions.
+
+    Args:
+        data_path - path to the data directory, defaults to DATA_FOLDER
+    Returns:
+        the newly loaded UsageDataset
+    """
+
+    global GLOBAL_DATASET
+
+    if data_path is None:
+        data_path = DEFAULT_DATA_PATH
+
+    version = get_data_version(data_path)
+
+    time_st = time.perf_counter()
+    raw_usage, last_update = readin_data(data_path)
+    raw_index = SubscriptionIndex(raw_usage)
+    cube_index = SubscriptionIndex(create_daily_cube(raw_index.df))
+    global_cube = create_global_cube(cube_index.df)
+    sub_names = SubscriptionNames(raw_index)
+    load_time = time.perf_counter() - time_st
+
+    # the sorted copy held by the index replaces the loaded dataframe
+    del raw_usage
+
+    dataset = UsageDataset(
+        raw_index,
+        cube_index,
+        global_cube,
+        sub_names,
+        last_update,
+        data_path,
+        version,
+        load_time,
+    )
+
+    with GLOBAL_DATASET_LOCK:
+        GLOBAL_DATASET = dataset
+
+    print(
+        "Loaded usage dataset {version}: {rows} rows ({cube_rows} in the "
+        "daily cube) in {load_time:.2f}s, "
+        "{memory_usage:,d} bytes (max RSS {max_rss:,d} bytes)".format(
+            **dataset.metrics()
+        )
+    )
+
+    return dataset
+
+
+def get_dataset(data_path=None):
+    """
+    Returns the dataset currently served, loading it on first use.
+
+    Args:
+        data_path - path to the data directory, defaults to DATA_FOLDER
+    Returns:
+        UsageDataset
+    """
+
+    dataset = GLOBAL_DATASET
+
+    if dataset is None:
+        dataset = load_dataset(data_path)
+
+    return dataset
+
+
+def refresh_dataset(data_path=None):
+    """
+    Reloads the dataset if the data directory has changed since it was
+        loaded.
+
+    A refresh started while another one is still running (e.g. a periodic
+    check firing during a slow reload) returns straight away.
+
+    Args:
+        data_path - path to the data directory, defaults to the path of the
+            dataset currently served
+    Returns:
+        True if a new dataset was loaded, False otherwise
+    """
+
+    if not GLOBAL_REFRESH_LOCK.acquire(blocking=False):
+        return False
+
+    try:
+        return _refresh_dataset(data_path)
+    finally:
+        GLOBAL_REFRESH_LOCK.release()
+
+
+def _refresh_dataset(data_path):
+    """Reloads the dataset if the data directory has changed"""
+
+    dataset = GLOBAL_DATASET
+
+    if data_path is None:
+        data_path = (
+            dataset.data_path if dataset is not None else DEFAULT_DATA_PATH
+        )
+
+    if dataset is not None and dataset.data_path == data_path:
+        if dataset.version == get_data_version(data_path):
+            return False
+
+    load_dataset(data_path)
+
+    return True
+
+
+def get_dataset_metrics():
+    """Returns load metrics of the dataset currently served"""
+
+    dataset = GLOBAL_DATASET
+
+    if dataset is None:
+        return None
+
+    return dataset.metrics()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+Persistent per-file cache of parsed Azure usage files.
+
+Each usage file is cached as a Feather (Arrow IPC) file holding the frame
+produced by data_loader.read_usage_file, i.e. with the Date column already
+parsed and EduHub columns normalised. A small JSON manifest stores the
+fingerprint of the source file (path, size, modification time and content
+hash) the cached frame was created from, and the format version of the
+cache. Entries written with another format version are treated as misses.
+"""
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+from .constants import CONST_ENCODING
+
+# bump when the parsed frames change, e.g. a new column or dtype
+CACHE_FORMAT_VERSION = 1
+
+CACHE_FRAME_EXT = ".feather"
+CACHE_MANIFEST_EXT = ".json"
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(file_path):
+    """Returns the sha1 hex digest of a file's content"""
+
+    sha1 = hashlib.sha1()
+
+    with open(file_path, "rb") as file_obj:
+        for block in iter(lambda: file_obj.read(HASH_BLOCK_SIZE), b""):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def _cache_key(file_path):
+    """Name of the cache entry for a usage file"""
+
+    key = "{}:{}".format(CACHE_FORMAT_VERSION, os.path.abspath(file_path))
+
+    return hashlib.sha1(key.encode(CONST_ENCODING)).hexdigest()
+
+
+def _cache_paths(cache_dir, file_path):
+    """Paths to the cached frame and the manifest of a usage file"""
+
+    key = _cache_key(file_path)
+
+    return (
+        os.path.join(cache_dir, key + CACHE_FRAME_EXT),
+        os.path.join(cache_dir, key + CACHE_MANIFEST_EXT),
+    )
+
+
+def _read_manifest(manifest_path):
+    """Reads in a cache manifest, returns None if it cannot be read"""
+
+    try:
+        with open(manifest_path, "r", encoding=CONST_ENCODING) as file_obj:
+            return json.load(file_obj)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(manifest_path, manifest):
+    """Writes a cache manifest"""
+
+    with open(manifest_path, "w", encoding=CONST_ENCODING) as file_obj:
+        json.dump(manifest, file_obj)
+
+
+def load_cached_frame(cache_dir, file_path):
+    """
+    Returns the cached frame of a usage file if the file has not changed
+        since it was cached.
+
+    Size and modification time are checked first; the content hash is only
+    computed when they differ, so that a file which was merely touched or
+    copied is still served from the cache.
+
+    Args:
+        cache_dir - cache directory
+        file_path - path to the usage file
+    Returns:
+        the cached dataframe or None on a cache miss
+    """
+
+    frame_path, manifest_path = _cache_paths(cache_dir, file_path)
+
+    manifest = _read_manifest(manifest_path)
+
+    if manifest is None or not os.path.exists(frame_path):
+        return None
+
+    if manifest.get("version") != CACHE_FORMAT_VERSION:
+        return None
+
+    stat = os.stat(file_path)
+
+    if manifest["path"] != os.path.abspath(file_path):
+        return None
+
+    if manifest["size"] != stat.st_size:
+        return None
+
+    if manifest["mtime"] != stat.st_mtime_ns:
+        if manifest["hash"] != hash_file(file_path):
+            return None
+
+        # same content, refreshing the fingerprint
+        manifest["mtime"] = stat.st_mtime_ns
+        _write_manifest(manifest_path, manifest)
+
+    return pd.read_feather(frame_path)
+
+
+def store_cached_frame(cache_dir, file_path, df):
+    """
+    Stores the parsed frame of a usage file in the cache.
+
+    Args:
+        cache_dir - cache directory
+        file_path - path to the usage file
+        df - parsed dataframe of the usage file
+    """
+
+    # several workers may create the directory at once
+    os.makedirs(cache_dir, exist_ok=True)
+
+    frame_path, manifest_path = _cache_paths(cache_dir, file_path)
+
+    stat = os.stat(file_path)
+
+    df.reset_index(drop=True).to_feather(frame_path)
+
+    _write_manifest(
+        manifest_path,
+        {
+            "version": CACHE_FORMAT_VERSION,
+            "path": os.path.abspath(file_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": hash_file(file_path),
+        },
+    )
+
+
+def clear_cache(cache_dir):
+    """
+    Removes all the cached frames and manifests from a cache directory.
+
+    Args:
+        cache_dir - cache directory
+    Returns:
+        number of removed cache entries
+    """
+
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    removed_cnt = 0
+
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(CACHE_FRAME_EXT):
+            removed_cnt += 1
+        elif not filename.endswith(CACHE_MANIFEST_EXT):
+            continue
+
+        os.remove(os.path.join(cache_dir, filename))
+
+    return removed_cnt
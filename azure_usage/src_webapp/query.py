@@ -0,0 +1,210 @@
+#!/usr/bin/python
+"""
+Python module to query usage data by subscription and date range.
+
+A SubscriptionIndex keeps a usage dataframe sorted by SubscriptionGuid and
+then by Date, together with the offsets of the rows of each subscription.
+The rows of a subscription are then returned by slicing instead of scanning
+the whole history, and a date range within a subscription is found by
+binary search.
+
+slice_date_range does the same binary search on a whole dataframe sorted by
+Date, e.g. the usage of one or more subscriptions.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .constants import CONST_COL_NAME_SGUID, CONST_COL_NAME_DATE
+
+
+def get_date_range_positions(dates, date_from=None, date_to=None):
+    """
+    Finds a date range in a sorted array of dates by binary search.
+
+    Args:
+        dates - sorted datetime64 array
+        date_from - first day of the range (inclusive), None for no limit
+        date_to - last day of the range (inclusive), None for no limit
+    Returns:
+        a (start, stop) tuple of positions, start == stop if there are no
+        dates in the range
+    """
+
+    start = 0
+    stop = len(dates)
+
+    if date_from is not None:
+        start = int(
+            np.searchsorted(
+                dates, pd.Timestamp(date_from).to_datetime64(), "left"
+            )
+        )
+
+    if date_to is not None:
+        stop = int(
+            np.searchsorted(
+                dates, pd.Timestamp(date_to).to_datetime64(), "right"
+            )
+        )
+
+    return start, max(start, stop)
+
+
+def slice_date_range(df, date_from=None, date_to=None, is_sorted=None):
+    """
+    Returns the rows of a usage dataframe within a date range.
+
+    The range is found by binary search when the dataframe is sorted by
+    Date, which is O(log n) plus the size of the output instead of two
+    boolean masks over the whole dataframe. An unsorted dataframe is
+    filtered with the boolean masks, keeping the order of its rows.
+
+    Checking whether the dataframe is sorted is itself a scan of all its
+    dates, so callers querying the same dataframe repeatedly should record
+    it once (see dataset.UsageDataset) and pass it in.
+
+    Args:
+        df - usage dataframe
+        date_from - first day of the range (inclusive), None for no limit
+        date_to - last day of the range (inclusive), None for no limit
+        is_sorted - whether the dataframe is sorted by Date, None to check
+    Returns:
+        dataframe with the rows in the range
+    """
+
+    if df.empty:
+        return df
+
+    dates = df[CONST_COL_NAME_DATE]
+
+    if is_sorted is None:
+        is_sorted = dates.is_monotonic_increasing
+
+    if not is_sorted:
+        mask = np.ones(len(dates), dtype=bool)
+
+        if date_from is not None:
+            mask &= (dates >= pd.Timestamp(date_from)).values
+        if date_to is not None:
+            mask &= (dates <= pd.Timestamp(date_to)).values
+
+        return df[mask]
+
+    start, stop = get_date_range_positions(dates.values, date_from, date_to)
+
+    return df.iloc[start:stop]
+
+
+class SubscriptionIndex:
+    """
+    An index of a usage dataframe by subscription.
+
+    The index is built once per dataset version and is read-only afterwards,
+    so it can be shared by all the sessions.
+
+    Args:
+        df - usage dataframe with SubscriptionGuid and Date columns
+    """
+
+    def __init__(self, df):
+
+        self._slices = {}
+
+        if CONST_COL_NAME_SGUID not in df.columns or df.empty:
+            self.df = df
+            self._dates = None
+            return
+
+        codes, uniques = pd.factorize(df[CONST_COL_NAME_SGUID], sort=True)
+        dates = df[CONST_COL_NAME_DATE].values
+
+        # sorted by subscription, then by date (stable, so the rows of a
+        # day keep their order)
+        order = np.lexsort((dates, codes))
+
+        if (order != np.arange(len(order))).any():
+            df = df.take(order)
+            codes = codes[order]
+            dates = dates[order]
+
+        self.df = df.reset_index(drop=True)
+        self._dates = dates
+
+        # missing ids (code -1) are sorted first and are not indexed
+        starts = np.searchsorted(codes, np.arange(len(uniques)), side="left")
+        stops = np.searchsorted(codes, np.arange(len(uniques)), side="right")
+
+        for sub_id, start, stop in zip(uniques, starts, stops):
+            self._slices[sub_id] = (int(start), int(stop))
+
+    @property
+    def sub_ids(self):
+        """Returns the subscription ids found in the data"""
+
+        return list(self._slices.keys())
+
+    def get_slice(self, sub_id, date_from=None, date_to=None):
+        """
+        Returns the positions of the rows of a subscription, optionally
+            limited to a date range.
+
+        Args:
+            sub_id - subscription id
+            date_from - first day of the range (inclusive), None for no limit
+            date_to - last day of the range (inclusive), None for no limit
+        Returns:
+            a (start, stop) tuple of row positions, (0, 0) if the
+            subscription is not in the data
+        """
+
+        start, stop = self._slices.get(sub_id, (0, 0))
+
+        if start == stop:
+            return 0, 0
+
+        range_start, range_stop = get_date_range_positions(
+            self._dates[start:stop], date_from, date_to
+        )
+
+        return start + range_start, start + range_stop
+
+    def get_rows(self, sub_ids, date_from=None, date_to=None):
+        """
+        Returns the rows of one or more subscriptions, optionally limited to
+            a date range.
+
+        The rows come in the order of the index (by subscription, then by
+        date), as a boolean filter of the indexed dataframe would return
+        them.
+
+        Args:
+            sub_ids - subscription id or a list of subscription ids
+            date_from - first day of the range (inclusive), None for no limit
+            date_to - last day of the range (inclusive), None for no limit
+        Returns:
+            dataframe with the selected rows
+        """
+
+        if isinstance(sub_ids, str):
+            sub_ids = [sub_ids]
+
+        slices = sorted(
+            set(
+                self.get_slice(sub_id, date_from, date_to)
+                for sub_id in sub_ids
+                if sub_id in self._slices
+            )
+        )
+        slices = [(start, stop) for start, stop in slices if start < stop]
+
+        if len(slices) == 0:
+            return self.df.iloc[0:0]
+
+        if len(slices) == 1:
+            start, stop = slices[0]
+            return self.df.iloc[start:stop]
+
+        return self.df.iloc[
+            np.concatenate([np.arange(start, stop) for start, stop in slices])
+        ]
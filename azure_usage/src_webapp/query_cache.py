@@ -0,0 +1,165 @@
+#!/usr/bin/python
+"""
+In-memory LRU cache of dashboard query results.
+
+Many sessions open the same bookmarked urls, i.e. run the same queries on
+the same dataset. Their results (the daily totals and top services frames)
+are cached per process and shared read-only by the sessions. The cache is
+capped both by the number of entries and by the estimated memory held by
+them, and is emptied when a new version of the dataset is served.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def estimate_size(value, seen=None):
+    """
+    Estimates the memory held by a cached value. Objects referenced more
+        than once (e.g. a dataframe shared by the updates of several top
+        services groupings) are counted once.
+
+    Args:
+        value - a dataframe, series, string, or a dictionary, list or tuple
+            of those
+        seen - ids of the objects already counted, used by the recursion
+    Returns:
+        estimated size in bytes
+    """
+
+    if seen is None:
+        seen = set()
+
+    if id(value) in seen:
+        return 0
+
+    seen.add(id(value))
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        size = value.memory_usage(deep=True)
+        return int(size.sum()) if isinstance(size, pd.Series) else int(size)
+
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(item, seen) for item in value.values()
+        )
+
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(
+            estimate_size(item, seen) for item in value
+        )
+
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of query results.
+
+    Cached values must not be modified by the callers, they are shared by
+    all the sessions of the process.
+
+    Args:
+        max_entries - maximum number of cached results
+        max_bytes - maximum estimated memory held by the cached results
+    """
+
+    def __init__(self, max_entries, max_bytes):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # the dataset version the cached results were computed from
+        self.version = None
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_version(self, version):
+        """
+        Sets the dataset version being served, the cache is emptied if it
+            changes.
+
+        Args:
+            version - fingerprint of the dataset (see UsageDataset.version)
+        """
+
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._bytes = 0
+                self.version = version
+
+    def get(self, key):
+        """
+        Returns a cached result and marks it as the most recently used.
+
+        Args:
+            key - hashable query key
+        Returns:
+            the cached result, None if the key is not cached
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Caches a result, evicting the least recently used results to stay
+            within the limits. Results larger than the memory limit are not
+            cached.
+
+        Args:
+            key - hashable query key
+            value - the result of the query
+        """
+
+        size = estimate_size(value)
+
+        if size > self.max_bytes or self.max_entries < 1:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while (
+                len(self._entries) > self.max_entries
+                or self._bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def metrics(self):
+        """Returns a dictionary with the counters of the cache"""
+
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -3,27 +3,44 @@
 Server module
 """
 
+import gc
+
 from bokeh.server.server import Server
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 from .bokeh_server import modify_doc
+from .constants import CONST_DATA_REFRESH_INTERVAL
+from .dataset import load_dataset, refresh_dataset
 
 
-def bk_worker(origin, bport):
+def bk_worker(origin, bport, workers=1):
     """A worker to run Bokeh application
 
     Args:
         origin - The origin of the websocket connections
         bport - The port of the Bokeh webapp
+        workers - The number of processes serving the sessions. With
+            more than one worker the data is not refreshed periodically and
+            the server has to be restarted to serve new data
     """
 
-    # Can't pass num_procs > 1 in this configuration. If you need to run
-    # multiple processes, see e.g. flask_gunicorn_embed.py
+    # Loading the usage data once, it is shared by all the sessions
+    load_dataset()
+
+    if workers > 1:
+        # The server forks the worker processes once the port is bound. The
+        # dataset loaded above is shared with them copy-on-write; freezing
+        # the loaded objects keeps the garbage collector from writing to
+        # (and so copying) their pages in every worker. Each worker creates
+        # its own IOLoop after the fork.
+        gc.freeze()
+        server_kwargs = {"num_procs": workers}
+    else:
+        server_kwargs = {"io_loop": IOLoop()}
 
     server = Server(
         {"/bokeh_server": modify_doc},
-        io_loop=IOLoop(),
         allow_websocket_origin=[
             "localhost",  # localhost access
             "turingazureusagetest.azurewebsites.net",
@@ -32,9 +49,27 @@ def bk_worker(origin, bport):
             "%s:%d" % (origin, int(bport)),  # origin access
         ],
         port=int(bport),
+        **server_kwargs,
     )
 
     server.start()
+
+    if workers > 1:
+        # Reloading in every worker would load one private copy of the data
+        # per process and lose the sharing with the parent, so the workers
+        # serve the data loaded at start-up and new data needs a restart
+        print(
+            "Serving with {} workers: the usage data is not refreshed, "
+            "restart the server to load new data".format(workers)
+        )
+    else:
+        # Checking periodically for new data, reloading it outside the
+        # IOLoop
+        PeriodicCallback(
+            lambda: server.io_loop.run_in_executor(None, refresh_dataset),
+            CONST_DATA_REFRESH_INTERVAL,
+        ).start()
+
     server.io_loop.start()
 
     return server
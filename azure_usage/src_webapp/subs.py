@@ -3,8 +3,8 @@
 Python module to perform operations related to subscriptions
 """
 
-import copy
 from math import pi
+import numpy as np
 import pandas as pd
 
 from bokeh.palettes import Category20c
@@ -15,7 +15,6 @@ from .constants import (
     CONST_COL_NAME_SERVICE,
     CONST_COL_NAME_SERVICENAME,
     CONST_COL_NAME_SERVICERESOURCE,
-    CONST_COL_NAME_SUM,
     CONST_NAME_OTHER,
     CONST_COL_NAME_PERC,
     CONST_COL_NAME_ANGLE,
@@ -25,27 +24,310 @@ from .constants import (
     CONST_RB_VALUE_1,
     CONST_RB_VALUE_2,
     CONST_RB_VALUE_3,
+    CONST_COL_NAME_SGUID,
+    CONST_COL_NAME_SNAME,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_DATE_FROM,
+    CONST_COL_NAME_DATE_TO,
 )
+from .query import SubscriptionIndex
 
 
 def get_data_for_subid(raw_data, sub_ids):
     """Filters data for a particular subscription id or a list of subscription ids
     Args:
-        raw_data: raw usage dataframe
+        raw_data: raw usage dataframe or a SubscriptionIndex of it, which
+            returns the rows by slicing instead of scanning the dataframe
         sub_ids: subscription id or a list of subscription ids
     """
 
+    if isinstance(raw_data, SubscriptionIndex):
+        if isinstance(sub_ids, (list,)):
+            return raw_data.get_rows(sub_ids)
+        else:
+            return raw_data.get_rows([sub_ids])
+
     if isinstance(sub_ids, (list,)):
         return raw_data[raw_data.SubscriptionGuid.isin(sub_ids)]
     else:
         return raw_data[raw_data.SubscriptionGuid == sub_ids]
 
 
+class SubscriptionNames:
+    """
+    The names of the subscriptions over time, built once per dataset
+        version from the raw usage sorted by a SubscriptionIndex.
+
+    The history holds one row per run of consecutive usage rows of a
+    subscription with the same name, with the first and the last day of
+    the run, ordered by subscription and date.
+
+    Args:
+        sub_index - SubscriptionIndex of the raw usage
+    """
+
+    def __init__(self, sub_index):
+
+        self._index = sub_index
+
+        df = sub_index.df
+
+        if df.empty or CONST_COL_NAME_SNAME not in df.columns:
+            self._run_starts = np.array([], dtype=np.int64)
+            self._run_names = np.array([], dtype=object)
+            self.history = pd.DataFrame(
+                columns=[
+                    CONST_COL_NAME_SGUID,
+                    CONST_COL_NAME_SNAME,
+                    CONST_COL_NAME_DATE_FROM,
+                    CONST_COL_NAME_DATE_TO,
+                ]
+            )
+            return
+
+        sub_codes = pd.factorize(df[CONST_COL_NAME_SGUID])[0]
+        name_codes = pd.factorize(df[CONST_COL_NAME_SNAME])[0]
+
+        # a run starts where the subscription or its name changes
+        run_start = np.ones(len(df.index), dtype=bool)
+        run_start[1:] = (sub_codes[1:] != sub_codes[:-1]) | (
+            name_codes[1:] != name_codes[:-1]
+        )
+
+        self._run_starts = np.flatnonzero(run_start)
+        run_stops = np.append(self._run_starts[1:], len(df.index))
+
+        self._run_names = df[CONST_COL_NAME_SNAME].to_numpy(dtype=object)[
+            self._run_starts
+        ]
+
+        dates = df[CONST_COL_NAME_DATE].values
+
+        self.history = pd.DataFrame(
+            {
+                CONST_COL_NAME_SGUID: df[CONST_COL_NAME_SGUID].to_numpy(
+                    dtype=object
+                )[self._run_starts],
+                CONST_COL_NAME_SNAME: self._run_names,
+                CONST_COL_NAME_DATE_FROM: dates[self._run_starts],
+                CONST_COL_NAME_DATE_TO: dates[run_stops - 1],
+            }
+        )
+
+    def get_history(self, sub_id):
+        """
+        Returns the name history of a subscription
+
+        Args:
+            sub_id - subscription id
+        Returns:
+            the rows of the history of the subscription
+        """
+
+        start, stop = self._index.get_slice(sub_id)
+
+        if start == stop:
+            return self.history.iloc[0:0]
+
+        first_run = np.searchsorted(self._run_starts, start, side="left")
+        stop_run = np.searchsorted(self._run_starts, stop, side="left")
+
+        return self.history.iloc[first_run:stop_run]
+
+    def get_latest_name(self, sub_id, date_from=None, date_to=None):
+        """
+        Returns the name a subscription used last, optionally within a
+            date range.
+
+        Args:
+            sub_id - subscription id
+            date_from - first day of the range (inclusive), None for no limit
+            date_to - last day of the range (inclusive), None for no limit
+        Returns:
+            subscription name, None if the subscription has no usage in the
+            date range
+        """
+
+        start, stop = self._index.get_slice(sub_id, date_from, date_to)
+
+        if start == stop:
+            return None
+
+        # the run holding the last row of the subscription within the range
+        run = np.searchsorted(self._run_starts, stop - 1, side="right") - 1
+
+        return self._run_names[run]
+
+    def get_latest_names(self, sub_ids, date_from=None, date_to=None):
+        """
+        Returns the names the subscriptions used last, optionally within a
+            date range.
+
+        Args:
+            sub_ids - a list of subscription ids
+            date_from - first day of the range (inclusive), None for no limit
+            date_to - last day of the range (inclusive), None for no limit
+        Returns:
+            a list of the names of the subscriptions with usage in the date
+            range, in the order of sub_ids
+        """
+
+        names = [
+            self.get_latest_name(sub_id, date_from, date_to)
+            for sub_id in sub_ids
+        ]
+
+        return [name for name in names if name is not None]
+
+
+def _factorize_column(column):
+    """
+    Returns integer codes of the values of a column (-1 for missing values)
+        and the values the codes refer to. The codes of categorical columns
+        are used as they are.
+    """
+
+    if pd.api.types.is_categorical_dtype(column.dtype):
+        codes = column.cat.codes.to_numpy(dtype=np.int64)
+        uniques = column.cat.categories
+    else:
+        codes, uniques = pd.factorize(column)
+
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def _get_service_labels(group_keys, col_uniques):
+    """
+    Formats the Service labels of the groups of services
+
+    Args:
+        group_keys - integer keys combining the codes of the service columns
+        col_uniques - the values the codes of each service column refer to
+    Returns:
+        array of labels, the values of the service columns joined by ": "
+    """
+
+    group_keys = np.asarray(group_keys, dtype=np.int64)
+
+    parts = []
+    for uniques in reversed(col_uniques):
+        group_keys, codes = np.divmod(group_keys, len(uniques))
+        parts.insert(0, pd.Series(uniques[codes], dtype=object))
+
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + ": " + part
+
+    return labels.to_numpy(dtype=object)
+
+
+def _select_top_groups(group_costs, group_keys, col_uniques, top_cnt):
+    """
+    Selects the groups of services with the highest costs by partial
+        sorting. Of the groups with the same cost as the last one selected,
+        those with the first labels are taken.
+
+    Args:
+        group_costs - summed cost of each group
+        group_keys - integer keys of the groups (see _get_service_labels)
+        col_uniques - the values the codes of each service column refer to
+        top_cnt - the number of groups to select
+    Returns:
+        positions of the selected groups (unordered)
+    """
+
+    if len(group_costs) <= top_cnt:
+        return np.arange(len(group_costs))
+
+    if top_cnt <= 0:
+        return np.array([], dtype=np.int64)
+
+    last_cost = group_costs[
+        np.argpartition(-group_costs, top_cnt - 1)[top_cnt - 1]
+    ]
+
+    above_groups = np.flatnonzero(group_costs > last_cost)
+    tied_groups = np.flatnonzero(group_costs == last_cost)
+
+    tied_labels = _get_service_labels(group_keys[tied_groups], col_uniques)
+    tied_groups = tied_groups[np.argsort(tied_labels, kind="mergesort")]
+
+    return np.concatenate(
+        [above_groups, tied_groups[: top_cnt - len(above_groups)]]
+    )
+
+
+def group_services(raw_data_df):
+    """
+    Sums the costs of usage by service at the finest grain, i.e. by
+        ServiceName, ServiceType and ServiceResource, in a single pass.
+
+    All the groupings of get_top_services are rolled up from the result as
+    from the usage itself, but over a few hundred rows instead of the rows
+    of the usage. Missing values are kept as a group of their own, so each
+    grouping leaves out the same costs.
+
+    Args:
+        raw_data_df - usage dataframe
+    Returns:
+        dataframe with the categorical service columns and the Cost of each
+        service, None if raw_data_df is not a dataframe or has no columns
+    """
+
+    if not isinstance(raw_data_df, pd.DataFrame):
+        return None
+
+    if raw_data_df.empty and len(raw_data_df.columns) == 0:
+        return None
+
+    service_cols = [
+        CONST_COL_NAME_SERVICENAME,
+        CONST_COL_NAME_SERVICETYPE,
+        CONST_COL_NAME_SERVICERESOURCE,
+    ]
+
+    # an integer key of the service of each row, missing values are code 0
+    row_keys = np.zeros(len(raw_data_df.index), dtype=np.int64)
+    col_uniques = []
+
+    for col in service_cols:
+        codes, uniques = _factorize_column(raw_data_df[col])
+        row_keys = row_keys * (len(uniques) + 1) + codes + 1
+        col_uniques.append(uniques)
+
+    costs = np.nan_to_num(
+        raw_data_df[CONST_COL_NAME_COST].to_numpy(dtype=np.float64)
+    )
+
+    # summing the costs of each service
+    row_groups, group_keys = pd.factorize(row_keys)
+    group_costs = np.bincount(
+        row_groups, weights=costs, minlength=len(group_keys)
+    ).astype(np.float64)
+
+    # decoding the keys into the codes of each service column
+    group_keys = np.asarray(group_keys, dtype=np.int64)
+    services = {}
+
+    for col, uniques in reversed(list(zip(service_cols, col_uniques))):
+        group_keys, codes = np.divmod(group_keys, len(uniques) + 1)
+        services[col] = pd.Categorical.from_codes(codes - 1, uniques)
+
+    services[CONST_COL_NAME_COST] = group_costs
+
+    return pd.DataFrame(services, columns=service_cols + [CONST_COL_NAME_COST])
+
+
 def get_top_services(
     raw_data_df, top_services_num=None, top_services_grp_md=CONST_RB_DEFAULT
 ):
     """
     Prepares top services dataframe
+
+    The services are grouped on integer codes of the service columns, so
+    the raw data is neither copied nor turned into strings. The top
+    services are selected by partial sorting and only their labels are
+    formatted.
     """
 
     # checking if raw_data_df is a pandas dataframe
@@ -61,74 +343,94 @@ def get_top_services(
     else:
         top_services_cnt = top_services_num
 
-    grp_srv = copy.copy(raw_data_df)
-
-    # creating new column to hold information about service
+    # columns combined into the service label of the grouping
     if top_services_grp_md == CONST_RB_VALUE_1:
-        grp_srv[CONST_COL_NAME_SERVICE] = (
-            grp_srv[CONST_COL_NAME_SERVICENAME]
-            + ": "
-            + grp_srv[CONST_COL_NAME_SERVICETYPE]
-            + ": "
-            + grp_srv[CONST_COL_NAME_SERVICERESOURCE]
-        )
+        service_cols = [
+            CONST_COL_NAME_SERVICENAME,
+            CONST_COL_NAME_SERVICETYPE,
+            CONST_COL_NAME_SERVICERESOURCE,
+        ]
     elif top_services_grp_md == CONST_RB_VALUE_2:
-        grp_srv[CONST_COL_NAME_SERVICE] = (
-            grp_srv[CONST_COL_NAME_SERVICENAME]
-            + ": "
-            + grp_srv[CONST_COL_NAME_SERVICETYPE]
-        )
+        service_cols = [CONST_COL_NAME_SERVICENAME, CONST_COL_NAME_SERVICETYPE]
     elif top_services_grp_md == CONST_RB_VALUE_3:
-        grp_srv[CONST_COL_NAME_SERVICE] = (
-            grp_srv[CONST_COL_NAME_SERVICENAME]
-            + ": "
-            + grp_srv[CONST_COL_NAME_SERVICERESOURCE]
-        )
+        service_cols = [
+            CONST_COL_NAME_SERVICENAME,
+            CONST_COL_NAME_SERVICERESOURCE,
+        ]
     else:
-        grp_srv[CONST_COL_NAME_SERVICE] = grp_srv[CONST_COL_NAME_SERVICETYPE]
+        service_cols = [CONST_COL_NAME_SERVICETYPE]
 
-    # grouping the data
-    grp_srv = (
-        grp_srv.groupby([CONST_COL_NAME_SERVICE])[CONST_COL_NAME_COST]
-        .agg(CONST_COL_NAME_SUM)
-        .reset_index()
-    )
+    # an integer key of the service of each row, rows with a missing value
+    # in any of the service columns have no service and are left out
+    row_keys = np.zeros(len(raw_data_df.index), dtype=np.int64)
+    has_service = np.ones(len(raw_data_df.index), dtype=bool)
+    col_uniques = []
 
-    # truncating service column's values
-    grp_srv[CONST_COL_NAME_SERVICE] = grp_srv[CONST_COL_NAME_SERVICE].str[
-        :CONST_MAX_SERVICE_LENGTH
-    ]
+    for col in service_cols:
+        codes, uniques = _factorize_column(raw_data_df[col])
+        row_keys = row_keys * len(uniques) + codes
+        has_service &= codes >= 0
+        col_uniques.append(uniques)
 
-    # sorting and reseting index
-    grp_srv = grp_srv.sort_values(CONST_COL_NAME_COST, ascending=False)
-    grp_srv.reset_index(inplace=True, drop=True)
+    costs = raw_data_df[CONST_COL_NAME_COST].to_numpy(dtype=np.float64)
 
-    # Creating a dataframe with the line Other, i.e. <= min_cost
-    if len(grp_srv.index) > top_services_cnt:
+    row_keys = row_keys[has_service]
+    costs = np.nan_to_num(costs[has_service])
 
-        top_srv = grp_srv.iloc[:top_services_cnt]
+    # summing the costs of each service
+    row_groups, group_keys = pd.factorize(row_keys)
+    group_costs = np.bincount(
+        row_groups, weights=costs, minlength=len(group_keys)
+    ).astype(np.float64)
 
-        other_temp_df = grp_srv.iloc[top_services_cnt:]
-        other_sum = other_temp_df[CONST_COL_NAME_COST].agg(CONST_COL_NAME_SUM)
-        other_df = pd.DataFrame(
-            [[CONST_NAME_OTHER + " (%d)" % (len(other_temp_df)), other_sum]],
-            columns=[CONST_COL_NAME_SERVICE, CONST_COL_NAME_COST],
-        )
+    # selecting the top services, the rest is summed up as Other
+    other_cnt = max(len(group_keys) - top_services_cnt, 0)
+
+    top_groups = _select_top_groups(
+        group_costs, group_keys, col_uniques, top_services_cnt
+    )
 
+    if other_cnt > 0:
+        other_mask = np.ones(len(group_keys), dtype=bool)
+        other_mask[top_groups] = False
+        other_sum = group_costs[other_mask].sum()
     else:
-        top_srv = copy.copy(grp_srv)
         other_sum = 0
 
-    # Combining the data frames
+    top_costs = group_costs[top_groups]
+    top_labels = _get_service_labels(group_keys[top_groups], col_uniques)
+
+    # sorting by cost, services with the same cost by their label
+    order = sorted(
+        range(len(top_groups)), key=lambda i: (-top_costs[i], top_labels[i])
+    )
+
+    top_srv = pd.DataFrame(
+        {
+            # truncating service labels
+            CONST_COL_NAME_SERVICE: np.array(
+                [top_labels[i][:CONST_MAX_SERVICE_LENGTH] for i in order],
+                dtype=object,
+            ),
+            CONST_COL_NAME_COST: top_costs[order],
+        },
+        columns=[CONST_COL_NAME_SERVICE, CONST_COL_NAME_COST],
+    )
+
+    # Combining the top services with the line Other
     if other_sum > 0:
-        top_srv = top_srv.append(other_df)
-        top_srv = top_srv.sort_values(CONST_COL_NAME_COST, ascending=False)
+        other_df = pd.DataFrame(
+            [[CONST_NAME_OTHER + " (%d)" % (other_cnt), other_sum]],
+            columns=[CONST_COL_NAME_SERVICE, CONST_COL_NAME_COST],
+        )
+        top_srv = pd.concat([top_srv, other_df])
+        top_srv = top_srv.sort_values(
+            CONST_COL_NAME_COST, ascending=False, kind="mergesort"
+        )
 
     # Adding percentage column
     top_sum = top_srv[CONST_COL_NAME_COST].sum()
 
-    top_srv = top_srv.copy()
-
     if top_sum > 0:
         top_srv[CONST_COL_NAME_PERC] = top_srv[CONST_COL_NAME_COST] / top_sum
     else:
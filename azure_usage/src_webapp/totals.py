@@ -3,16 +3,87 @@
 Python module to perform operations related to aggregated numbers.
 """
 
+import numpy as np
 import pandas as pd
 
-from dateutil.relativedelta import relativedelta
-
 from .constants import (
     CONST_COL_NAME_SGUID,
     CONST_COL_NAME_YM,
     CONST_COL_NAME_DATE,
     CONST_COL_NAME_COST,
+    CONST_COL_NAME_QUANTITY,
+    CONST_CUBE_COLS,
+    CONST_COL_NAME_END,
+    CONST_MAX_BARS,
+    CONST_RESOLUTION_WEEK,
+    CONST_RESOLUTION_MONTH,
+    CONST_RESOLUTION_DAY,
+    CONST_COL_NAME_CUMULATIVE,
+    CONST_COL_NAME_ROLLING,
+    CONST_ROLLING_WINDOWS,
 )
+from .utilities import diff_month
+
+
+def create_daily_cube(raw_data):
+    """
+    Pre-aggregates raw usage to summed Cost and Quantity per subscription,
+        calender day and service (ServiceName, ServiceType and
+        ServiceResource), sorted by subscription and day.
+
+    The cube has all the columns group_day and get_top_services use, so
+    both give the same results on the cube as on the raw usage.
+
+    Args:
+        raw_data: raw usage data framework
+    Returns:
+        cube_df: dataframe of the pre-aggregated usage
+    """
+
+    if raw_data.empty and len(raw_data.columns) == 0:
+        return pd.DataFrame()
+
+    cube_cols = [col for col in CONST_CUBE_COLS if col in raw_data.columns]
+    value_cols = [
+        col
+        for col in [CONST_COL_NAME_COST, CONST_COL_NAME_QUANTITY]
+        if col in raw_data.columns
+    ]
+
+    if raw_data.empty:
+        return raw_data[cube_cols + value_cols].reset_index(drop=True)
+
+    # grouping by the factorized keys keeps rows with missing keys (e.g. no
+    # ServiceResource) in groups of their own instead of dropping them
+    keys = [pd.factorize(raw_data[col], sort=True)[0] for col in cube_cols]
+
+    grouped = raw_data[value_cols].groupby(keys, sort=True)
+
+    cube_df = grouped.sum().reset_index(drop=True)
+
+    # the key values are taken from the first row of each group
+    _, first_rows = np.unique(grouped.ngroup().values, return_index=True)
+
+    for col_idx, col in enumerate(cube_cols):
+        cube_df.insert(col_idx, col, raw_data[col].iloc[first_rows].values)
+
+    return cube_df
+
+
+def create_global_cube(daily_cube):
+    """
+    Aggregates the daily cube over all the subscriptions: summed Cost and
+        Quantity per calender day and service, sorted by day.
+
+    Args:
+        daily_cube: dataframe returned by create_daily_cube
+    Returns:
+        global_cube_df: dataframe of the usage of all the subscriptions
+    """
+
+    return create_daily_cube(
+        daily_cube.drop(columns=[CONST_COL_NAME_SGUID], errors="ignore")
+    )
 
 
 def group_day(raw_data, add_missing_days=False):
@@ -42,8 +113,6 @@ def group_day(raw_data, add_missing_days=False):
 
     raw_data_gr["Date"] = pd.to_datetime(raw_data_gr["Date"])
 
-    raw_data_gr["Date_str"] = raw_data_gr["Date"].dt.strftime("%Y-%m-%d")
-
     # raw_data_gr['Date_id'] = [x for x in range(raw_data_gr.shape[0])]
 
     raw_data_gr.reset_index(drop=True, inplace=True)
@@ -51,36 +120,367 @@ def group_day(raw_data, add_missing_days=False):
     return raw_data_gr
 
 
-def add_missing_year_months(df, date_from, date_to, value_col_name):
+def get_running_total_cols(windows=CONST_ROLLING_WINDOWS):
+    """
+    Returns the names of the running total columns: the cumulative cost and
+        the moving average cost of each window
+    """
+
+    return [CONST_COL_NAME_CUMULATIVE] + [
+        CONST_COL_NAME_ROLLING.format(window) for window in windows
+    ]
+
+
+def calc_running_totals(group_codes, days, costs, windows):
+    """
+    Calculates the cumulative costs and the moving averages of daily costs
+        of one or more groups (e.g. subscriptions) at once.
+
+    All the running totals come from one cumulative sum over the rows: the
+    sum over a window is the difference of the cumulative sums at its ends,
+    and the start of each window is found by binary search. The work does
+    not depend on the length of the windows. The windows are calender days,
+    days without a row count as no cost. Until a group has a full window of
+    days, its averages are over the days since its first day.
+
+    Args:
+        group_codes - integer code of the group of each row
+        days - integer calender day of each row
+        costs - cost of each row
+        windows - lengths (days) of the moving averages
+    Returns:
+        dictionary of the running total columns (see get_running_total_cols)
+    """
+
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+
+    positions = np.arange(len(costs))
+
+    cum_costs = np.zeros(len(costs) + 1)
+    np.cumsum(
+        np.nan_to_num(np.asarray(costs, dtype=np.float64)), out=cum_costs[1:]
+    )
+
+    # the first row of the group of each row
+    new_groups = np.ones(len(costs), dtype=bool)
+    new_groups[1:] = group_codes[1:] != group_codes[:-1]
+    group_starts = np.maximum.accumulate(np.where(new_groups, positions, 0))
+
+    totals = {
+        CONST_COL_NAME_CUMULATIVE: cum_costs[positions + 1]
+        - cum_costs[group_starts]
+    }
+
+    if len(costs) == 0:
+        days_span = 1
+    else:
+        days = days - days.min()
+        days_span = days.max() + 1
+
+    # keys sorted by group and day, a window starting before the first day
+    # of a group is cut at the group start
+    keys = group_codes * days_span + days
+
+    # days from the first day of the group to the day of each row
+    group_days = days - days[group_starts] + 1
+
+    for window in windows:
+        window_starts = np.maximum(
+            np.searchsorted(keys, keys - window, side="right"), group_starts
+        )
+        totals[CONST_COL_NAME_ROLLING.format(window)] = (
+            cum_costs[positions + 1] - cum_costs[window_starts]
+        ) / np.minimum(group_days, window)
+
+    return totals
+
+
+def add_running_totals(daily_data, windows=CONST_ROLLING_WINDOWS):
+    """
+    Adds the running totals (see get_running_total_cols) to usage grouped by
+        calender day.
+
+    Args:
+        daily_data - dataframe returned by group_day
+        windows - lengths (days) of the moving averages
+    Returns:
+        a copy of daily_data with the running total columns
+    """
+
+    days = daily_data[CONST_COL_NAME_DATE].values.astype("datetime64[D]")
+
+    totals = calc_running_totals(
+        np.zeros(len(days), dtype=np.int64),
+        days.astype(np.int64),
+        daily_data[CONST_COL_NAME_COST].values,
+        windows,
+    )
+
+    return daily_data.assign(**totals)
+
+
+def group_sub_running_totals(raw_data, windows=CONST_ROLLING_WINDOWS):
+    """
+    Groups raw usage by subscriptionid and calender day, with the running
+        totals (see get_running_total_cols) of each subscription.
+
+    The usage is grouped in a single pass over integer keys of the
+    subscription and the day, and the running totals of all the
+    subscriptions are calculated together.
+
+    Args:
+        raw_data - raw usage data framework
+        windows - lengths (days) of the moving averages
+    Returns:
+        dataframe with the SubscriptionGuid, Date, Cost and running totals,
+        sorted by subscription and day
+    """
+
+    sub_codes, sub_ids = pd.factorize(
+        raw_data[CONST_COL_NAME_SGUID], sort=True
+    )
+    days = (
+        raw_data[CONST_COL_NAME_DATE]
+        .values.astype("datetime64[D]")
+        .astype(np.int64)
+    )
+
+    # rows without a subscription are left out
+    has_sub = sub_codes >= 0
+    sub_codes = sub_codes[has_sub]
+    days = days[has_sub]
+    costs = np.nan_to_num(
+        raw_data[CONST_COL_NAME_COST].to_numpy(dtype=np.float64)[has_sub]
+    )
+
+    day_min = days.min() if len(days) > 0 else 0
+    days_span = days.max() - day_min + 1 if len(days) > 0 else 1
+
+    # summing the costs of each subscription and day, sorted by the keys
+    keys, row_groups = np.unique(
+        sub_codes * days_span + (days - day_min), return_inverse=True
+    )
+    group_costs = np.bincount(row_groups, weights=costs, minlength=len(keys))
+
+    group_subs, group_days = np.divmod(keys, days_span)
+    group_days = group_days + day_min
+
+    totals = calc_running_totals(group_subs, group_days, group_costs, windows)
+
+    grouped = pd.DataFrame(
+        {
+            CONST_COL_NAME_SGUID: np.asarray(sub_ids, dtype=object)[
+                group_subs
+            ],
+            CONST_COL_NAME_DATE: group_days.astype("datetime64[D]").astype(
+                "datetime64[ns]"
+            ),
+            CONST_COL_NAME_COST: group_costs,
+        }
+    )
+
+    return grouped.assign(**totals)
+
+
+def get_resolution(date_from, date_to, max_bars=CONST_MAX_BARS):
+    """
+    Returns the finest resolution at which a period is shown in at most
+        max_bars bars.
+
+    Args:
+        date_from - first day of the period
+        date_to - last day of the period
+        max_bars - maximum number of bars
+    Returns:
+        CONST_RESOLUTION_DAY, CONST_RESOLUTION_WEEK or CONST_RESOLUTION_MONTH
+    """
+
+    days = (pd.Timestamp(date_to) - pd.Timestamp(date_from)).days + 1
+
+    if days <= max_bars:
+        return CONST_RESOLUTION_DAY
+
+    if days <= max_bars * 7:
+        return CONST_RESOLUTION_WEEK
+
+    return CONST_RESOLUTION_MONTH
+
+
+def group_period(daily_data, resolution):
+    """
+    Re-aggregates usage grouped by calender day (see group_day) into bars
+        of a day, a week (starting on Monday) or a calender month.
+
+    Args:
+        daily_data - dataframe of grouped raw usage by calender day
+        resolution - CONST_RESOLUTION_DAY, CONST_RESOLUTION_WEEK or
+            CONST_RESOLUTION_MONTH
+    Returns:
+        dataframe with the first day of each bar (Date), where its bar ends
+            (End, leaving a gap before the next bar), the summed Cost and
+            the running totals of daily_data (if any) on the last day of
+            each bar
+    """
+
+    running_cols = [
+        col for col in get_running_total_cols() if col in daily_data.columns
+    ]
+
+    if resolution == CONST_RESOLUTION_MONTH:
+        grouped = group_year_month(daily_data)
+        starts = pd.to_datetime(grouped[CONST_COL_NAME_YM], format="%Y-%m")
+        next_starts = starts + pd.offsets.MonthBegin(1)
+        running = (
+            daily_data[running_cols]
+            .groupby(get_year_months(daily_data[CONST_COL_NAME_DATE]))
+            .last()
+        )
+    elif resolution == CONST_RESOLUTION_WEEK:
+        resampled = daily_data.set_index(CONST_COL_NAME_DATE).resample(
+            "W-MON", label="left", closed="left"
+        )
+        grouped = resampled[CONST_COL_NAME_COST].sum().reset_index()
+        starts = grouped[CONST_COL_NAME_DATE]
+        next_starts = starts + pd.Timedelta(days=7)
+        running = resampled[running_cols].last()
+    else:
+        grouped = daily_data
+        starts = grouped[CONST_COL_NAME_DATE]
+        next_starts = starts + pd.Timedelta(days=1)
+        running = daily_data[running_cols]
+
+    period_df = pd.DataFrame(
+        {
+            CONST_COL_NAME_DATE: starts.values,
+            CONST_COL_NAME_END: (starts + (next_starts - starts) * 0.9).values,
+            CONST_COL_NAME_COST: grouped[CONST_COL_NAME_COST].values,
+        }
+    )
+
+    for col in running_cols:
+        period_df[col] = running[col].values
+
+    return period_df
+
+
+def get_year_month_range(date_from, date_to):
+    """
+    Returns the calender months of a period: the months of date_from and of
+        the dates a whole number of months later which are before date_to,
+        i.e. of stepping from date_from by relativedelta(months=1) (where
+        the day of the month is cut to the end of shorter months).
+
+    Args:
+        date_from - period start date
+        date_to - period end date (exclusive)
+    Returns:
+        datetime64[M] array of the months, in order
+    """
+
+    date_from = pd.Timestamp(date_from)
+    date_to = pd.Timestamp(date_to)
+
+    if date_to <= date_from:
+        return np.array([], dtype="datetime64[M]")
+
+    months = np.datetime64(date_from.strftime("%Y-%m"), "M") + np.arange(
+        diff_month(date_to, date_from) + 1
+    )
+
+    # the day of each step, cut by the shortest month stepped through
+    month_days = (
+        (months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")
+    ).astype(np.int64)
+    days = np.minimum.accumulate(np.minimum(month_days, date_from.day))
+
+    step_dates = (months.astype("datetime64[D]") + (days - 1)).astype(
+        "datetime64[ns]"
+    ) + (date_from - date_from.normalize())
+
+    return months[step_dates < date_to.to_datetime64()]
+
+
+def add_missing_year_months(
+    df, date_from, date_to, value_col_name, group_col_names=None
+):
     """
     Adds missing Year-Month values from the given range to the
         dataframe with zero values in the specified column
 
+    The months of the range (see get_year_month_range) are built once and
+    merged with the dataframe. Monthly usage of several groups (e.g.
+    subscriptions) gets the missing months of each group.
+
     Args:
         df - dataframe of grouped raw usage by calender month
         date_from - analysis period start date
         date_to - analysis period end date
         value_col_name - costs column name
+        group_col_names - columns of the groups which get all the months,
+            None for a single group
 
     Returns:
-        df - appended dataframe
+        df - dataframe with all the months, sorted by Year-Month (and by
+            group)
     """
 
-    cur_date = date_from
+    calendar_df = pd.DataFrame(
+        {
+            CONST_COL_NAME_YM: format_year_months(
+                get_year_month_range(date_from, date_to)
+            )
+        }
+    )
+
+    key_cols = [CONST_COL_NAME_YM]
 
-    while cur_date < date_to:
-        year_month = "{year}-{month:02d}".format(
-            year=cur_date.year, month=cur_date.month
+    if group_col_names:
+        key_cols = list(group_col_names) + key_cols
+        calendar_df = (
+            df[list(group_col_names)]
+            .drop_duplicates()
+            .merge(calendar_df, how="cross")
         )
-        cur_date += relativedelta(months=1)
 
-        if year_month not in df[CONST_COL_NAME_YM].values:
-            df = df.append(
-                {CONST_COL_NAME_YM: year_month, value_col_name: 0.0},
-                ignore_index=True,
-            )
+    df = df.merge(calendar_df, on=key_cols, how="outer", indicator=True)
+
+    missing = (df["_merge"] == "right_only").values
+    df.loc[missing, value_col_name] = 0.0
+
+    return (
+        df.drop(columns=["_merge"])
+        .sort_values(by=key_cols[-1:] + key_cols[:-1], kind="mergesort")
+        .reset_index(drop=True)
+    )
+
+
+def get_year_months(dates):
+    """
+    Returns the calender month of each date
+
+    Args:
+        dates: series or array of dates
+    Returns:
+        datetime64[M] array of the first days of the months
+    """
 
-    return df
+    return pd.to_datetime(dates).values.astype("datetime64[M]")
+
+
+def format_year_months(months):
+    """
+    Formats calender months as Year-Month labels, e.g. 2019-07
+
+    Args:
+        months: datetime64 array of days within the months
+    Returns:
+        array of Year-Month strings
+    """
+
+    return np.datetime_as_string(
+        np.asarray(months).astype("datetime64[M]"), unit="M"
+    ).astype(object)
 
 
 def group_year_month(raw_data):
@@ -92,16 +492,18 @@ def group_year_month(raw_data):
         raw_data_gr: dataframe of grouped raw usage by calender month
     """
 
-    raw_data_ = raw_data.copy()
-    raw_data_[CONST_COL_NAME_YM] = pd.to_datetime(
-        raw_data_[CONST_COL_NAME_DATE]
-    ).apply(lambda x: "{year}-{month:02d}".format(year=x.year, month=x.month))
-
-    raw_data_gr = (
-        raw_data_.groupby([CONST_COL_NAME_YM])[CONST_COL_NAME_COST]
+    # grouped by month, only the grouped rows get their Year-Month label
+    grouped = (
+        raw_data[CONST_COL_NAME_COST]
+        .groupby(get_year_months(raw_data[CONST_COL_NAME_DATE]))
         .sum()
-        .reset_index()
-        .sort_values(by=[CONST_COL_NAME_YM], ascending=True)
+    )
+
+    raw_data_gr = pd.DataFrame(
+        {
+            CONST_COL_NAME_YM: format_year_months(grouped.index.values),
+            CONST_COL_NAME_COST: grouped.values,
+        }
     )
 
     return raw_data_gr
@@ -116,18 +518,22 @@ def group_sub_year_month(raw_data):
         raw_data_gr: dataframe of grouped raw usage by calender month
     """
 
-    raw_data_ = raw_data.copy()
-    raw_data_[CONST_COL_NAME_YM] = pd.to_datetime(
-        raw_data_[CONST_COL_NAME_DATE]
-    ).apply(lambda x: "{year}-{month:02d}".format(year=x.year, month=x.month))
+    year_months = pd.Series(
+        get_year_months(raw_data[CONST_COL_NAME_DATE]),
+        index=raw_data.index,
+        name=CONST_COL_NAME_YM,
+    )
 
     raw_data_gr = (
-        raw_data_.groupby([CONST_COL_NAME_SGUID, CONST_COL_NAME_YM])[
+        raw_data.groupby([CONST_COL_NAME_SGUID, year_months], observed=True)[
             CONST_COL_NAME_COST
         ]
         .sum()
         .reset_index()
-        .sort_values(by=[CONST_COL_NAME_YM], ascending=True)
     )
 
-    return raw_data_gr
+    raw_data_gr[CONST_COL_NAME_YM] = format_year_months(
+        raw_data_gr[CONST_COL_NAME_YM].values
+    )
+
+    return raw_data_gr.sort_values(by=[CONST_COL_NAME_YM], ascending=True)
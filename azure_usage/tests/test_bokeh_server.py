@@ -5,6 +5,8 @@ Author: Tomas Lazauskas
 """
 
 import os
+import time
+import concurrent.futures
 import pandas as pd
 
 from ..src_webapp.bokeh_server import (
@@ -13,16 +15,40 @@ from ..src_webapp.bokeh_server import (
     create_about_tab,
     create_usage_bar_plot,
     create_top_services_pie_plot,
+    UsageDashboard,
+    get_query_cache_metrics,
+    log_query_cache_metrics,
+    get_source_data,
+    update_source,
+    get_patch_doc_size,
+    get_top_services_plot_data,
     # initiliase_data_sources,
 )
 
+from ..src_webapp.dataset import load_dataset
+from ..src_webapp.subs import group_services
+from ..src_webapp.utilities import parse_url_params
+
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+
 from bokeh.models.widgets import Panel
 from bokeh.plotting import Figure
 
 from ..src_webapp.constants import (
     CONST_TEST_DIR_DATA_LOADER,
-    # CONST_TEST_DIR_1,
+    CONST_TEST_DIR_1,
     CONST_TEST_DIR_3,
+    CONST_TEST_DIR_8,
+    CONST_TEST_DIR_1_SUB_ID_1,
+    CONST_COL_NAME_COST,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_END,
+    CONST_COL_NAME_CUMULATIVE,
+    CONST_COL_NAME_ANGLE,
+    CONST_RESOLUTION_DAY,
+    CONST_RESOLUTION_WEEK,
+    URL_PARAM_SUB_IDS,
 )
 
 
@@ -57,3 +83,507 @@ def test_create_usage_bar_plot():
 
 def test_create_top_services_pie_plot():
     assert isinstance(create_top_services_pie_plot(), (Figure,))
+
+
+class _SessionDoc:
+    """Records the callbacks a dashboard schedules on its document"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.timeout_callbacks = []
+
+    def add_next_tick_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def add_timeout_callback(self, callback, timeout):
+        self.timeout_callbacks.append(callback)
+        return callback
+
+    def remove_timeout_callback(self, callback):
+        self.timeout_callbacks.remove(callback)
+
+    def run_timeout_callbacks(self):
+        callbacks, self.timeout_callbacks = self.timeout_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def run_callbacks(self, future):
+        # done callbacks of a future may run just after its result is set
+        concurrent.futures.wait([future])
+        for _ in range(100):
+            if self.callbacks:
+                break
+            time.sleep(0.01)
+
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def _create_dashboard(dataset, sub_ids):
+    """Creates the dashboard of a session showing sub_ids"""
+
+    url_params = parse_url_params(
+        {URL_PARAM_SUB_IDS: [sub_ids.encode("utf-8")]}
+    )
+
+    dashboard = UsageDashboard(dataset)
+    dashboard.initiliase_data_sources()
+    dashboard.set_layout(Document(), url_params)
+    dashboard.update_data()
+
+    return dashboard
+
+
+def test_usage_dashboard_sessions():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboards = []
+
+    for sub_ids in [CONST_TEST_DIR_1_SUB_ID_1, "ALLMODE"]:
+        dashboards.append(_create_dashboard(dataset, sub_ids))
+
+    # the sessions share the data, but not the widgets and sources
+    assert dashboards[0].raw_usage is dashboards[1].raw_usage
+    assert dashboards[0].total_source is not dashboards[1].total_source
+
+    assert "1 subscriptions selected:" in (
+        dashboards[0].widget_subscription_names.text
+    )
+    assert "2 subscriptions selected" in (
+        dashboards[1].widget_subscription_names.text
+    )
+
+    sub_total = sum(dashboards[0].total_source.data[CONST_COL_NAME_COST])
+    all_total = sum(dashboards[1].total_source.data[CONST_COL_NAME_COST])
+    assert sub_total < all_total
+
+    # the running totals are plotted from the same source
+    assert round(
+        dashboards[1].total_source.data[CONST_COL_NAME_CUMULATIVE][-1], 10
+    ) == round(all_total, 10)
+    for renderer in dashboards[1].s3.renderers:
+        assert renderer.data_source is dashboards[1].total_source
+
+    # changing one session's subscription does not change the other one
+    dashboards[1].update_data()
+    dashboards[1].widget_subid.value = CONST_TEST_DIR_1_SUB_ID_1
+    dashboards[1].update_data()
+
+    assert sum(dashboards[1].total_source.data[CONST_COL_NAME_COST]) == (
+        sub_total
+    )
+    assert "1 subscriptions selected:" in (
+        dashboards[0].widget_subscription_names.text
+    )
+
+
+def test_request_update():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboard = _create_dashboard(dataset, "ALLMODE")
+    dashboard.doc = _SessionDoc()
+
+    all_text = dashboard.widget_total_text.text
+
+    # updates are computed in the background, the results are only applied
+    # on the next tick of the session
+    dashboard.widget_subid.value = "abc"
+    dashboard.request_update()
+    dashboard._pending_update.result()
+
+    assert dashboard.widget_total_text.text == all_text
+
+    # the user keeps typing: only the latest request is applied
+    dashboard.widget_subid.value = CONST_TEST_DIR_1_SUB_ID_1
+    dashboard.request_update()
+    dashboard.doc.run_callbacks(dashboard._pending_update)
+
+    assert "1 subscriptions selected:" in (
+        dashboard.widget_subscription_names.text
+    )
+    assert dashboard.widget_total_text.text != all_text
+    assert dashboard.widget_total_text.text != "Total usage: $0.00"
+
+
+def test_schedule_update():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboard = _create_dashboard(dataset, "ALLMODE")
+    dashboard.doc = _SessionDoc()
+
+    # a burst of widget changes is coalesced into one update
+    dashboard.widget_subid.value = "abc"
+    dashboard.widget_subid.value = CONST_TEST_DIR_1_SUB_ID_1
+    dashboard.date_picker_from.value = "2016-01-01"
+    dashboard.date_picker_to.value = "2020-01-01"
+
+    assert len(dashboard.doc.timeout_callbacks) == 1
+
+    dashboard.doc.run_timeout_callbacks()
+    assert dashboard._request_cnt == 1
+
+    dashboard.doc.run_callbacks(dashboard._pending_update)
+    assert "1 subscriptions selected:" in (
+        dashboard.widget_subscription_names.text
+    )
+
+    # changes which end up with the same selection are skipped
+    dashboard.widget_subid.value = "abc"
+    dashboard.widget_subid.value = CONST_TEST_DIR_1_SUB_ID_1
+    dashboard.widget_top_services_rb.active = 1
+    dashboard.widget_top_services_rb.active = 0
+
+    dashboard.doc.run_timeout_callbacks()
+    assert dashboard._request_cnt == 1
+
+    # as are the same ids typed differently
+    dashboard.widget_subid.value = " " + CONST_TEST_DIR_1_SUB_ID_1.lower()
+
+    dashboard.doc.run_timeout_callbacks()
+    assert dashboard._request_cnt == 1
+
+    # a failed update can be requested again
+    def _fail(selection):
+        raise ValueError("failed")
+
+    compute_selection = dashboard.compute_selection
+    dashboard.compute_selection = _fail
+
+    dashboard.widget_subid.value = "ALLMODE"
+    dashboard.doc.run_timeout_callbacks()
+    dashboard.doc.run_callbacks(dashboard._pending_update)
+
+    assert dashboard._request_cnt == 2
+    assert dashboard._last_query is None
+    assert "1 subscriptions selected:" in (
+        dashboard.widget_subscription_names.text
+    )
+
+    dashboard.compute_selection = compute_selection
+
+    dashboard.schedule_update()
+    dashboard.doc.run_timeout_callbacks()
+    dashboard.doc.run_callbacks(dashboard._pending_update)
+
+    assert dashboard._request_cnt == 3
+    assert "2 subscriptions selected" in (
+        dashboard.widget_subscription_names.text
+    )
+
+
+def test_switch_top_services():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboard = _create_dashboard(dataset, "ALLMODE")
+    dashboard.doc = _SessionDoc()
+
+    selection = dashboard.get_query()[:-1]
+    updates = dashboard.compute_selection(selection)
+
+    # the groupings of the selection shown are switched without a request
+    dashboard.widget_top_services_rb.active = 1
+
+    assert dashboard._request_cnt == 0
+    assert len(dashboard.doc.timeout_callbacks) == 0
+    assert list(dashboard.top_service_source.data[CONST_COL_NAME_COST]) == (
+        list(updates[1]["top_services"][CONST_COL_NAME_COST])
+    )
+
+    for grp_md in range(4):
+        pd.testing.assert_frame_equal(
+            updates[grp_md]["top_services"],
+            dashboard.aggregate_update(selection + (grp_md,))["top_services"],
+        )
+
+    # with another selection, the switch waits for its update
+    dashboard.widget_subid.value = CONST_TEST_DIR_1_SUB_ID_1
+    dashboard.widget_top_services_rb.active = 2
+
+    assert len(dashboard.doc.timeout_callbacks) == 1
+
+    dashboard.doc.run_timeout_callbacks()
+    dashboard.doc.run_callbacks(dashboard._pending_update)
+
+    assert dashboard._request_cnt == 1
+    assert dashboard._selection_updates[0] == dashboard.get_query()[:-1]
+    assert list(dashboard.top_service_source.data[CONST_COL_NAME_COST]) == (
+        list(
+            dashboard.compute_update(dashboard.get_query())["top_services"][
+                CONST_COL_NAME_COST
+            ]
+        )
+    )
+
+
+def test_query_cache(capsys):
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboards = [
+        _create_dashboard(dataset, CONST_TEST_DIR_1_SUB_ID_1) for _ in range(2)
+    ]
+
+    query = dashboards[0].get_query()
+    assert query == dashboards[1].get_query()
+
+    # the second session is served the result of the first one
+    metrics = get_query_cache_metrics()
+    assert dashboards[1].compute_update(query) is (
+        dashboards[0].compute_update(query)
+    )
+    assert get_query_cache_metrics()["hits"] == metrics["hits"] + 2
+
+    # the counters are logged when a session is closed
+    capsys.readouterr()
+    log_query_cache_metrics(None)
+    assert "{} hits".format(metrics["hits"] + 2) in capsys.readouterr().out
+
+    pd.testing.assert_frame_equal(
+        dashboards[1].compute_update(query)["total_usage"],
+        dashboards[0].aggregate_update(query)["total_usage"],
+    )
+
+    # a new dataset version empties the cache
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+    UsageDashboard(load_dataset(data_path))
+
+    metrics = get_query_cache_metrics()
+    assert metrics["version"] != dataset.version
+    assert metrics["entries"] == 0
+
+
+def test_update_source():
+
+    dates = pd.date_range("2020-01-01", periods=30)
+    daily = pd.DataFrame(
+        {CONST_COL_NAME_DATE: dates, CONST_COL_NAME_COST: 1.0}
+    )
+
+    data = get_source_data(daily)
+    assert list(data.keys()) == [CONST_COL_NAME_DATE, CONST_COL_NAME_COST]
+
+    doc = Document()
+    source = ColumnDataSource(data=data)
+    doc.add_root(source)
+
+    events = []
+    doc.on_change(events.append)
+
+    assert update_source(source, get_source_data(daily)) == "none"
+    assert events == []
+
+    # a few days change
+    changed = daily.copy()
+    changed.loc[3:4, CONST_COL_NAME_COST] = 2.0
+    assert update_source(source, get_source_data(changed)) == "patch"
+
+    # the source does not share its arrays with the dataframes
+    assert (daily[CONST_COL_NAME_COST] == 1.0).all()
+
+    # the period is extended
+    extended = pd.DataFrame(
+        {
+            CONST_COL_NAME_DATE: pd.date_range("2020-01-01", periods=35),
+            CONST_COL_NAME_COST: 2.0,
+        }
+    )
+    extended.loc[:29, CONST_COL_NAME_COST] = changed[CONST_COL_NAME_COST]
+    assert update_source(source, get_source_data(extended)) == "stream"
+
+    extended.loc[0, CONST_COL_NAME_COST] = 0.0
+    extended = pd.concat([extended, extended.iloc[-1:]], ignore_index=True)
+    assert update_source(source, get_source_data(extended)) == "patch+stream"
+
+    for col in extended.columns:
+        assert (source.data[col] == extended[col].values).all()
+
+    # the period is shortened or mostly changed
+    assert update_source(source, get_source_data(daily)) == "replace"
+    mostly_changed = pd.DataFrame(
+        {
+            CONST_COL_NAME_DATE: pd.date_range("2019-01-01", periods=30),
+            CONST_COL_NAME_COST: 3.0,
+        }
+    )
+    assert update_source(source, get_source_data(mostly_changed)) == "replace"
+
+    # deltas are sent in fewer bytes than the whole data
+    source.data = get_source_data(daily)
+    events.clear()
+    update_source(source, get_source_data(changed))
+    patch_size = get_patch_doc_size(events)
+
+    events.clear()
+    source.data = get_source_data(changed)
+    assert 0 < patch_size < get_patch_doc_size(events)
+    assert get_patch_doc_size([]) == 0
+
+
+def test_plot_resolution():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    dashboard = _create_dashboard(dataset, CONST_TEST_DIR_1_SUB_ID_1)
+    dashboard.doc = _SessionDoc()
+
+    assert dashboard._plot_window == (CONST_RESOLUTION_DAY, None)
+
+    # a selection of three years is shown by week
+    daily = pd.DataFrame(
+        {
+            CONST_COL_NAME_DATE: pd.date_range("2017-01-01", "2019-12-31"),
+            CONST_COL_NAME_COST: 1.0,
+        }
+    )
+    dashboard.apply_update(
+        {
+            "subscription_names": "",
+            "total_usage": daily,
+            "top_services": dashboard.sub_service_grp,
+            "total_text": "",
+        }
+    )
+
+    assert dashboard._plot_window == (CONST_RESOLUTION_WEEK, None)
+    assert len(dashboard.total_source.data[CONST_COL_NAME_DATE]) == 158
+
+    # zoomed in to a month, it is shown by day around the visible range
+    x_range = dashboard.s1.x_range
+    x_range.start = pd.Timestamp("2018-06-01").timestamp() * 1000
+    x_range.end = pd.Timestamp("2018-06-30").timestamp() * 1000
+
+    assert len(dashboard.doc.timeout_callbacks) == 1
+    dashboard.doc.run_timeout_callbacks()
+
+    resolution, window = dashboard._plot_window
+    assert resolution == CONST_RESOLUTION_DAY
+    assert window[0] <= pd.Timestamp("2018-05-03")
+    assert window[1] >= pd.Timestamp("2018-07-28")
+
+    # the window is shown by day from the week of its first day to the
+    # week of its last day, the rest of the selection still by week
+    dates = pd.Series(dashboard.total_source.data[CONST_COL_NAME_DATE])
+    day_bars = dates[
+        (dates >= pd.Timestamp("2018-04-30"))
+        & (dates < pd.Timestamp("2018-07-30"))
+    ]
+    assert list(day_bars) == list(pd.date_range("2018-04-30", "2018-07-29"))
+    assert dates[dates < pd.Timestamp("2018-04-30")].iloc[-1] == (
+        pd.Timestamp("2018-04-23")
+    )
+    assert len(dates) == 158 - 13 + 91
+    assert sum(dashboard.total_source.data[CONST_COL_NAME_COST]) == (
+        daily[CONST_COL_NAME_COST].sum()
+    )
+
+    # so the plots are still ranged to the whole selection: auto-ranging or
+    # a reset fit the bars of all the three years
+    assert dates.iloc[0] <= pd.Timestamp("2017-01-01")
+    assert dates.iloc[-1] >= pd.Timestamp("2019-12-25")
+    assert (dates.diff().iloc[1:] > pd.Timedelta(0)).all()
+
+    # panning within the window needs no new bars
+    plot_data = dashboard.total_source.data
+    x_range.start = pd.Timestamp("2018-06-10").timestamp() * 1000
+    x_range.end = pd.Timestamp("2018-07-09").timestamp() * 1000
+    dashboard.doc.run_timeout_callbacks()
+    assert dashboard.total_source.data is plot_data
+
+    # a new update keeps the bars of the zoomed range
+    update = {
+        "subscription_names": "",
+        "total_usage": daily,
+        "top_services": dashboard.sub_service_grp,
+        "total_text": "",
+    }
+    dashboard.apply_update(update)
+    assert dashboard._plot_window[0] == CONST_RESOLUTION_DAY
+
+    # unless the range is outside of the new selection
+    dashboard.apply_update(
+        dict(update, total_usage=daily[daily.Date >= "2019-01-01"])
+    )
+    assert dashboard._plot_window == (CONST_RESOLUTION_DAY, None)
+    assert len(dashboard.total_source.data[CONST_COL_NAME_DATE]) == 365
+
+    dashboard.apply_update(update)
+
+    # a reset ranges the plot to the bars, i.e. the whole selection, which
+    # is shown by week again
+    x_range.start = dates.iloc[0].timestamp() * 1000
+    x_range.end = (
+        pd.Timestamp(
+            dashboard.total_source.data[CONST_COL_NAME_END][-1]
+        ).timestamp()
+        * 1000
+    )
+    dashboard.doc.run_timeout_callbacks()
+    assert dashboard._plot_window == (CONST_RESOLUTION_WEEK, None)
+    assert len(dashboard.total_source.data[CONST_COL_NAME_DATE]) == 158
+
+
+def test_allmode():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_8)
+    dataset = load_dataset(data_path)
+
+    dashboard = UsageDashboard(dataset)
+    all_sub_ids = ",".join(
+        sub_id.strip("{}") for sub_id in dataset.cube_index.sub_ids
+    )
+
+    for date_from, date_to in [
+        ("2019-10-01", "2019-12-01"),
+        ("2019-10-20", "2019-11-01"),
+        ("2020-01-01", "2020-02-01"),
+    ]:
+        for grp_md in range(4):
+            query = (
+                pd.Timestamp(date_from),
+                pd.Timestamp(date_to),
+                grp_md,
+            )
+
+            # served from the aggregates of all the subscriptions
+            all_update = dashboard.aggregate_update(("ALLMODE",) + query)
+            subs_update = dashboard.aggregate_update((all_sub_ids,) + query)
+
+            assert all_update["total_text"] == subs_update["total_text"]
+            for key in ["total_usage", "top_services"]:
+                pd.testing.assert_frame_equal(
+                    all_update[key], subs_update[key], check_exact=False
+                )
+
+
+def test_top_services_plot_data_empty():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    dataset = load_dataset(data_path)
+
+    services = group_services(dataset.raw_usage.iloc[0:0])
+
+    # an empty selection is shown as a single empty wedge, all the columns
+    # of the source have the same length
+    plot_data = get_top_services_plot_data(services, 0)
+    source_data = get_source_data(plot_data)
+
+    assert len(plot_data.index) == 1
+    assert plot_data[CONST_COL_NAME_ANGLE].iloc[0] == 0.0
+    assert set(len(values) for values in source_data.values()) == {1}
+
+    # as is the selection of a dashboard
+    dashboard = _create_dashboard(dataset, "abc")
+    assert set(
+        len(values) for values in dashboard.top_service_source.data.values()
+    ) == {1}
@@ -5,7 +5,11 @@ Author: Tomas Lazauskas
 """
 
 import os
+import json
+import shutil
 import datetime
+import numpy as np
+import pandas as pd
 
 from ..src_webapp.constants import (
     CONST_COL_NAME_QUANTITY,
@@ -16,12 +20,37 @@ from ..src_webapp.constants import (
     CONST_TEST_DIR_2,
     CONST_TEST_DIR_3,
     CONST_TEST_DIR_4,
+    CONST_TEST_DIR_5,
+    CONST_TEST_DIR_6,
     CONST_TEST_DIR_8,
+    CONST_COL_NAME_SOURCEFILE,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_SGUID,
+    USAGE_STORE_FOLDER,
+    CONST_DATE_FORMAT_US,
+    CONST_DATE_FORMAT_UK,
+    CONST_DATE_FORMAT_ISO,
+    CONST_DATE_FORMAT_OVERRIDES,
 )
 from ..src_webapp.data_loader import (
     create_dataframe,
     check_filename_convention,
+    write_usage_store,
+    read_usage_store,
+    detect_date_format,
+    dedup_dataframes,
+    list_usage_files,
+    read_usage_files,
+    compact_dataframe,
+    memory_report,
 )
+from ..src_webapp.ingest_cache import (
+    clear_cache,
+    load_cached_frame,
+    store_cached_frame,
+)
+from ..src_webapp import ingest_cache
+from ..src_webapp import data_loader
 
 
 def test_check_filename_convention():
@@ -66,6 +95,56 @@ def test_check_filename_convention():
     assert not result
 
 
+def test_detect_date_format():
+    """
+    Testing the date format detection
+    """
+
+    before_switch = datetime.datetime(2019, 10, 1)
+    after_switch = datetime.datetime(2020, 2, 1)
+
+    # unambiguous dates
+    dates = pd.Series(["10/01/2019", "10/31/2019"])
+    assert detect_date_format(dates, before_switch) == CONST_DATE_FORMAT_US
+    assert detect_date_format(dates, after_switch) == CONST_DATE_FORMAT_US
+
+    dates = pd.Series(["01/02/2020", "28/02/2020"])
+    assert detect_date_format(dates, before_switch) == CONST_DATE_FORMAT_UK
+    assert detect_date_format(dates, after_switch) == CONST_DATE_FORMAT_UK
+
+    dates = pd.Series(["2020-02-01", "2020-02-28"])
+    assert detect_date_format(dates, after_switch) == CONST_DATE_FORMAT_ISO
+
+    # ambiguous dates depend on the file's period
+    dates = pd.Series(["01/02/2020", "02/02/2020"])
+    assert detect_date_format(dates, before_switch) == CONST_DATE_FORMAT_US
+    assert detect_date_format(dates, after_switch) == CONST_DATE_FORMAT_UK
+
+    # unless the file is listed in the override table, which does not
+    # change unambiguous dates
+    filename = "2020-02-02-2020-02-01.csv"
+    CONST_DATE_FORMAT_OVERRIDES[filename] = CONST_DATE_FORMAT_US
+    try:
+        assert (
+            detect_date_format(dates, after_switch, filename)
+            == CONST_DATE_FORMAT_US
+        )
+        assert (
+            detect_date_format(
+                pd.Series(["01/02/2020", "28/02/2020"]),
+                after_switch,
+                filename,
+            )
+            == CONST_DATE_FORMAT_UK
+        )
+    finally:
+        del CONST_DATE_FORMAT_OVERRIDES[filename]
+
+    # no dates at all
+    dates = pd.Series([], dtype=object)
+    assert detect_date_format(dates, after_switch) == CONST_DATE_FORMAT_UK
+
+
 def test_create_dataframe_empty_dir():
     """
     Testing the simplest import from an empty directory
@@ -152,3 +231,363 @@ def test_on_eduhub_data():
     raw_usage = create_dataframe(data_path)
 
     assert raw_usage[CONST_COL_NAME_COST].sum() == 228.05678868340001
+
+
+def test_create_dataframe_cache(tmp_path):
+    """
+    Testing that the ingest cache gives the same data as parsing the files
+    and that only changed files are parsed again
+    """
+
+    data_path = str(tmp_path / "data")
+    cache_dir = str(tmp_path / "cache")
+    shutil.copytree(
+        os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3), data_path
+    )
+
+    expected = create_dataframe(data_path)
+
+    # cold and warm loads
+    cold = create_dataframe(data_path, cache_dir=cache_dir)
+    warm = create_dataframe(data_path, cache_dir=cache_dir)
+
+    pd.testing.assert_frame_equal(cold, expected)
+    pd.testing.assert_frame_equal(warm, expected)
+    assert len(os.listdir(cache_dir)) == 6
+
+    # changing the content of a file invalidates its cache entry
+    file_path = os.path.join(data_path, "2019-10-15-2019-10-15.csv")
+    with open(file_path, "r") as file_obj:
+        content = file_obj.read()
+    with open(file_path, "w") as file_obj:
+        file_obj.write(content.replace(",0.5,0.5", ",1.5,1.5"))
+
+    raw_usage = create_dataframe(data_path, cache_dir=cache_dir)
+    assert raw_usage[CONST_COL_NAME_COST].sum() == 6.5
+
+    # invalidating the whole cache
+    assert clear_cache(cache_dir) == 3
+    assert len(os.listdir(cache_dir)) == 0
+
+
+def test_ingest_cache_version(tmp_path, monkeypatch):
+    """
+    Testing that cache entries of another format version are misses
+    """
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+    file_path = os.path.join(data_path, "2019-10-15-2019-10-15.csv")
+    cache_dir = str(tmp_path / "cache")
+
+    df = read_usage_files([file_path])[0]
+    store_cached_frame(cache_dir, file_path, df)
+
+    pd.testing.assert_frame_equal(load_cached_frame(cache_dir, file_path), df)
+
+    # a manifest written by another version of the cache
+    manifest_path = [
+        os.path.join(cache_dir, filename)
+        for filename in os.listdir(cache_dir)
+        if filename.endswith(".json")
+    ][0]
+    with open(manifest_path, "r") as file_obj:
+        manifest = json.load(file_obj)
+    manifest["version"] = ingest_cache.CACHE_FORMAT_VERSION + 1
+    with open(manifest_path, "w") as file_obj:
+        json.dump(manifest, file_obj)
+
+    assert load_cached_frame(cache_dir, file_path) is None
+
+    # a new format version does not pick up the entries of the old one
+    store_cached_frame(cache_dir, file_path, df)
+    monkeypatch.setattr(
+        ingest_cache,
+        "CACHE_FORMAT_VERSION",
+        ingest_cache.CACHE_FORMAT_VERSION + 1,
+    )
+
+    assert load_cached_frame(cache_dir, file_path) is None
+
+
+def test_usage_store(tmp_path):
+    """
+    Testing writing and reading the columnar usage store
+    """
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    raw_usage = create_dataframe(data_path)
+
+    store_path = str(tmp_path / USAGE_STORE_FOLDER)
+    write_usage_store(raw_usage, store_path)
+
+    # partitioned by Year-Month
+    assert len(os.listdir(store_path)) == 11
+
+    store_usage = read_usage_store(store_path)
+
+    assert store_usage[CONST_COL_NAME_SGUID].dtype.name == "category"
+    assert store_usage[CONST_COL_NAME_DATE].dtype.name == "datetime64[ns]"
+    assert list(store_usage.columns) == list(raw_usage.columns)
+    assert len(store_usage.index) == len(raw_usage.index)
+    assert round(store_usage[CONST_COL_NAME_COST].sum(), 10) == round(
+        raw_usage[CONST_COL_NAME_COST].sum(), 10
+    )
+
+    # writing again replaces the store, without leaving temporary
+    # directories behind
+    write_usage_store(raw_usage.iloc[:10], store_path)
+    assert len(read_usage_store(store_path).index) == 10
+    assert os.listdir(str(tmp_path)) == [USAGE_STORE_FOLDER]
+
+    # a store that does not exist
+    assert read_usage_store(str(tmp_path / "doesnt_exist")).empty
+
+
+def test_create_dataframe_parallel(tmp_path):
+    """
+    Testing that reading in files in a process pool gives the same data as
+    reading them one after another
+    """
+
+    source_dir = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+
+    # 12 files in two directories, later files overriding earlier ones
+    data_path = tmp_path / "data"
+    for idx in range(12):
+        directory = data_path / ("sub" if idx % 2 else "")
+        directory.mkdir(parents=True, exist_ok=True)
+        shutil.copy(
+            os.path.join(source_dir, sorted(os.listdir(source_dir))[idx % 3]),
+            str(directory / "2019-11-{:02d}-2019-10-01.csv".format(idx + 1)),
+        )
+
+    expected = create_dataframe(str(data_path))
+
+    timings = {}
+    raw_usage = create_dataframe(str(data_path), workers=2, timings=timings)
+
+    pd.testing.assert_frame_equal(raw_usage, expected)
+
+    assert len(timings) == 12
+    assert all(file_time >= 0.0 for file_time in timings.values())
+
+
+def _drop_duplicates(df_list):
+    """
+    Reference deduplication: concatenating all the dataframes and dropping
+    duplicates on all columns except for Quantity, Cost and SourceFile
+    """
+
+    total_df = pd.concat(df_list, axis=0, ignore_index=True)
+
+    columns_to_dedup = [
+        col
+        for col in total_df.columns
+        if col
+        not in [
+            CONST_COL_NAME_QUANTITY,
+            CONST_COL_NAME_COST,
+            CONST_COL_NAME_SOURCEFILE,
+        ]
+    ]
+
+    return total_df.drop_duplicates(columns_to_dedup, keep="last")
+
+
+def test_dedup_dataframes_fixtures():
+    """
+    Testing that the deduplication gives the same output as
+    dropping duplicates from the concatenated test fixtures
+    """
+
+    for test_dir in [
+        CONST_TEST_DIR_1,
+        CONST_TEST_DIR_3,
+        CONST_TEST_DIR_5,
+        CONST_TEST_DIR_6,
+        CONST_TEST_DIR_8,
+    ]:
+        data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, test_dir)
+        df_list = read_usage_files(
+            [
+                os.path.join(data_path, filename)
+                for filename in list_usage_files(data_path)
+            ]
+        )
+
+        # all the files twice, the second copy overrides the first one
+        df_list = df_list + [df.copy() for df in df_list]
+
+        pd.testing.assert_frame_equal(
+            dedup_dataframes(df_list), _drop_duplicates(df_list)
+        )
+
+
+def test_dedup_dataframes():
+    """
+    Testing the deduplication on overlapping dataframes with
+    duplicates within a dataframe, missing values and differing columns
+    """
+
+    dates = pd.to_datetime(["2019-10-15", "2019-10-16", "2019-10-17"])
+
+    df_1 = pd.DataFrame(
+        {
+            "SubscriptionGuid": ["{A}", "{A}", "{B}", "{A}"],
+            CONST_COL_NAME_DATE: [dates[0], dates[0], dates[0], dates[1]],
+            "ServiceName": ["VM", "VM", "VM", None],
+            CONST_COL_NAME_QUANTITY: [1, 2, 3, 4],
+            CONST_COL_NAME_COST: [1.0, 2.0, 3.0, 4.0],
+            CONST_COL_NAME_SOURCEFILE: "1.csv",
+        }
+    )
+
+    df_2 = pd.DataFrame(
+        {
+            "SubscriptionGuid": ["{A}", "{B}", "{A}"],
+            CONST_COL_NAME_DATE: [dates[1], dates[1], dates[2]],
+            "ServiceName": [None, "VM", "VM"],
+            CONST_COL_NAME_QUANTITY: [5.0, 6.0, 7.0],
+            CONST_COL_NAME_COST: [5.0, 6.0, 7.0],
+            CONST_COL_NAME_SOURCEFILE: "2.csv",
+        }
+    )
+
+    # an extra column with missing values only matches rows without it
+    df_3 = pd.DataFrame(
+        {
+            "SubscriptionGuid": ["{A}", "{B}"],
+            CONST_COL_NAME_DATE: [dates[0], dates[1]],
+            "ServiceName": ["VM", "VM"],
+            "ServiceRegion": [None, "UK South"],
+            CONST_COL_NAME_QUANTITY: [8.0, 9.0],
+            CONST_COL_NAME_COST: [8.0, 9.0],
+            CONST_COL_NAME_SOURCEFILE: "3.csv",
+        }
+    )
+
+    for df_list in [
+        [df_1, df_2],
+        [df_2, df_1],
+        [df_1, df_2, df_3],
+        [df_3, pd.DataFrame(), df_1, None, df_2],
+    ]:
+        expected = _drop_duplicates([df for df in df_list if df is not None])
+
+        pd.testing.assert_frame_equal(dedup_dataframes(df_list), expected)
+
+    assert dedup_dataframes([]).empty
+
+
+def test_dedup_dataframes_stream():
+    """
+    Testing the deduplication of many overlapping dataframes streamed in
+    from a generator against dropping duplicates from their concatenation
+    """
+
+    rng = np.random.RandomState(0)
+
+    def _usage_df(idx):
+        row_cnt = 50 + 10 * idx
+        df = pd.DataFrame(
+            {
+                "SubscriptionGuid": rng.choice(["{A}", "{B}"], row_cnt),
+                CONST_COL_NAME_DATE: pd.Timestamp("2019-10-01")
+                + pd.to_timedelta(rng.randint(idx, idx + 20, row_cnt), "D"),
+                "ServiceName": rng.choice(["VM", "Storage", None], row_cnt),
+                CONST_COL_NAME_QUANTITY: rng.randint(0, 5, row_cnt),
+                CONST_COL_NAME_COST: rng.rand(row_cnt),
+                CONST_COL_NAME_SOURCEFILE: "{}.csv".format(idx),
+            }
+        )
+
+        # later exports have an extra column
+        if idx % 3 == 2:
+            df["ServiceRegion"] = rng.choice(["UK South", None], row_cnt)
+
+        return df
+
+    df_list = [_usage_df(idx) for idx in range(20)]
+
+    pd.testing.assert_frame_equal(
+        dedup_dataframes(df for df in df_list), _drop_duplicates(df_list)
+    )
+
+
+def test_dedup_dataframes_collisions(monkeypatch):
+    """
+    Testing that entries with colliding keys are only dropped if they are
+    actual duplicates
+    """
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    df_list = read_usage_files(
+        [
+            os.path.join(data_path, filename)
+            for filename in list_usage_files(data_path)
+        ]
+    )
+    df_list = df_list + [df.copy() for df in df_list]
+
+    # every entry gets the same key
+    monkeypatch.setattr(
+        data_loader,
+        "hash_usage_rows",
+        lambda df, columns: np.zeros(len(df.index), dtype=np.uint64),
+    )
+
+    pd.testing.assert_frame_equal(
+        dedup_dataframes(df_list), _drop_duplicates(df_list)
+    )
+
+
+def test_compact_dataframe():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+    raw_usage = create_dataframe(data_path)
+    raw_usage = pd.concat([raw_usage] * 100, ignore_index=True)
+
+    # strings parsed from different files are separate objects
+    raw_usage["ResourceGuid"] = raw_usage["ResourceGuid"].map(
+        lambda guid: "".join(list(guid))
+    )
+
+    compact_usage = compact_dataframe(raw_usage, float32_quantity=True)
+
+    assert compact_usage[CONST_COL_NAME_SGUID].dtype == "category"
+    assert compact_usage[CONST_COL_NAME_SOURCEFILE].dtype == "category"
+    assert compact_usage[CONST_COL_NAME_QUANTITY].dtype == np.float32
+    assert compact_usage[CONST_COL_NAME_COST].dtype == np.float64
+    assert compact_usage["ResourceGuid"].nunique() == len(
+        set(map(id, compact_usage["ResourceGuid"]))
+    )
+
+    # the values are not changed, neither is the original dataframe
+    pd.testing.assert_frame_equal(
+        compact_usage.astype(raw_usage.dtypes.to_dict()), raw_usage
+    )
+    assert raw_usage[CONST_COL_NAME_SGUID].dtype == object
+
+    # pandas' deep memory usage by default
+    assert memory_report(compact_usage).loc["Total", "Bytes"] == (
+        compact_usage.memory_usage(index=True, deep=True).sum()
+    )
+
+    raw_report = memory_report(raw_usage, dedup_objects=True)
+    compact_report = memory_report(compact_usage, dedup_objects=True)
+
+    assert list(compact_report.index) == (
+        ["Index"] + list(raw_usage.columns) + ["Total"]
+    )
+    assert (
+        compact_report.loc["Total", "Bytes"]
+        < raw_report.loc["Total", "Bytes"] / 2
+    )
+
+    # a compact dataframe stays compact
+    pd.testing.assert_frame_equal(
+        compact_dataframe(compact_usage, float32_quantity=True),
+        compact_usage,
+    )
+
+    assert compact_dataframe(pd.DataFrame()).empty
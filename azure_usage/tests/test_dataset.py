@@ -0,0 +1,117 @@
+"""
+test the process-wide usage dataset store
+"""
+
+import os
+import shutil
+import pandas as pd
+
+from ..src_webapp import dataset as dataset_module
+
+from ..src_webapp.data_loader import create_dataframe, write_usage_store
+
+from ..src_webapp.dataset import (
+    readin_data,
+    get_data_version,
+    load_dataset,
+    get_dataset,
+    refresh_dataset,
+    get_dataset_metrics,
+)
+
+from ..src_webapp.constants import (
+    CONST_TEST_DIR_DATA_LOADER,
+    CONST_TEST_DIR_3,
+    CONST_COL_NAME_COST,
+    USAGE_STORE_FOLDER,
+)
+
+
+def test_load_dataset():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+
+    dataset = load_dataset(data_path)
+
+    assert len(dataset.raw_usage.index) == 3
+    assert dataset.last_update == pd.to_datetime("2019-12-12 15:49:30.988079")
+
+    # the usage of all the subscriptions is sorted by date
+    assert dataset.global_sorted
+
+    # new sessions are served the same shared object
+    assert get_dataset() is dataset
+
+    metrics = get_dataset_metrics()
+    assert metrics["rows"] == 3
+    assert metrics["cube_rows"] == len(dataset.daily_cube.index)
+    assert metrics["global_cube_rows"] == len(dataset.global_cube.index)
+    assert metrics["load_time"] >= 0.0
+    assert metrics["memory_usage"] > 0
+
+
+def test_refresh_dataset(tmp_path):
+
+    data_path = str(tmp_path / "data")
+    shutil.copytree(
+        os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3), data_path
+    )
+
+    version = get_data_version(data_path)
+    assert version == get_data_version(data_path)
+
+    dataset = load_dataset(data_path)
+
+    # nothing has changed
+    assert not refresh_dataset(data_path)
+    assert dataset_module.GLOBAL_DATASET is dataset
+
+    # a new export file arrives
+    shutil.copy(
+        os.path.join(data_path, "2019-10-17-2019-10-17.csv"),
+        os.path.join(data_path, "2019-10-18-2019-10-18.csv"),
+    )
+
+    assert get_data_version(data_path) != version
+
+    # a refresh already in flight
+    with dataset_module.GLOBAL_REFRESH_LOCK:
+        assert not refresh_dataset(data_path)
+    assert dataset_module.GLOBAL_DATASET is dataset
+
+    assert refresh_dataset(data_path)
+
+    new_dataset = dataset_module.GLOBAL_DATASET
+    assert new_dataset is not dataset
+    assert new_dataset.version == get_data_version(data_path)
+
+    # the old snapshot is left untouched for the sessions still using it
+    assert len(dataset.raw_usage.index) == 3
+
+
+def test_readin_data_prefers_store(tmp_path):
+
+    data_path = str(tmp_path / "data")
+    os.makedirs(data_path)
+
+    raw_usage = create_dataframe(
+        os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_3)
+    )
+
+    # the store holds only a part of the data
+    write_usage_store(
+        raw_usage.iloc[:2], os.path.join(data_path, USAGE_STORE_FOLDER)
+    )
+    shutil.copy(
+        os.path.join(
+            CONST_TEST_DIR_DATA_LOADER,
+            CONST_TEST_DIR_3,
+            "2019-10-17-2019-10-17.csv",
+        ),
+        data_path,
+    )
+
+    store_usage, _ = readin_data(data_path)
+
+    assert len(store_usage.index) == 2
+    assert store_usage[CONST_COL_NAME_COST].sum() == 2.5
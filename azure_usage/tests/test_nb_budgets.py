@@ -0,0 +1,160 @@
+"""
+Test budget projections for the notebook
+"""
+
+import numpy as np
+import pandas as pd
+
+from ..src_notebook.budgets import (
+    get_calender_months,
+    get_period_months,
+    project_budgets,
+    create_projection_df,
+)
+
+from ..src_webapp.constants import (
+    CONST_COL_NAME_YM,
+    CONST_COL_NAME_AVAILCOST,
+    CONST_COL_NAME_IDEALCOST,
+)
+
+
+def test_get_period_months():
+
+    date_from = pd.to_datetime("2019-10-15")
+    date_to = pd.to_datetime("2020-01-10")
+
+    period_months = get_period_months(
+        get_calender_months(date_from, date_to), date_from, date_to
+    )
+
+    assert list(period_months[CONST_COL_NAME_YM]) == [
+        "2019-10",
+        "2019-11",
+        "2019-12",
+        "2020-01",
+    ]
+    assert period_months["start"].iloc[0] == date_from
+    assert period_months["end"].iloc[0] == pd.to_datetime("2019-10-31")
+    assert period_months["end"].iloc[-1] == date_to
+    assert list(period_months["days"]) == [16, 29, 30, 9]
+
+
+def test_project_budgets():
+
+    date_from = pd.to_datetime("2019-10-01")
+    date_to = pd.to_datetime("2020-01-31")
+
+    # October and November have passed
+    dt_now = pd.to_datetime("2019-11-30")
+
+    period_months = get_period_months(
+        get_calender_months(date_from, date_to), date_from, date_to
+    )
+
+    assert list(period_months["days"]) == [30, 29, 30, 30]
+
+    nan = np.nan
+
+    # EA budget: 12 months (366 days) from November, 225 spent, 13 months
+    # (337 days) left counting November
+    ea_args = (
+        1200.0,
+        pd.to_datetime("2019-11-01"),
+        pd.to_datetime("2020-11-01"),
+        225.0,
+        dt_now,
+    )
+    ea_flags = dict(count_current_month=True, zero_before_start=True)
+
+    # sponsorship: 12 months (366 days) from October, 100 spent, 11 months
+    # (306 days) left
+    spnsr_args = (
+        1200.0,
+        pd.to_datetime("2019-10-01"),
+        pd.to_datetime("2020-10-01"),
+        100.0,
+        dt_now,
+    )
+
+    for args, flags, use_days, exp_ideal, exp_avail in [
+        (
+            ea_args,
+            ea_flags,
+            False,
+            [0.0, 100.0, nan, nan],
+            [nan, nan, 75.0, 75.0],
+        ),
+        (
+            ea_args,
+            ea_flags,
+            True,
+            [0.0, 95.08196721, nan, nan],
+            [nan, nan, 86.79525223, 86.79525223],
+        ),
+        (
+            spnsr_args,
+            {},
+            False,
+            [100.0, 100.0, nan, nan],
+            [nan, nan, 100.0, 100.0],
+        ),
+        (
+            spnsr_args,
+            {},
+            True,
+            [98.36065574, 95.08196721, nan, nan],
+            [nan, nan, 107.84313725, 107.84313725],
+        ),
+    ]:
+        ideal_costs, avail_costs = project_budgets(
+            period_months, *args, use_days=use_days, **flags
+        )
+
+        assert ideal_costs.shape == (1, 4)
+        np.testing.assert_allclose(ideal_costs[0], exp_ideal, rtol=1e-8)
+        np.testing.assert_allclose(avail_costs[0], exp_avail, rtol=1e-8)
+
+    # what-if amounts projected in one call
+    ideal_costs, avail_costs = project_budgets(
+        period_months, [1200.0, 2520.0, 3840.0], *spnsr_args[1:]
+    )
+
+    np.testing.assert_allclose(ideal_costs[:, 1], [100.0, 210.0, 320.0])
+    np.testing.assert_allclose(avail_costs[:, 2], [100.0, 220.0, 340.0])
+
+    period_months = get_period_months(
+        get_calender_months(
+            pd.to_datetime("2019-10-01"), pd.to_datetime("2020-09-30")
+        ),
+        pd.to_datetime("2019-10-01"),
+        pd.to_datetime("2020-09-30"),
+    )
+
+    # several budgets with their own date ranges
+    ideal_costs, avail_costs = project_budgets(
+        period_months,
+        [1200.0, 1200.0],
+        pd.to_datetime(["2019-01-01", "2020-01-01"]),
+        pd.to_datetime(["2020-01-01", "2021-01-01"]),
+        [0.0, 0.0],
+        pd.to_datetime("2019-12-31"),
+        count_current_month=True,
+        zero_before_start=True,
+    )
+
+    assert list(ideal_costs[0, :3]) == [100.0, 100.0, 100.0]
+    assert list(ideal_costs[1, :3]) == [0.0, 0.0, 0.0]
+    # the first budget ends with the year, the second one has 14 months
+    # left counting December
+    assert avail_costs[0, 3] == 0.0
+    assert avail_costs[1, 3] == 1200.0 / 14
+
+    result = create_projection_df(
+        period_months, ideal_costs[1], avail_costs[1]
+    )
+    assert list(result.columns) == [
+        CONST_COL_NAME_YM,
+        CONST_COL_NAME_IDEALCOST,
+        CONST_COL_NAME_AVAILCOST,
+    ]
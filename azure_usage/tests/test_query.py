@@ -0,0 +1,157 @@
+"""
+test querying usage data by subscription and date range
+"""
+
+import os
+import pandas as pd
+
+from ..src_webapp.query import SubscriptionIndex, slice_date_range
+
+from ..src_webapp.subs import get_data_for_subid
+
+from ..src_webapp.data_loader import create_dataframe, compact_dataframe
+
+from ..src_webapp.utilities import prep_sub_ids
+
+from ..src_webapp.constants import (
+    CONST_TEST_DIR_DATA_LOADER,
+    CONST_TEST_DIR_1,
+    CONST_TEST_DIR_4,
+    CONST_TEST_DIR_5,
+    CONST_TEST_DIR_1_SUB_ID_1,
+    CONST_TEST_DIR_1_SUB_ID_2,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_SGUID,
+)
+
+
+def _filter(df, sub_ids, date_from, date_to):
+    """Boolean filter the index is checked against"""
+
+    return df[
+        df[CONST_COL_NAME_SGUID].isin(sub_ids)
+        & (df[CONST_COL_NAME_DATE] >= pd.Timestamp(date_from))
+        & (df[CONST_COL_NAME_DATE] <= pd.Timestamp(date_to))
+    ]
+
+
+def test_subscription_index():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    raw_usage = compact_dataframe(create_dataframe(data_path))
+
+    sub_index = SubscriptionIndex(raw_usage)
+
+    # sorted by subscription and date
+    assert sub_index.df.equals(
+        raw_usage.sort_values(
+            [CONST_COL_NAME_SGUID, CONST_COL_NAME_DATE], kind="mergesort"
+        ).reset_index(drop=True)
+    )
+    assert sorted(sub_index.sub_ids) == sorted(
+        raw_usage[CONST_COL_NAME_SGUID].unique()
+    )
+
+    sub_id_1 = prep_sub_ids(CONST_TEST_DIR_1_SUB_ID_1)
+    sub_ids = prep_sub_ids(
+        CONST_TEST_DIR_1_SUB_ID_1 + "," + CONST_TEST_DIR_1_SUB_ID_2
+    )
+
+    assert len(get_data_for_subid(sub_index, sub_id_1).index) == 15
+    assert len(get_data_for_subid(sub_index, sub_ids).index) == 29
+    assert get_data_for_subid(sub_index, prep_sub_ids("abc,xxx")).empty
+    assert get_data_for_subid(sub_index, prep_sub_ids("")).empty
+
+    pd.testing.assert_frame_equal(
+        get_data_for_subid(sub_index, sub_ids),
+        get_data_for_subid(sub_index.df, sub_ids),
+    )
+
+    # date ranges within the subscriptions
+    for date_from, date_to in [
+        ("2016-01-01", "2021-01-01"),
+        ("2016-10-31", "2016-10-31"),
+        ("2016-10-30", "2016-10-30"),
+        ("2016-11-01", "2016-10-01"),
+        ("2016-11-01", "2021-01-01"),
+    ]:
+        pd.testing.assert_frame_equal(
+            sub_index.get_rows(sub_ids, date_from, date_to),
+            _filter(sub_index.df, sub_ids, date_from, date_to),
+        )
+
+    assert sub_index.get_slice("abc") == (0, 0)
+
+
+def test_subscription_index_unsorted():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    raw_usage = create_dataframe(data_path)
+
+    shuffled = raw_usage.sample(frac=1, random_state=0)
+    sub_index = SubscriptionIndex(shuffled)
+
+    sub_ids = sub_index.sub_ids
+
+    assert len(sub_index.get_rows(sub_ids).index) == len(raw_usage.index)
+    for date_from, date_to in [
+        ("2019-01-01", "2019-03-31"),
+        ("2018-10-11", "2018-10-11"),
+        ("2019-03-31", "2019-01-01"),
+    ]:
+        pd.testing.assert_frame_equal(
+            sub_index.get_rows(sub_ids, date_from, date_to),
+            _filter(sub_index.df, sub_ids, date_from, date_to),
+        )
+
+    # empty dataframes
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_4)
+    sub_index = SubscriptionIndex(create_dataframe(data_path))
+    assert sub_index.get_rows(["abc"]).empty
+
+    sub_index = SubscriptionIndex(pd.DataFrame())
+    assert sub_index.sub_ids == []
+    assert sub_index.get_rows("abc").empty
+
+
+def test_slice_date_range():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    raw_usage = create_dataframe(data_path)
+
+    date_sorted = raw_usage.sort_values(CONST_COL_NAME_DATE, kind="mergesort")
+
+    for date_from, date_to in [
+        ("2019-01-01", "2019-03-31"),
+        ("2018-10-11", "2018-10-11"),
+        ("2019-03-31", "2019-01-01"),
+        ("2010-01-01", "2030-01-01"),
+    ]:
+        expected = date_sorted[
+            (date_sorted[CONST_COL_NAME_DATE] >= pd.Timestamp(date_from))
+            & (date_sorted[CONST_COL_NAME_DATE] <= pd.Timestamp(date_to))
+        ]
+
+        pd.testing.assert_frame_equal(
+            slice_date_range(date_sorted, date_from, date_to), expected
+        )
+
+        # the sortedness recorded by the caller skips the check
+        for is_sorted in [True, False]:
+            pd.testing.assert_frame_equal(
+                slice_date_range(date_sorted, date_from, date_to, is_sorted),
+                expected,
+            )
+
+        # unsorted dataframes keep the order of their rows
+        shuffled = raw_usage.sample(frac=1, random_state=0)
+        pd.testing.assert_frame_equal(
+            slice_date_range(shuffled, date_from, date_to),
+            shuffled[
+                (shuffled[CONST_COL_NAME_DATE] >= pd.Timestamp(date_from))
+                & (shuffled[CONST_COL_NAME_DATE] <= pd.Timestamp(date_to))
+            ],
+        )
+
+    assert slice_date_range(date_sorted).equals(date_sorted)
+    assert slice_date_range(pd.DataFrame(), "2019-01-01").empty
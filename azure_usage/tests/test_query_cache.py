@@ -0,0 +1,69 @@
+"""
+test the LRU cache of dashboard query results
+"""
+
+import pandas as pd
+
+from ..src_webapp.query_cache import QueryCache, estimate_size
+
+
+def test_query_cache_lru():
+
+    cache = QueryCache(2, 1024 * 1024)
+    cache.set_version("v1")
+
+    assert cache.get("a") is None
+
+    cache.put("a", "result a")
+    cache.put("b", "result b")
+
+    assert cache.get("a") == "result a"
+
+    # "b" is the least recently used
+    cache.put("c", "result c")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "result a"
+    assert cache.get("c") == "result c"
+
+    metrics = cache.metrics()
+    assert metrics["entries"] == 2
+    assert metrics["hits"] == 3
+    assert metrics["misses"] == 2
+    assert metrics["evictions"] == 1
+
+    # the same version keeps the results, a new one drops them
+    cache.set_version("v1")
+    assert cache.get("a") == "result a"
+
+    cache.set_version("v2")
+    assert cache.get("a") is None
+    assert cache.metrics()["entries"] == 0
+    assert cache.metrics()["bytes"] == 0
+
+
+def test_query_cache_memory():
+
+    frame = pd.DataFrame({"Cost": range(1000)})
+    frame_size = estimate_size(frame)
+
+    assert frame_size >= 8000
+    assert estimate_size({"a": frame, "b": frame.copy()}) > 2 * frame_size
+
+    # a frame shared by several values is counted once
+    assert estimate_size({"a": frame, "b": frame}) < 2 * frame_size
+
+    cache = QueryCache(10, int(2.5 * frame_size))
+
+    for key in range(3):
+        cache.put(key, frame)
+
+    # only two frames fit into the memory limit
+    assert cache.get(0) is None
+    assert cache.get(1) is frame
+    assert cache.metrics()["bytes"] == 2 * frame_size
+
+    # too large to be cached at all
+    cache.put("large", pd.concat([frame] * 3))
+    assert cache.get("large") is None
+    assert cache.metrics()["entries"] == 2
@@ -11,9 +11,13 @@ from math import pi
 from ..src_webapp.subs import (
     get_data_for_subid,
     get_top_services,
+    group_services,
     calc_top_services_perc,
+    SubscriptionNames,
 )
 
+from ..src_webapp.query import SubscriptionIndex
+
 from ..src_webapp.constants import (
     CONST_TEST_DIR_DATA_LOADER,
     # CONST_TEST_DIR_0,
@@ -23,7 +27,9 @@ from ..src_webapp.constants import (
     CONST_TEST_DIR_1_SUB_ID_1,
     CONST_TEST_DIR_1_SUB_ID_2,
     CONST_COL_NAME_COST,
-    # CONST_COL_NAME_SERVICETYPE,
+    CONST_COL_NAME_SERVICENAME,
+    CONST_COL_NAME_SERVICETYPE,
+    CONST_COL_NAME_SERVICERESOURCE,
     CONST_COL_NAME_SERVICE,
     CONST_COL_NAME_ANGLE,
     # CONST_MAX_TOP_SERVICES,
@@ -33,11 +39,16 @@ from ..src_webapp.constants import (
     CONST_RB_VALUE_1,
     CONST_RB_VALUE_2,
     CONST_RB_VALUE_3,
+    CONST_COL_NAME_SGUID,
+    CONST_COL_NAME_SNAME,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_DATE_FROM,
+    CONST_COL_NAME_DATE_TO,
 )
 
 from ..src_webapp.utilities import prep_sub_ids
 
-from ..src_webapp.data_loader import create_dataframe
+from ..src_webapp.data_loader import create_dataframe, compact_dataframe
 
 
 def test_get_data_for_subid():
@@ -238,3 +249,182 @@ def test_calc_top_services_perc():
     assert round(top_services[CONST_COL_NAME_ANGLE].sum(), 13) == round(
         test_value, 13
     )
+
+
+def test_get_top_services_compact():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_6)
+    raw_usage = create_dataframe(data_path)
+    compact_usage = compact_dataframe(raw_usage)
+
+    for grp_md in [
+        CONST_RB_VALUE_0,
+        CONST_RB_VALUE_1,
+        CONST_RB_VALUE_2,
+        CONST_RB_VALUE_3,
+    ]:
+        pd.testing.assert_frame_equal(
+            get_top_services(compact_usage, top_services_grp_md=grp_md),
+            get_top_services(raw_usage, top_services_grp_md=grp_md),
+        )
+
+    # subscriptions filtered out of the data are not grouped
+    sub_usage = get_data_for_subid(compact_usage, ["abc"])
+    assert get_top_services(sub_usage).empty
+
+
+def test_get_top_services_ties():
+
+    usage = pd.DataFrame(
+        {
+            CONST_COL_NAME_SERVICENAME: ["n"] * 6,
+            CONST_COL_NAME_SERVICETYPE: ["d", "b", "a", "c", "a", None],
+            CONST_COL_NAME_SERVICERESOURCE: ["r"] * 6,
+            CONST_COL_NAME_COST: [2.0, 2.0, 1.0, 2.0, 4.0, 9.0],
+        }
+    )
+
+    # services with the same cost are selected and sorted by their label,
+    # rows without a service are left out
+    top_services = get_top_services(usage, top_services_num=2)
+    assert list(top_services[CONST_COL_NAME_SERVICE]) == [
+        "a",
+        CONST_NAME_OTHER + " (2)",
+        "b",
+    ]
+    assert list(top_services[CONST_COL_NAME_COST]) == [5.0, 4.0, 2.0]
+
+    top_services = get_top_services(
+        usage, top_services_num=3, top_services_grp_md=CONST_RB_VALUE_1
+    )
+    assert list(top_services[CONST_COL_NAME_SERVICE]) == [
+        "n: a: r",
+        "n: b: r",
+        "n: c: r",
+        CONST_NAME_OTHER + " (1)",
+    ]
+
+    # no top services, everything is Other
+    top_services = get_top_services(usage, top_services_num=0)
+    assert list(top_services[CONST_COL_NAME_SERVICE]) == [
+        CONST_NAME_OTHER + " (4)"
+    ]
+    assert top_services[CONST_COL_NAME_PERC].sum() == 1
+
+
+def test_group_services():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_6)
+    raw_usage = create_dataframe(data_path)
+
+    for usage in [raw_usage, compact_dataframe(raw_usage)]:
+        services = group_services(usage)
+
+        assert len(services.index) <= len(usage.index)
+        assert services[CONST_COL_NAME_COST].sum() == (
+            usage[CONST_COL_NAME_COST].sum()
+        )
+
+        # the groupings are rolled up from the services
+        for grp_md in [
+            CONST_RB_VALUE_0,
+            CONST_RB_VALUE_1,
+            CONST_RB_VALUE_2,
+            CONST_RB_VALUE_3,
+        ]:
+            pd.testing.assert_frame_equal(
+                get_top_services(services, top_services_grp_md=grp_md),
+                get_top_services(usage, top_services_grp_md=grp_md),
+            )
+
+    # missing values are a service of their own
+    usage = pd.DataFrame(
+        {
+            CONST_COL_NAME_SERVICENAME: ["n", None, "n"],
+            CONST_COL_NAME_SERVICETYPE: ["a", "a", "a"],
+            CONST_COL_NAME_SERVICERESOURCE: ["r", "r", "r"],
+            CONST_COL_NAME_COST: [1.0, 2.0, 4.0],
+        }
+    )
+    services = group_services(usage)
+
+    assert list(services[CONST_COL_NAME_COST]) == [5.0, 2.0]
+    assert list(
+        get_top_services(services, top_services_grp_md=CONST_RB_VALUE_1)[
+            CONST_COL_NAME_COST
+        ]
+    ) == [5.0]
+    assert list(get_top_services(services)[CONST_COL_NAME_COST]) == [7.0]
+
+    assert group_services(pd.DataFrame()) is None
+
+    # an empty selection
+    for usage in [raw_usage.iloc[0:0], group_services(raw_usage.iloc[0:0])]:
+        result = get_top_services(usage)
+
+        assert result.empty
+        assert result[CONST_COL_NAME_SERVICE].dtype == object
+        assert result[CONST_COL_NAME_COST].dtype == "float64"
+
+
+def test_subscription_names():
+
+    usage = pd.DataFrame(
+        {
+            CONST_COL_NAME_SGUID: ["B", "A", "A", "A", "B", "A", "A"],
+            CONST_COL_NAME_SNAME: ["b", "a1", "a2", "a1", "b", "a2", "a3"],
+            CONST_COL_NAME_DATE: pd.to_datetime(
+                [
+                    "2020-01-02",
+                    "2020-01-01",
+                    "2020-01-05",
+                    "2020-01-02",
+                    "2020-01-03",
+                    "2020-01-06",
+                    "2020-01-09",
+                ]
+            ),
+        }
+    )
+
+    sub_names = SubscriptionNames(SubscriptionIndex(compact_dataframe(usage)))
+
+    history = sub_names.get_history("A")
+    assert list(history[CONST_COL_NAME_SNAME]) == ["a1", "a2", "a3"]
+    assert list(history[CONST_COL_NAME_DATE_FROM]) == list(
+        pd.to_datetime(["2020-01-01", "2020-01-05", "2020-01-09"])
+    )
+    assert list(history[CONST_COL_NAME_DATE_TO]) == list(
+        pd.to_datetime(["2020-01-02", "2020-01-06", "2020-01-09"])
+    )
+    assert list(sub_names.get_history("B")[CONST_COL_NAME_SNAME]) == ["b"]
+    assert sub_names.get_history("C").empty
+    assert len(sub_names.history.index) == 4
+
+    # the name used on the last day with usage in the date range
+    assert sub_names.get_latest_name("A") == "a3"
+    assert sub_names.get_latest_name("A", date_to="2020-01-08") == "a2"
+    assert sub_names.get_latest_name("A", "2020-01-01", "2020-01-04") == "a1"
+    assert sub_names.get_latest_name("A", "2020-01-03", "2020-01-04") is None
+    assert sub_names.get_latest_name("C") is None
+
+    assert sub_names.get_latest_names(
+        ["B", "C", "A"], date_to="2020-01-02"
+    ) == ["b", "a1"]
+
+    # the same names as the last row of each subscription in the range
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    sub_index = SubscriptionIndex(
+        compact_dataframe(create_dataframe(data_path))
+    )
+    sub_names = SubscriptionNames(sub_index)
+
+    for sub_id in sub_index.sub_ids:
+        assert sub_names.get_latest_name(sub_id) == (
+            sub_index.get_rows(sub_id)[CONST_COL_NAME_SNAME].iloc[-1]
+        )
+
+    sub_names = SubscriptionNames(SubscriptionIndex(pd.DataFrame()))
+    assert sub_names.get_latest_name("A") is None
+    assert sub_names.get_latest_names(["A"]) == []
+    assert sub_names.get_history("A").empty
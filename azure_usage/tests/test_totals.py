@@ -5,26 +5,53 @@ Author: Tomas Lazauskas
 """
 
 import os
+import pytest
+import numpy as np
 import pandas as pd
 
 from ..src_webapp.totals import (
+    create_daily_cube,
+    create_global_cube,
     group_day,
     group_year_month,
     group_sub_year_month,
+    group_period,
+    get_resolution,
+    get_year_months,
+    format_year_months,
+    add_running_totals,
+    group_sub_running_totals,
+    get_running_total_cols,
+    get_year_month_range,
+    add_missing_year_months,
 )
 
-from ..src_webapp.data_loader import create_dataframe
+from ..src_webapp.data_loader import create_dataframe, compact_dataframe
+from ..src_webapp.subs import get_data_for_subid, get_top_services
+from ..src_webapp.utilities import prep_sub_ids
 
 from ..src_webapp.constants import (
     CONST_COL_NAME_COST,
     CONST_COL_NAME_DATE,
     CONST_COL_NAME_SGUID,
     CONST_COL_NAME_YM,
+    CONST_COL_NAME_QUANTITY,
+    CONST_COL_NAME_SERVICERESOURCE,
+    CONST_RB_VALUE_0,
+    CONST_RB_VALUE_1,
+    CONST_RB_VALUE_2,
+    CONST_RB_VALUE_3,
     CONST_TEST_DIR_DATA_LOADER,
     CONST_TEST_DIR_1,
     CONST_TEST_DIR_5,
+    CONST_TEST_DIR_8,
     CONST_TEST_DIR_1_SUB_ID_1,
     CONST_TEST_DIR_1_SUB_ID_2,
+    CONST_COL_NAME_END,
+    CONST_RESOLUTION_DAY,
+    CONST_RESOLUTION_WEEK,
+    CONST_RESOLUTION_MONTH,
+    CONST_COL_NAME_CUMULATIVE,
 )
 
 
@@ -50,6 +77,209 @@ def test_group_day():
     assert round(result[CONST_COL_NAME_COST].sum(), 10) == 1097.9489568535
 
 
+def test_group_period():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    raw_usage = create_dataframe(data_path)
+
+    daily = group_day(raw_usage, add_missing_days=True)
+
+    assert get_resolution("2019-01-01", "2019-12-31") == CONST_RESOLUTION_DAY
+    assert get_resolution("2018-01-01", "2019-12-31") == CONST_RESOLUTION_WEEK
+    assert get_resolution("2010-01-01", "2019-12-31") == (
+        CONST_RESOLUTION_MONTH
+    )
+    assert get_resolution("2019-01-01", "2019-01-10", 9) == (
+        CONST_RESOLUTION_WEEK
+    )
+
+    result = group_period(daily, CONST_RESOLUTION_DAY)
+    assert (result[CONST_COL_NAME_DATE] == daily[CONST_COL_NAME_DATE]).all()
+    assert (result[CONST_COL_NAME_COST] == daily[CONST_COL_NAME_COST]).all()
+
+    result = group_period(daily, CONST_RESOLUTION_WEEK)
+    assert (result[CONST_COL_NAME_DATE].dt.dayofweek == 0).all()
+    # 2018-10-11 to 2019-08-11, from Thursday to Sunday
+    assert len(result.index) == 44
+    assert round(result[CONST_COL_NAME_COST].sum(), 10) == round(
+        daily[CONST_COL_NAME_COST].sum(), 10
+    )
+
+    result = group_period(daily, CONST_RESOLUTION_MONTH)
+    pd.testing.assert_series_equal(
+        result[CONST_COL_NAME_COST],
+        group_year_month(raw_usage)[CONST_COL_NAME_COST],
+    )
+    assert (result[CONST_COL_NAME_DATE].dt.day == 1).all()
+
+    # the bars do not overlap
+    assert (
+        result[CONST_COL_NAME_END].iloc[:-1].values
+        < result[CONST_COL_NAME_DATE].iloc[1:].values
+    ).all()
+
+    for resolution in [CONST_RESOLUTION_WEEK, CONST_RESOLUTION_MONTH]:
+        assert group_period(daily.iloc[0:0], resolution).empty
+
+
+def test_running_totals():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    raw_usage = create_dataframe(data_path)
+
+    assert get_running_total_cols([7]) == [CONST_COL_NAME_CUMULATIVE, "Avg7D"]
+
+    # checked against pandas' cumulative sum and calender day windows, the
+    # averages of the first days of a subscription are over the days so far
+    expected = (
+        raw_usage.groupby([CONST_COL_NAME_SGUID, CONST_COL_NAME_DATE])[
+            CONST_COL_NAME_COST
+        ]
+        .sum()
+        .reset_index()
+    )
+    expected[CONST_COL_NAME_CUMULATIVE] = expected.groupby(
+        CONST_COL_NAME_SGUID
+    )[CONST_COL_NAME_COST].cumsum()
+    first_days = expected.groupby(CONST_COL_NAME_SGUID)[
+        CONST_COL_NAME_DATE
+    ].transform("min")
+    sub_days = (expected[CONST_COL_NAME_DATE] - first_days).dt.days + 1
+    for window in [7, 30]:
+        window_sums = (
+            expected.set_index(CONST_COL_NAME_DATE)
+            .groupby(CONST_COL_NAME_SGUID)[CONST_COL_NAME_COST]
+            .rolling("{}D".format(window))
+            .sum()
+            .values
+        )
+        expected["Avg{}D".format(window)] = window_sums / np.minimum(
+            sub_days, window
+        )
+
+    for usage in [raw_usage, compact_dataframe(raw_usage)]:
+        pd.testing.assert_frame_equal(
+            group_sub_running_totals(usage), expected, check_exact=False
+        )
+
+    # usage grouped by day, with the missing days
+    daily = add_running_totals(group_day(raw_usage, add_missing_days=True))
+
+    assert round(daily[CONST_COL_NAME_CUMULATIVE].iloc[-1], 10) == round(
+        raw_usage[CONST_COL_NAME_COST].sum(), 10
+    )
+    pd.testing.assert_series_equal(
+        daily["Avg7D"],
+        daily[CONST_COL_NAME_COST].rolling(7, min_periods=1).sum()
+        / np.minimum(np.arange(1, len(daily.index) + 1), 7),
+        check_names=False,
+    )
+
+    # the bars carry the running totals of their last day
+    result = group_period(daily, CONST_RESOLUTION_WEEK)
+    assert list(result.columns[3:]) == get_running_total_cols()
+    assert result[CONST_COL_NAME_CUMULATIVE].iloc[-1] == (
+        daily[CONST_COL_NAME_CUMULATIVE].iloc[-1]
+    )
+    result = group_period(daily, CONST_RESOLUTION_MONTH)
+    assert (
+        result["Avg30D"].iloc[0]
+        == daily.loc[
+            daily[CONST_COL_NAME_DATE] == "2018-10-31", "Avg30D"
+        ].iloc[0]
+    )
+
+    assert group_sub_running_totals(raw_usage.iloc[0:0]).empty
+    assert add_running_totals(daily.iloc[0:0]).empty
+
+
+def test_year_months():
+
+    dates = pd.Series(
+        pd.to_datetime(
+            ["2019-07-31", "2019-07-01", "2020-12-15", "2001-01-01"]
+        )
+    )
+
+    months = get_year_months(dates)
+    assert list(format_year_months(months)) == [
+        "2019-07",
+        "2019-07",
+        "2020-12",
+        "2001-01",
+    ]
+    assert months[0] == months[1]
+    assert list(format_year_months(dates.values)) == list(
+        format_year_months(months)
+    )
+    assert len(format_year_months(get_year_months(dates.iloc[0:0]))) == 0
+
+
+def test_add_missing_year_months():
+    def _months(date_from, date_to):
+        return list(
+            format_year_months(
+                get_year_month_range(
+                    pd.Timestamp(date_from), pd.Timestamp(date_to)
+                )
+            )
+        )
+
+    # stepping by months from the start date, before the end date
+    assert _months("2019-10-01", "2020-01-01") == [
+        "2019-10",
+        "2019-11",
+        "2019-12",
+    ]
+    assert _months("2019-10-15", "2020-01-10") == [
+        "2019-10",
+        "2019-11",
+        "2019-12",
+    ]
+    # the day is cut to the end of February and stays there
+    assert _months("2019-01-31", "2019-03-30") == [
+        "2019-01",
+        "2019-02",
+        "2019-03",
+    ]
+    assert _months("2019-10-01", "2019-10-01") == []
+    assert _months("2019-10-01", "2019-09-01") == []
+
+    usage = pd.DataFrame(
+        {
+            CONST_COL_NAME_YM: ["2019-12", "2019-10"],
+            CONST_COL_NAME_COST: [1.0, 2.0],
+        }
+    )
+
+    result = add_missing_year_months(
+        usage,
+        pd.Timestamp("2019-10-01"),
+        pd.Timestamp("2020-01-31"),
+        CONST_COL_NAME_COST,
+    )
+    assert list(result[CONST_COL_NAME_YM]) == [
+        "2019-10",
+        "2019-11",
+        "2019-12",
+        "2020-01",
+    ]
+    assert list(result[CONST_COL_NAME_COST]) == [2.0, 0.0, 1.0, 0.0]
+
+    # each subscription gets all the months
+    usage[CONST_COL_NAME_SGUID] = ["a", "b"]
+
+    result = add_missing_year_months(
+        usage,
+        pd.Timestamp("2019-10-01"),
+        pd.Timestamp("2019-12-31"),
+        CONST_COL_NAME_COST,
+        [CONST_COL_NAME_SGUID],
+    )
+    assert list(result[CONST_COL_NAME_SGUID]) == ["a", "b"] * 3
+    assert list(result[CONST_COL_NAME_COST]) == [0.0, 2.0, 0.0, 0.0, 1.0, 0.0]
+
+
 def test_group_year_month():
 
     data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
@@ -144,3 +374,111 @@ def test_group_sub_year_month():
         )
         == 168.824052184
     )
+
+
+def test_group_compact():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_1)
+    raw_usage = create_dataframe(data_path)
+    compact_usage = compact_dataframe(raw_usage, float32_quantity=True)
+
+    pd.testing.assert_frame_equal(
+        group_day(compact_usage, add_missing_days=True),
+        group_day(raw_usage, add_missing_days=True),
+    )
+
+    # only the subscriptions present in the data are grouped
+    sub_ids = prep_sub_ids(CONST_TEST_DIR_1_SUB_ID_1)
+    result = group_sub_year_month(get_data_for_subid(compact_usage, sub_ids))
+
+    assert set(result[CONST_COL_NAME_SGUID]) == set(sub_ids)
+    assert result[CONST_COL_NAME_COST].sum() == (
+        group_sub_year_month(get_data_for_subid(raw_usage, sub_ids))[
+            CONST_COL_NAME_COST
+        ].sum()
+    )
+
+
+def test_create_daily_cube():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_8)
+    raw_usage = compact_dataframe(create_dataframe(data_path))
+
+    cube = create_daily_cube(raw_usage)
+
+    assert len(cube.index) == 323
+    assert cube[CONST_COL_NAME_COST].sum() == pytest.approx(
+        raw_usage[CONST_COL_NAME_COST].sum()
+    )
+    assert cube[CONST_COL_NAME_QUANTITY].sum() == pytest.approx(
+        raw_usage[CONST_COL_NAME_QUANTITY].sum()
+    )
+
+    # the dashboard aggregations give the same results on the cube
+    pd.testing.assert_frame_equal(
+        group_day(cube, add_missing_days=True),
+        group_day(raw_usage, add_missing_days=True),
+    )
+
+    for grp_md in [
+        CONST_RB_VALUE_0,
+        CONST_RB_VALUE_1,
+        CONST_RB_VALUE_2,
+        CONST_RB_VALUE_3,
+    ]:
+        pd.testing.assert_frame_equal(
+            get_top_services(cube, top_services_grp_md=grp_md),
+            get_top_services(raw_usage, top_services_grp_md=grp_md),
+        )
+
+    # rows with missing keys are not dropped
+    raw_usage = raw_usage.copy()
+    raw_usage[CONST_COL_NAME_SERVICERESOURCE] = None
+
+    cube = create_daily_cube(raw_usage)
+    assert cube[CONST_COL_NAME_COST].sum() == pytest.approx(
+        raw_usage[CONST_COL_NAME_COST].sum()
+    )
+
+    # sorted by subscription and day
+    assert cube.equals(
+        cube.sort_values(
+            [CONST_COL_NAME_SGUID, CONST_COL_NAME_DATE], kind="mergesort"
+        ).reset_index(drop=True)
+    )
+
+    assert create_daily_cube(pd.DataFrame()).empty
+
+
+def test_create_global_cube():
+
+    data_path = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_8)
+    raw_usage = compact_dataframe(create_dataframe(data_path))
+
+    global_cube = create_global_cube(create_daily_cube(raw_usage))
+
+    assert CONST_COL_NAME_SGUID not in global_cube.columns
+    assert global_cube[CONST_COL_NAME_DATE].is_monotonic_increasing
+    assert len(global_cube.index) < len(create_daily_cube(raw_usage).index)
+
+    # the usage of all the subscriptions is the same, up to the order of
+    # the summation
+    pd.testing.assert_frame_equal(
+        group_day(global_cube, add_missing_days=True),
+        group_day(raw_usage, add_missing_days=True),
+        check_exact=False,
+    )
+
+    for grp_md in [
+        CONST_RB_VALUE_0,
+        CONST_RB_VALUE_1,
+        CONST_RB_VALUE_2,
+        CONST_RB_VALUE_3,
+    ]:
+        pd.testing.assert_frame_equal(
+            get_top_services(global_cube, top_services_grp_md=grp_md),
+            get_top_services(raw_usage, top_services_grp_md=grp_md),
+            check_exact=False,
+        )
+
+    assert create_global_cube(pd.DataFrame()).empty
@@ -0,0 +1,141 @@
+"""
+A script to benchmark parsing of the Date column of usage files: the previous
+    chain of format attempts vs the single pass with format detection.
+
+The number of pandas.to_datetime calls and of the date strings they were
+    given are counted for both parsers.
+
+Usage:
+    python utils/bench_date_parsing.py -r 2000000
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "azure_usage"))
+
+from src_webapp.data_loader import parse_dates  # noqa: E402
+from src_webapp.constants import (  # noqa: E402
+    CONST_COL_NAME_DATE,
+    CONST_TEST_DIR_DATA_LOADER,
+    CONST_TEST_DIR_1,
+    CONST_TEST_DIR_5,
+    CONST_TEST_DIR_8,
+)
+
+# pandas.to_datetime calls made by the parsers and rows given to them
+PANDAS_TO_DATETIME = pd.to_datetime
+PASS_CNT = [0, 0]
+
+
+def setup():
+    """
+    Prepared arguments for the command line
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark parsing of usage dates."
+    )
+    parser.add_argument(
+        "-r",
+        "--rows",
+        help="Number of rows of each scaled fixture",
+        type=int,
+        default=2000000,
+    )
+
+    return parser.parse_args()
+
+
+def to_datetime(dates, *args, **kwargs):
+    """Counts the calls of pandas.to_datetime and the parsed rows"""
+
+    PASS_CNT[0] += 1
+    PASS_CNT[1] += len(dates)
+
+    return PANDAS_TO_DATETIME(dates, *args, **kwargs)
+
+
+def parse_chain(dates, start_date):
+    """The previous parser: tries formats one after another"""
+
+    if start_date > datetime.datetime(2020, 1, 24, 0, 0):
+        formats = ["%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%d"]
+    else:
+        formats = ["%m/%d/%Y", "%d/%m/%Y", "%Y-%m-%d"]
+
+    for date_format in formats[:-1]:
+        try:
+            return pd.to_datetime(dates, format=date_format)
+        except Exception:
+            pass
+
+    return pd.to_datetime(dates, format=formats[-1])
+
+
+def parse_detect(dates, start_date):
+    """The current parser: detects the format, then parses once"""
+
+    return parse_dates(dates, start_date)
+
+
+def load_fixture_dates(test_dir, rows_cnt):
+    """Reads in a test fixture's dates and scales them to rows_cnt rows"""
+
+    fixture_dir = os.path.join(CONST_TEST_DIR_DATA_LOADER, test_dir)
+    dates = pd.read_csv(
+        os.path.join(fixture_dir, sorted(os.listdir(fixture_dir))[0])
+    )[CONST_COL_NAME_DATE]
+
+    repeats = rows_cnt // len(dates) + 1
+
+    return pd.concat([dates] * repeats, ignore_index=True).iloc[:rows_cnt]
+
+
+def run_case(name, dates, start_date):
+    """Benchmarks both parsers on one case"""
+
+    results = []
+
+    for parser in [parse_chain, parse_detect]:
+        PASS_CNT[0] = 0
+        PASS_CNT[1] = 0
+        time_st = time.perf_counter()
+        parsed = parser(dates, start_date)
+        results.append(
+            (time.perf_counter() - time_st, PASS_CNT[0], PASS_CNT[1], parsed)
+        )
+
+    assert results[0][3].equals(results[1][3])
+
+    for parser_name, result in zip(["chain", "detect"], results):
+        print(
+            "{:<32} {:<6} {:.3f}s, {} passes, {:,d} strings parsed".format(
+                name, parser_name, result[0], result[1], result[2]
+            )
+        )
+
+
+if __name__ == "__main__":
+
+    args = setup()
+
+    pd.to_datetime = to_datetime
+
+    before_switch = datetime.datetime(2019, 10, 1)
+    after_switch = datetime.datetime(2020, 2, 1)
+
+    for test_dir in [CONST_TEST_DIR_1, CONST_TEST_DIR_5, CONST_TEST_DIR_8]:
+        us_dates = load_fixture_dates(test_dir, args.rows)
+        iso_dates = pd.Series(
+            pd.to_datetime(us_dates, format="%m/%d/%Y").dt.strftime("%Y-%m-%d")
+        )
+
+        run_case(test_dir + " US", us_dates, before_switch)
+        run_case(test_dir + " US after switch", us_dates, after_switch)
+        run_case(test_dir + " ISO", iso_dates, before_switch)
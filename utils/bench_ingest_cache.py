@@ -0,0 +1,106 @@
+"""
+A script to benchmark cold vs warm loads of Azure usage data with the
+    ingest cache.
+
+Usage:
+    python utils/bench_ingest_cache.py -n 365
+"""
+
+import argparse
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "azure_usage"))
+
+from src_webapp.data_loader import create_dataframe  # noqa: E402
+from src_webapp.constants import (  # noqa: E402
+    CONST_TEST_DIR_DATA_LOADER,
+    CONST_TEST_DIR_5,
+)
+
+
+def setup():
+    """
+    Prepared arguments for the command line
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingest cache of the data loader."
+    )
+    parser.add_argument(
+        "-n",
+        "--files",
+        help="Number of daily usage files to generate",
+        type=int,
+        default=365,
+    )
+
+    return parser.parse_args()
+
+
+def generate_data(data_path, files_cnt):
+    """
+    Generates daily usage files by replicating the test fixture
+
+    Args:
+        data_path - output directory
+        files_cnt - number of files to generate
+    """
+
+    fixture_dir = os.path.join(CONST_TEST_DIR_DATA_LOADER, CONST_TEST_DIR_5)
+    fixture_df = pd.read_csv(
+        os.path.join(fixture_dir, os.listdir(fixture_dir)[0])
+    )
+
+    day = pd.to_datetime("2019-01-01")
+
+    for _ in range(files_cnt):
+        day_str = day.strftime("%Y-%m-%d")
+        prev_str = (day - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+
+        fixture_df.assign(Date=day.strftime("%m/%d/%Y")).to_csv(
+            os.path.join(data_path, "{}-{}.csv".format(day_str, prev_str)),
+            index=False,
+        )
+
+        day += pd.Timedelta(days=1)
+
+
+def time_load(data_path, cache_dir):
+    """Times a single call of create_dataframe"""
+
+    time_st = time.perf_counter()
+    raw_usage = create_dataframe(data_path, cache_dir=cache_dir)
+
+    return time.perf_counter() - time_st, len(raw_usage.index)
+
+
+if __name__ == "__main__":
+
+    args = setup()
+
+    work_dir = tempfile.mkdtemp()
+
+    try:
+        data_path = os.path.join(work_dir, "data")
+        cache_dir = os.path.join(work_dir, "cache")
+        os.makedirs(data_path)
+
+        generate_data(data_path, args.files)
+
+        no_cache, rows = time_load(data_path, None)
+        cold, _ = time_load(data_path, cache_dir)
+        warm, _ = time_load(data_path, cache_dir)
+
+        print("files: {}, rows: {}".format(args.files, rows))
+        print("no cache: {:.3f}s".format(no_cache))
+        print("cold:     {:.3f}s".format(cold))
+        print("warm:     {:.3f}s ({:.1f}x)".format(warm, no_cache / warm))
+
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,116 @@
+"""
+A script to measure the bytes sent to the browser per dashboard update: the
+    previous replacement of the whole data of the column data sources (with
+    the Date_str and index columns) vs the current delta updates.
+
+A sequence of selections is applied to the daily usage and top services
+    sources of a document and the size of the PATCH-DOC message of each
+    update is reported.
+
+Usage:
+    python utils/bench_source_updates.py
+"""
+
+import os
+import sys
+
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "azure_usage"))
+
+from src_webapp.bokeh_server import (  # noqa: E402
+    UsageDashboard,
+    get_source_data,
+    update_source,
+    get_patch_doc_size,
+)
+from src_webapp.dataset import load_dataset  # noqa: E402
+from src_webapp.constants import (  # noqa: E402
+    CONST_COL_NAME_DATE,
+    CONST_TEST_DIR_DATA_LOADER,
+    CONST_TEST_DIR_5,
+    CONST_TEST_DIR_8,
+)
+
+
+def get_selections(dataset):
+    """A sequence of selections a user could make on a dataset"""
+
+    dates = dataset.raw_usage[CONST_COL_NAME_DATE]
+    date_min = dates.min()
+    date_max = dates.max()
+    date_mid = date_min + (date_max - date_min) / 2
+
+    sub_id = dataset.cube_index.sub_ids[-1].strip("{}")
+
+    return [
+        ("all, first half", ("ALLMODE", date_min, date_mid, 0)),
+        ("all, extended", ("ALLMODE", date_min, date_max, 0)),
+        ("all, other grouping", ("ALLMODE", date_min, date_max, 1)),
+        ("one subscription", (sub_id, date_min, date_max, 1)),
+        ("one subscription, later", (sub_id, date_mid, date_max, 1)),
+    ]
+
+
+def replace_data(source, df):
+    """The previous update: the whole data, as a dataframe would be sent"""
+
+    df = df.copy()
+
+    if CONST_COL_NAME_DATE in df.columns:
+        df["Date_str"] = df[CONST_COL_NAME_DATE].dt.strftime("%Y-%m-%d")
+
+    source.data = dict(ColumnDataSource(data=df).data)
+
+
+def run_case(name, dataset):
+    """Measures the bytes sent per update for both update methods"""
+
+    dashboard = UsageDashboard(dataset)
+
+    sizes = {}
+
+    for method in ["replace", "delta"]:
+        doc = Document()
+        sources = {
+            "total_usage": ColumnDataSource(data={}),
+            "top_services": ColumnDataSource(data={}),
+        }
+        for source in sources.values():
+            doc.add_root(source)
+
+        events = []
+        doc.on_change(events.append)
+
+        for selection_name, query in get_selections(dataset):
+            update = dashboard.aggregate_update(query)
+
+            events.clear()
+
+            for key, source in sources.items():
+                if method == "replace":
+                    replace_data(source, update[key])
+                else:
+                    update_source(source, get_source_data(update[key]))
+
+            sizes[(selection_name, method)] = get_patch_doc_size(events)
+
+    for selection_name, _ in get_selections(dataset):
+        print(
+            "{:<16} {:<28} replace {:>7,d} bytes, delta {:>7,d} bytes".format(
+                name,
+                selection_name,
+                sizes[(selection_name, "replace")],
+                sizes[(selection_name, "delta")],
+            )
+        )
+
+
+if __name__ == "__main__":
+
+    for test_dir in [CONST_TEST_DIR_5, CONST_TEST_DIR_8]:
+        run_case(
+            test_dir,
+            load_dataset(os.path.join(CONST_TEST_DIR_DATA_LOADER, test_dir)),
+        )
@@ -0,0 +1,197 @@
+"""
+A script to benchmark the top services of the dashboard: the previous
+    grouping on concatenated Service labels with a full sort vs the grouping
+    on integer codes of the service columns with partial selection.
+
+Both are run for all four top services groupings on a synthetic usage
+    dataframe (object and categorical columns) and their results are checked
+    to be the same.
+
+Usage:
+    python utils/bench_top_services.py -r 1000000
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "azure_usage"))
+
+from src_webapp.subs import get_top_services  # noqa: E402
+from src_webapp.data_loader import compact_dataframe  # noqa: E402
+from src_webapp.constants import (  # noqa: E402
+    CONST_COL_NAME_COST,
+    CONST_COL_NAME_SERVICE,
+    CONST_COL_NAME_SERVICENAME,
+    CONST_COL_NAME_SERVICETYPE,
+    CONST_COL_NAME_SERVICERESOURCE,
+    CONST_COL_NAME_PERC,
+    CONST_MAX_TOP_SERVICES,
+    CONST_MAX_SERVICE_LENGTH,
+    CONST_NAME_OTHER,
+    CONST_RB_VALUE_0,
+    CONST_RB_VALUE_1,
+    CONST_RB_VALUE_2,
+    CONST_RB_VALUE_3,
+)
+
+
+def setup():
+    """
+    Prepared arguments for the command line
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the top services of the dashboard."
+    )
+    parser.add_argument(
+        "-r",
+        "--rows",
+        help="Number of rows of the synthetic usage",
+        type=int,
+        default=1000000,
+    )
+
+    return parser.parse_args()
+
+
+def create_usage(rows_cnt):
+    """Creates synthetic usage with a realistic number of services"""
+
+    rng = np.random.default_rng(0)
+
+    names = np.array(["Service name %d" % i for i in range(30)], dtype=object)
+    types = np.array(["Service type %d" % i for i in range(300)], dtype=object)
+    resources = np.array(
+        ["Service resource %d" % i for i in range(500)], dtype=object
+    )
+
+    return pd.DataFrame(
+        {
+            CONST_COL_NAME_SERVICENAME: names[
+                rng.integers(0, len(names), rows_cnt)
+            ],
+            CONST_COL_NAME_SERVICETYPE: types[
+                rng.integers(0, len(types), rows_cnt)
+            ],
+            CONST_COL_NAME_SERVICERESOURCE: resources[
+                rng.integers(0, len(resources), rows_cnt)
+            ],
+            CONST_COL_NAME_COST: rng.exponential(1.0, rows_cnt),
+        }
+    )
+
+
+def get_top_services_previous(raw_data_df, top_services_grp_md):
+    """The previous top services: labels per row, grouping, full sort"""
+
+    top_services_cnt = CONST_MAX_TOP_SERVICES
+
+    grp_srv = copy.copy(raw_data_df)
+
+    if top_services_grp_md == CONST_RB_VALUE_1:
+        grp_srv[CONST_COL_NAME_SERVICE] = (
+            grp_srv[CONST_COL_NAME_SERVICENAME].astype(object)
+            + ": "
+            + grp_srv[CONST_COL_NAME_SERVICETYPE].astype(object)
+            + ": "
+            + grp_srv[CONST_COL_NAME_SERVICERESOURCE].astype(object)
+        )
+    elif top_services_grp_md == CONST_RB_VALUE_2:
+        grp_srv[CONST_COL_NAME_SERVICE] = (
+            grp_srv[CONST_COL_NAME_SERVICENAME].astype(object)
+            + ": "
+            + grp_srv[CONST_COL_NAME_SERVICETYPE].astype(object)
+        )
+    elif top_services_grp_md == CONST_RB_VALUE_3:
+        grp_srv[CONST_COL_NAME_SERVICE] = (
+            grp_srv[CONST_COL_NAME_SERVICENAME].astype(object)
+            + ": "
+            + grp_srv[CONST_COL_NAME_SERVICERESOURCE].astype(object)
+        )
+    else:
+        grp_srv[CONST_COL_NAME_SERVICE] = grp_srv[CONST_COL_NAME_SERVICETYPE]
+
+    grp_srv = (
+        grp_srv.groupby([CONST_COL_NAME_SERVICE], observed=True)[
+            CONST_COL_NAME_COST
+        ]
+        .agg("sum")
+        .reset_index()
+    )
+
+    grp_srv[CONST_COL_NAME_SERVICE] = grp_srv[CONST_COL_NAME_SERVICE].str[
+        :CONST_MAX_SERVICE_LENGTH
+    ]
+
+    grp_srv = grp_srv.sort_values(CONST_COL_NAME_COST, ascending=False)
+    grp_srv.reset_index(inplace=True, drop=True)
+
+    top_srv = grp_srv.iloc[:top_services_cnt]
+
+    other_temp_df = grp_srv.iloc[top_services_cnt:]
+    other_df = pd.DataFrame(
+        [
+            [
+                CONST_NAME_OTHER + " (%d)" % (len(other_temp_df)),
+                other_temp_df[CONST_COL_NAME_COST].agg("sum"),
+            ]
+        ],
+        columns=[CONST_COL_NAME_SERVICE, CONST_COL_NAME_COST],
+    )
+
+    top_srv = pd.concat([top_srv, other_df])
+    top_srv = top_srv.sort_values(CONST_COL_NAME_COST, ascending=False)
+
+    top_srv = top_srv.copy()
+    top_srv[CONST_COL_NAME_PERC] = (
+        top_srv[CONST_COL_NAME_COST] / top_srv[CONST_COL_NAME_COST].sum()
+    )
+
+    return top_srv
+
+
+def run_case(name, usage, grp_md):
+    """Benchmarks the previous and the current top services"""
+
+    time_st = time.perf_counter()
+    previous = get_top_services_previous(usage, grp_md)
+    previous_time = time.perf_counter() - time_st
+
+    time_st = time.perf_counter()
+    current = get_top_services(usage, top_services_grp_md=grp_md)
+    current_time = time.perf_counter() - time_st
+
+    pd.testing.assert_frame_equal(previous, current)
+
+    print(
+        "{:<20} mode {} previous {:.3f}s, current {:.3f}s ({:.1f}x)".format(
+            name,
+            grp_md,
+            previous_time,
+            current_time,
+            previous_time / current_time,
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    args = setup()
+
+    usage = create_usage(args.rows)
+    compact_usage = compact_dataframe(usage)
+
+    for grp_md in [
+        CONST_RB_VALUE_0,
+        CONST_RB_VALUE_1,
+        CONST_RB_VALUE_2,
+        CONST_RB_VALUE_3,
+    ]:
+        run_case("object columns", usage, grp_md)
+        run_case("categorical columns", compact_usage, grp_md)
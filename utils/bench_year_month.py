@@ -0,0 +1,154 @@
+"""
+A script to benchmark grouping usage by calender month: the previous per-row
+    Year-Month labels vs the vectorised month keys with labels formatted for
+    the grouped rows only.
+
+Both groupings are run on a synthetic usage dataframe and their results are
+    checked to be the same.
+
+Usage:
+    python utils/bench_year_month.py -r 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "azure_usage"))
+
+from src_webapp.totals import (  # noqa: E402
+    group_year_month,
+    group_sub_year_month,
+)
+from src_webapp.constants import (  # noqa: E402
+    CONST_COL_NAME_COST,
+    CONST_COL_NAME_DATE,
+    CONST_COL_NAME_SGUID,
+    CONST_COL_NAME_YM,
+)
+
+
+def setup():
+    """
+    Prepared arguments for the command line
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark grouping usage by calender month."
+    )
+    parser.add_argument(
+        "-r",
+        "--rows",
+        help="Number of rows of the synthetic usage",
+        type=int,
+        default=1000000,
+    )
+    parser.add_argument(
+        "-s",
+        "--subs",
+        help="Number of subscriptions of the synthetic usage",
+        type=int,
+        default=200,
+    )
+
+    return parser.parse_args()
+
+
+def create_usage(rows_cnt, subs_cnt):
+    """Creates synthetic usage over five years"""
+
+    rng = np.random.default_rng(0)
+
+    return pd.DataFrame(
+        {
+            CONST_COL_NAME_SGUID: pd.Categorical(
+                rng.integers(0, subs_cnt, rows_cnt).astype(str)
+            ),
+            CONST_COL_NAME_DATE: pd.Timestamp("2016-01-01")
+            + pd.to_timedelta(rng.integers(0, 5 * 365, rows_cnt), unit="D"),
+            CONST_COL_NAME_COST: rng.random(rows_cnt),
+        }
+    )
+
+
+def add_labels(raw_data):
+    """The previous Year-Month labels, formatted row by row"""
+
+    raw_data_ = raw_data.copy()
+    raw_data_[CONST_COL_NAME_YM] = pd.to_datetime(
+        raw_data_[CONST_COL_NAME_DATE]
+    ).apply(lambda x: "{year}-{month:02d}".format(year=x.year, month=x.month))
+
+    return raw_data_
+
+
+def group_year_month_rows(raw_data):
+    """The previous group_year_month"""
+
+    return (
+        add_labels(raw_data)
+        .groupby([CONST_COL_NAME_YM])[CONST_COL_NAME_COST]
+        .sum()
+        .reset_index()
+        .sort_values(by=[CONST_COL_NAME_YM], ascending=True)
+    )
+
+
+def group_sub_year_month_rows(raw_data):
+    """The previous group_sub_year_month"""
+
+    return (
+        add_labels(raw_data)
+        .groupby([CONST_COL_NAME_SGUID, CONST_COL_NAME_YM], observed=True)[
+            CONST_COL_NAME_COST
+        ]
+        .sum()
+        .reset_index()
+        .sort_values(by=[CONST_COL_NAME_YM], ascending=True)
+    )
+
+
+def run_case(name, previous, current, usage):
+    """Benchmarks the previous and the current grouping"""
+
+    results = []
+
+    for grouping in [previous, current]:
+        time_st = time.perf_counter()
+        grouped = grouping(usage)
+        results.append((time.perf_counter() - time_st, grouped))
+
+    pd.testing.assert_frame_equal(results[0][1], results[1][1])
+
+    print(
+        "{:<22} previous {:.3f}s, vectorised {:.3f}s ({:.1f}x)".format(
+            name,
+            results[0][0],
+            results[1][0],
+            results[0][0] / results[1][0],
+        )
+    )
+
+
+if __name__ == "__main__":
+
+    args = setup()
+
+    usage = create_usage(args.rows, args.subs)
+
+    run_case(
+        "group_year_month",
+        group_year_month_rows,
+        group_year_month,
+        usage,
+    )
+    run_case(
+        "group_sub_year_month",
+        group_sub_year_month_rows,
+        group_sub_year_month,
+        usage,
+    )
@@ -9,8 +9,13 @@ import os
 from pandas import Timestamp
 import pytz
 
-from src_webapp.data_loader import create_dataframe
-from src_webapp.constants import TIMESTAMP_FILE, DEFAULT_TIMEZONE
+from src_webapp.data_loader import create_dataframe, write_usage_store
+from src_webapp.ingest_cache import clear_cache
+from src_webapp.constants import (
+    TIMESTAMP_FILE,
+    DEFAULT_TIMEZONE,
+    USAGE_STORE_FOLDER,
+)
 
 sys.path.append("./azure_usage/")
 
@@ -31,6 +36,31 @@ def setup():
     parser.add_argument(
         "-o", "--output", help="Path to the output directory", required=True
     )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        help="Path to the ingest cache directory (parsed files are reused)",
+        default=None,
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format: a single csv file or a columnar (parquet) store",
+        choices=["csv", "parquet"],
+        default="csv",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of processes used to read in the input files",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--clear-cache",
+        help="Invalidates the ingest cache before reading the input files",
+        action="store_true",
+    )
 
     args = parser.parse_args()
 
@@ -48,22 +78,37 @@ if __name__ == "__main__":
     if not os.path.isdir(args.output):
         raise Exception(args.output + " cannot be accessed.")
 
-    raw_usage = create_dataframe(args.input)
+    if args.clear_cache:
+        if args.cache is None:
+            raise Exception("--clear-cache requires --cache to be set.")
 
-    dt_st = raw_usage["Date"].min()
-    dt_end = raw_usage["Date"].max()
+        print("Removed {} cached files.".format(clear_cache(args.cache)))
 
-    output_file_name = "{year_end}-{month_end:02d}-{day_end:02d}".format(
-        year_end=dt_end.year, month_end=dt_end.month, day_end=dt_end.day
-    )
-    output_file_name = "{}-{year_st}-{month_st:02d}-{day_st:02d}.csv".format(
-        output_file_name,
-        year_st=dt_st.year,
-        month_st=dt_st.month,
-        day_st=dt_st.day,
+    raw_usage = create_dataframe(
+        args.input, cache_dir=args.cache, workers=args.workers
     )
 
-    raw_usage.to_csv(os.path.join(args.output, output_file_name))
+    if args.format == "parquet":
+        write_usage_store(
+            raw_usage, os.path.join(args.output, USAGE_STORE_FOLDER)
+        )
+    else:
+        dt_st = raw_usage["Date"].min()
+        dt_end = raw_usage["Date"].max()
+
+        output_file_name = "{year_end}-{month_end:02d}-{day_end:02d}".format(
+            year_end=dt_end.year, month_end=dt_end.month, day_end=dt_end.day
+        )
+        output_file_name = (
+            "{}-{year_st}-{month_st:02d}-{day_st:02d}.csv".format(
+                output_file_name,
+                year_st=dt_st.year,
+                month_st=dt_st.month,
+                day_st=dt_st.day,
+            )
+        )
+
+        raw_usage.to_csv(os.path.join(args.output, output_file_name))
 
     # creating a time stamp when data was prepared
     timestamp_f = open(os.path.join(args.output, TIMESTAMP_FILE), "w")